@@ -0,0 +1,146 @@
+import argparse
+import threading
+import time
+import numpy as np
+from config import *
+from hand_tracker import HandTracker, create_hands_model
+from inference import InferenceServer, RemoteHandTracker
+from sources import create_source
+
+
+class TrackerRun:
+    def __init__(self, name, tracker):
+        self.name = name
+        self.tracker = tracker
+        self.latencies = []
+        self.cpu_time = 0.0
+        self.detected = 0
+
+    def step(self, frame):
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        self.tracker.find_hands(frame, draw=False)
+        self.latencies.append(time.perf_counter() - start)
+        self.cpu_time += time.process_time() - cpu_start
+        self.detected += len(self.tracker.landmarks) > 0
+
+    def report(self):
+        latencies = np.array(self.latencies) * 1000
+        wall = latencies.sum() / 1000
+        return (
+            f"{self.name:>10}: mean {latencies.mean():7.2f} ms, "
+            f"p95 {np.percentile(latencies, 95):7.2f} ms, "
+            f"cpu {self.cpu_time / len(self.latencies) * 1000:7.2f} ms/frame "
+            f"({100 * self.cpu_time / wall:5.1f}% of a core), "
+            f"hand in {self.detected}/{len(self.latencies)} frames"
+        )
+
+
+def benchmark_roi(source, max_frames):
+    frames_source = create_source(source)
+
+    # both trackers see exactly the same frames, one after the other
+    runs = [
+        TrackerRun("full", HandTracker(roi_tracking=False)),
+        TrackerRun("roi", HandTracker(roi_tracking=True)),
+    ]
+    frames = 0
+    while frames < max_frames:
+        success, frame = frames_source.read()
+        if not success:
+            break
+        for run in runs:
+            run.step(frame)
+        frames += 1
+    frames_source.release()
+
+    if frames == 0:
+        print(f"No frames read from {source}")
+        return
+
+    height, width = frame.shape[:2]
+    print(f"find_hands over {frames} frames at {width}x{height}")
+    for run in runs:
+        print(run.report())
+
+    full, roi = (np.mean(run.latencies) for run in runs)
+    print(f"ROI tracking speedup: {full / roi:.2f}x")
+
+
+def load_frames(source, max_frames):
+    # read up front, so every session replays the same frames from memory
+    # and capture is not part of the measurement
+    frames_source = create_source(source)
+    frames = []
+    while len(frames) < max_frames:
+        success, frame = frames_source.read()
+        if not success:
+            break
+        frames.append(frame.copy())
+    frames_source.release()
+    return frames
+
+
+def benchmark_inference(source, max_frames, worker_counts, sessions, model_factory=create_hands_model):
+    # aggregate find_hands throughput of several sessions on one machine,
+    # with mediapipe in-process (0 workers, every session shares the GIL)
+    # and in 1, 2, ... inference worker processes
+    frames = load_frames(source, max_frames)
+    if not frames:
+        print(f"No frames read from {source}")
+        return
+
+    height, width = frames[0].shape[:2]
+    print(f"{sessions} sessions x {len(frames)} frames at {width}x{height}")
+    baseline = None
+    for workers in worker_counts:
+        server = InferenceServer(workers, model_factory) if workers else None
+        trackers = [RemoteHandTracker(server) if server else HandTracker() for _ in range(sessions)]
+        # worker start-up and model loading are not part of the timings
+        for tracker in trackers:
+            tracker.find_hands(frames[0], draw=False)
+
+        latencies = [[] for _ in trackers]
+
+        def run(tracker, latencies):
+            for frame in frames:
+                start = time.perf_counter()
+                tracker.find_hands(frame, draw=False)
+                latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=run, args=args) for args in zip(trackers, latencies)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if server:
+            server.close()
+
+        fps = sessions * len(frames) / elapsed
+        baseline = baseline or fps
+        latencies = np.concatenate(latencies) * 1000
+        print(
+            f"{workers:>3} workers: {fps:8.1f} frames/s total, "
+            f"latency mean {latencies.mean():7.2f} ms, p95 {np.percentile(latencies, 95):7.2f} ms, "
+            f"{fps / baseline:5.2f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AirCanvas benchmarks")
+    parser.add_argument("source", nargs="?", default="0", help="camera index, video file, image directory or pattern, or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--workers", type=int, nargs="+", help="benchmark the inference server with these worker counts instead, 0 is in-process")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions for --workers")
+    args = parser.parse_args()
+
+    if args.workers:
+        benchmark_inference(args.source, args.frames, args.workers, args.sessions)
+    else:
+        benchmark_roi(args.source, args.frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import asyncio
+import threading
+import time
+import zlib
+import cv2
+import numpy as np
+from config import *
+from logging_utils import get_logger
+
+logger = get_logger("broadcast")
+
+MAGIC = b"ACBC"
+KEYFRAME, DELTA = 0, 1
+# every message is this header, the (ty, tx) index of each tile in it and the
+# zlib compressed pixels of those tiles: all their colour, then all their
+# inverse alpha, row by row
+MESSAGE_HEADER = np.dtype([
+    ("magic", "S4"),
+    ("kind", "u1"),
+    ("seq", "<u4"),
+    ("timestamp", "<f8"),  # time.time() of the newest change in the message
+    ("width", "<u2"),
+    ("height", "<u2"),
+    ("tile_size", "<u2"),
+    ("tiles", "<u4"),
+    ("size", "<u4"),
+])
+TILE_INDEX = np.dtype("<u2")
+# viewers answer every message with its seq, so the server knows how many
+# are still in flight to each of them
+ACK = np.dtype("<u4")
+
+
+class CanvasMirror:
+    # the flattened layers of a canvas as the premultiplied colour and inverse
+    # alpha the Compositor blends with, cut into its tiles. Wraps the
+    # compositor's own buffers on the sending side, and is rebuilt from
+    # messages by viewers.
+    def __init__(self, width, height, tile_size, colour=None, inverse_alpha=None):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        shape = (height, width, 3)
+        self.colour = np.zeros(shape, dtype=np.uint8) if colour is None else colour
+        self.inverse_alpha = np.full(shape, 255, dtype=np.uint8) if inverse_alpha is None else inverse_alpha
+        self.tiles_shape = (-(-height // tile_size), -(-width // tile_size))
+
+    def regions(self, tiles):
+        ts = self.tile_size
+        return [
+            np.s_[ty * ts:min((ty + 1) * ts, self.height), tx * ts:min((tx + 1) * ts, self.width)]
+            for ty, tx in tiles.tolist()
+        ]
+
+    def pack(self, tiles):
+        # a copy of the tiles' pixels, safe to hand to another thread
+        regions = self.regions(tiles)
+        return b"".join(
+            np.ascontiguousarray(buffer[region]).tobytes()
+            for buffer in (self.colour, self.inverse_alpha)
+            for region in regions
+        )
+
+    def unpack(self, tiles, raw):
+        offset = 0
+        regions = self.regions(tiles)
+        for buffer in (self.colour, self.inverse_alpha):
+            for region in regions:
+                target = buffer[region]
+                target[:] = np.frombuffer(raw, np.uint8, target.size, offset).reshape(target.shape)
+                offset += target.size
+        if offset != len(raw):
+            raise ValueError(f"Tile data is {len(raw)} bytes, expected {offset}")
+
+    def image(self, background=None):
+        # the canvas over a BGR background, or over black
+        if background is None:
+            return self.colour.copy()
+        image = cv2.multiply(background, self.inverse_alpha, scale=1 / 255)
+        return cv2.add(image, self.colour, dst=image)
+
+
+def encode_message(kind, seq, timestamp, mirror, tiles, compressed):
+    header = np.zeros((), dtype=MESSAGE_HEADER)
+    header["magic"] = MAGIC
+    header["kind"] = kind
+    header["seq"] = seq
+    header["timestamp"] = timestamp
+    header["width"] = mirror.width
+    header["height"] = mirror.height
+    header["tile_size"] = mirror.tile_size
+    header["tiles"] = len(tiles)
+    header["size"] = len(compressed)
+    return header.tobytes() + tiles.astype(TILE_INDEX).tobytes() + compressed
+
+
+async def read_message(reader):
+    # (header, tiles, raw tile pixels) of the next message, raises
+    # asyncio.IncompleteReadError when the stream ends
+    header = np.frombuffer(await reader.readexactly(MESSAGE_HEADER.itemsize), MESSAGE_HEADER)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError("Not an AirCanvas broadcast")
+    index = await reader.readexactly(int(header["tiles"]) * 2 * TILE_INDEX.itemsize)
+    tiles = np.frombuffer(index, TILE_INDEX).reshape(-1, 2).astype(np.intp)
+    raw = zlib.decompress(await reader.readexactly(int(header["size"])))
+    return header, tiles, raw
+
+
+class Connection:
+    # the sending side of one viewer. Changes are only marked in dirty and the
+    # tiles are read from the server's mirror when the viewer has fewer than
+    # the window of messages unacknowledged, so a slow viewer gets one delta
+    # covering everything it missed instead of a queue of stale ones.
+    def __init__(self, writer, tiles_shape):
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.dirty = np.ones(tiles_shape, dtype=bool)
+        self.keyframe = True
+        self.in_flight = 0
+        self.closed = False
+        self.wake = asyncio.Event()
+        self.wake.set()
+        self.messages = 0
+        self.bytes = 0
+        self.coalesced = 0
+
+
+class BroadcastServer:
+    # streams a dense canvas to viewers (src/viewer.py) from an asyncio loop
+    # on its own thread. The render loop calls tick() after compositing, which
+    # copies just the tiles the compositor re-composited; compressing and
+    # sending happen on the loop and its executor.
+    def __init__(self, compositor, host=BROADCAST_HOST, port=BROADCAST_PORT, rate=BROADCAST_RATE,
+                 compression=BROADCAST_COMPRESSION, window=BROADCAST_WINDOW):
+        canvas = compositor.canvas
+        if canvas.tiled:
+            raise ValueError("Broadcasting needs the dense canvas backend")
+        self.compositor = compositor
+        self.source = CanvasMirror(
+            canvas.width, canvas.height, compositor.tile_size, compositor.colour, compositor.inverse_alpha
+        )
+        # only touched on the loop thread
+        self.mirror = CanvasMirror(canvas.width, canvas.height, compositor.tile_size)
+        self.interval = 1 / rate if rate else 0.0
+        self.compression = compression
+        self.window = window
+        self.last_tick = None
+        self.seq = 0
+        self.published = 0  # seq of the newest change the loop has applied
+        self.published_at = time.time()
+        self.viewers = set()
+        self.tasks = set()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="broadcast", daemon=True)
+        self.thread.start()
+        try:
+            self.server = asyncio.run_coroutine_threadsafe(
+                asyncio.start_server(self._serve, host, port), self.loop
+            ).result()
+        except OSError:
+            self._stop_loop()
+            raise
+        self.address = self.server.sockets[0].getsockname()[:2]
+        logger.info("Broadcasting on %s:%d", *self.address)
+
+    def tick(self, now=None):
+        # called once per frame, after the compositor. Changes pile up in the
+        # compositor between ticks at most rate times a second.
+        now = time.perf_counter() if now is None else now
+        if self.last_tick is not None and now - self.last_tick < self.interval:
+            return False
+        changed = self.compositor.changed_tiles
+        if not changed.any():
+            return False
+        self.last_tick = now
+        tiles = np.argwhere(changed)
+        changed[:] = False
+        self.seq += 1
+        self.loop.call_soon_threadsafe(self._publish, self.seq, time.time(), tiles, self.source.pack(tiles))
+        return True
+
+    def _publish(self, seq, timestamp, tiles, raw):
+        self.mirror.unpack(tiles, raw)
+        self.published = seq
+        self.published_at = timestamp
+        ty, tx = tiles.T
+        for viewer in self.viewers:
+            if viewer.in_flight >= self.window:
+                # it is behind, this change goes out with the next one
+                viewer.coalesced += 1
+            viewer.dirty[ty, tx] = True
+            viewer.wake.set()
+
+    async def _read_acks(self, reader, viewer):
+        try:
+            while True:
+                await reader.readexactly(ACK.itemsize)
+                viewer.in_flight -= 1
+                viewer.wake.set()
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        viewer.closed = True
+        viewer.wake.set()
+
+    async def _serve(self, reader, writer):
+        self.tasks.add(asyncio.current_task())
+        viewer = Connection(writer, self.mirror.tiles_shape)
+        self.viewers.add(viewer)
+        acks = asyncio.create_task(self._read_acks(reader, viewer))
+        logger.info("Viewer %s joined", viewer.address)
+        try:
+            while True:
+                await viewer.wake.wait()
+                viewer.wake.clear()
+                if viewer.closed:
+                    break
+                if viewer.in_flight >= self.window or not viewer.dirty.any():
+                    continue
+                tiles = np.argwhere(viewer.dirty)
+                viewer.dirty[:] = False
+                kind = KEYFRAME if viewer.keyframe else DELTA
+                viewer.keyframe = False
+                seq, timestamp = self.published, self.published_at
+                # the copy is taken here, zlib runs off the loop
+                compressed = await self.loop.run_in_executor(
+                    None, zlib.compress, self.mirror.pack(tiles), self.compression
+                )
+                message = encode_message(kind, seq, timestamp, self.mirror, tiles, compressed)
+                viewer.in_flight += 1
+                viewer.messages += 1
+                viewer.bytes += len(message)
+                writer.write(message)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.viewers.discard(viewer)
+            writer.close()
+            await acks
+            self.tasks.discard(asyncio.current_task())
+            logger.info(
+                "Viewer %s left after %d messages, %.1f kB, %d changes coalesced",
+                viewer.address, viewer.messages, viewer.bytes / 1024, viewer.coalesced,
+            )
+
+    async def _shutdown(self):
+        self.server.close()
+        # closing a viewer ends its ack reader, which ends _serve
+        for viewer in list(self.viewers):
+            viewer.writer.close()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout=5)
+        self._stop_loop()
+
+    def _stop_loop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
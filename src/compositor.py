@@ -0,0 +1,175 @@
+import cv2
+import numpy as np
+from layers import flatten, from_premultiplied, over, to_premultiplied
+from strokes import curve_bounds, render_stroke
+
+
+def ink_mask(image, out=None):
+    # non-zero wherever any channel has ink, as a uint8 mask for cv2.copyTo
+    b, g, r = cv2.split(image)
+    cv2.bitwise_or(b, g, dst=b)
+    return cv2.bitwise_or(b, r, dst=out)
+
+
+class Compositor:
+    # overlays the drawing canvas on the camera frame, only re-scanning the
+    # canvas inside tiles that were touched since the last frame.
+    #
+    # The layers of a dense canvas are kept flattened as a premultiplied
+    # colour and inverse alpha, so a frame is frame * inverse + colour
+    # whatever the layers, opacities and blend modes. The layers under and
+    # over the active one are cached flattened too and only rebuilt when one
+    # of them changes, drawing just re-composites the touched tiles from the
+    # two caches and the active layer.
+    def __init__(self, canvas, tile_size=64):
+        self.canvas = canvas
+        self.tile_size = tile_size
+        tiles_y = -(-canvas.height // tile_size)
+        tiles_x = -(-canvas.width // tile_size)
+        self.tile_ink = np.zeros((tiles_y, tiles_x), dtype=bool)
+        # tiles re-composited since whoever streams them last cleared this
+        self.changed_tiles = np.zeros((tiles_y, tiles_x), dtype=bool)
+        self.ink_box = None
+        self.ink_rects = []
+        # previews are drawn into the front of these, grown as needed
+        self.scratch = np.empty(0, dtype=np.uint8)
+        self.scratch_mask = np.empty(0, dtype=np.uint8)
+
+        if not canvas.tiled:
+            shape = (canvas.height, canvas.width, 3)
+            self.colour = np.zeros(shape, dtype=np.uint8)
+            self.inverse_alpha = np.full(shape, 255, dtype=np.uint8)
+            # (colour, inverse alpha) of the layers under and over the active
+            # one, None when there are none
+            self.below = self.above = None
+            # the empty buffers already are a lone layer's composite, so the
+            # first frame does not re-composite the whole canvas for nothing.
+            # Ink drawn before this is still in dirty_rects.
+            self.layers_version = canvas.layers_version if len(canvas.layers) == 1 else None
+
+    def _cache_layers(self):
+        canvas = self.canvas
+        states = [layer.state() for layer in canvas.layers]
+        below = flatten(states[:canvas.active_layer])
+        above = flatten(states[canvas.active_layer + 1:])
+        self.below = None if below is None else to_premultiplied(below)
+        self.above = None if above is None else to_premultiplied(above)
+        self.layers_version = canvas.layers_version
+        canvas.dirty_rects = [(0, 0, canvas.width, canvas.height)]
+
+    def _composite(self, region):
+        # the whole stack over a region, from the caches and the active layer
+        stack = flatten([self.canvas.layer.state()], region, from_premultiplied(self.below, region))
+        stack = over(stack, from_premultiplied(self.above, region))
+        if stack is None:
+            self.colour[region] = 0
+            self.inverse_alpha[region] = 255
+        else:
+            self.colour[region], self.inverse_alpha[region] = to_premultiplied(stack)
+
+    def update(self):
+        if not self.canvas.tiled and self.canvas.layers_version != self.layers_version:
+            self._cache_layers()
+        if not self.canvas.dirty_rects:
+            return
+
+        ts = self.tile_size
+        for x0, y0, x1, y1 in self.canvas.dirty_rects:
+            # snap to the tile grid so tile_ink stays exact
+            tx0, ty0 = x0 // ts, y0 // ts
+            tx1, ty1 = -(-x1 // ts), -(-y1 // ts)
+            px0, py0 = tx0 * ts, ty0 * ts
+            px1, py1 = min(tx1 * ts, self.canvas.width), min(ty1 * ts, self.canvas.height)
+
+            # pixels the stack changes: any colour, or anything less than
+            # fully see-through
+            region = np.s_[py0:py1, px0:px1]
+            self._composite(region)
+            self.changed_tiles[ty0:ty1, tx0:tx1] = True
+            mask = self.canvas.mask[region]
+            ink_mask(self.colour[region], out=mask)
+            cv2.bitwise_or(mask, ink_mask(cv2.bitwise_not(self.inverse_alpha[region])), dst=mask)
+
+            rows = np.logical_or.reduceat(mask, np.arange(0, mask.shape[0], ts), axis=0)
+            self.tile_ink[ty0:ty1, tx0:tx1] = np.logical_or.reduceat(
+                rows, np.arange(0, mask.shape[1], ts), axis=1
+            )
+        self.canvas.dirty_rects.clear()
+
+        ink_rows = np.flatnonzero(self.tile_ink.any(axis=1))
+        ink_cols = np.flatnonzero(self.tile_ink.any(axis=0))
+        if ink_rows.size == 0:
+            self.ink_box = None
+        else:
+            self.ink_box = (
+                int(ink_cols[0]) * ts,
+                int(ink_rows[0]) * ts,
+                min((int(ink_cols[-1]) + 1) * ts, self.canvas.width),
+                min((int(ink_rows[-1]) + 1) * ts, self.canvas.height),
+            )
+        self.ink_rects = self._ink_rects()
+
+    def _ink_rects(self):
+        # the inked tiles as few rectangles: runs of inked tiles along each
+        # row, merged with the same run in the rows below
+        ts = self.tile_size
+        rects = []
+        open_runs = {}
+        for ty, row in enumerate(self.tile_ink):
+            edges = np.flatnonzero(np.diff(np.concatenate(([False], row, [False])).astype(np.int8)))
+            runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+            for run in list(open_runs):
+                if run not in runs:
+                    rects.append((run, open_runs.pop(run), ty))
+            for run in runs:
+                open_runs.setdefault(run, ty)
+        rects.extend((run, start, len(self.tile_ink)) for run, start in open_runs.items())
+        return [
+            (tx0 * ts, ty0 * ts, min(tx1 * ts, self.canvas.width), min(ty1 * ts, self.canvas.height))
+            for (tx0, tx1), ty0, ty1 in rects
+        ]
+
+    def blend(self, frame):
+        if self.canvas.tiled:
+            # tiles keep their own ink masks, only visible ones are blended
+            frame = self.canvas.composite(frame)
+        else:
+            frame = self.blend_canvas(frame)
+        self.blend_previews(frame)
+        return frame
+
+    def blend_previews(self, frame):
+        # shapes being dragged are rendered into a scratch layer covering
+        # just their bounding box and copied over the frame, so a preview
+        # costs its own area and the canvas is only touched on commit
+        height, width = frame.shape[:2]
+        for stroke in self.canvas.previews():
+            x0, y0, x1, y1 = curve_bounds(stroke.points, stroke.thickness)
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, width), min(y1, height)
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            size = (y1 - y0) * (x1 - x0)
+            if len(self.scratch_mask) < size:
+                self.scratch = np.empty(3 * size, dtype=np.uint8)
+                self.scratch_mask = np.empty(size, dtype=np.uint8)
+            layer = self.scratch[:3 * size].reshape(y1 - y0, x1 - x0, 3)
+            layer[:] = 0
+            render_stroke(layer, stroke, (x0, y0))
+            mask = ink_mask(layer, out=self.scratch_mask[:size].reshape(y1 - y0, x1 - x0))
+            cv2.copyTo(layer, mask, frame[y0:y1, x0:x1])
+
+    def blend_canvas(self, frame):
+        self.update()
+        if self.ink_box is None:
+            return frame
+
+        # the camera frame is fresh every tick, so the layers still have to
+        # be blended in, but only over inked tiles: frame * inverse alpha +
+        # colour in two saturating uint8 passes
+        for x0, y0, x1, y1 in self.ink_rects:
+            target = frame[y0:y1, x0:x1]
+            cv2.multiply(target, self.inverse_alpha[y0:y1, x0:x1], dst=target, scale=1 / 255)
+            cv2.add(target, self.colour[y0:y1, x0:x1], dst=target)
+        return frame
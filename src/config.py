@@ -1,10 +1,161 @@
 # Camera Settings
+CAMERA_INDEX = 0
 CAMERA_WIDTH = 1920
 CAMERA_HEIGHT = 1080
 CAMERA_FPS = 30
 FLIP_CAMERA = True
+CAMERA_API = None  # OpenCV capture backend, e.g. "v4l2", "dshow", "msmf", "avfoundation", None picks one
+CAMERA_FOURCC = "MJPG"  # most webcams only reach full resolution at full frame rate as MJPEG, None keeps the default
+CAMERA_THREADED = True  # grab on a background thread that keeps only the newest frame
+# frames are written into this many reused buffers, it has to be more than
+# the frames in flight in the pipeline (2 queues + one per stage)
+FRAME_BUFFERS = 8
+
+# Capture, hand tracking and gestures run at this resolution while the canvas
+# and window stay at CAMERA_WIDTH x CAMERA_HEIGHT, e.g. 640 x 360 to save CPU.
+# None processes at whatever resolution the camera delivers.
+PROCESSING_WIDTH = None
+PROCESSING_HEIGHT = None
 
 # Hand Tracking Settings
-MAX_HANDS = 1
+MAX_HANDS = 2  # every hand gets its own gesture state, tool, colour and stroke
 MIN_DETECTION_CONFIDENCE = 0.7
-MIN_TRACKING_CONFIDENCE = 0.7
\ No newline at end of file
+MIN_TRACKING_CONFIDENCE = 0.7
+ROI_TRACKING = True  # run inference on a crop around the last detected hand
+ROI_PADDING = 0.5  # padding on each side, as a fraction of the hand box size
+ROI_MAX_SIZE = 480  # crops larger than this (px) are downscaled
+SEARCH_SCALE = 0.5  # frame scale used to search for a lost hand
+HAND_SEARCH_INTERVAL = 15  # frames between full frame searches for more hands while fewer than MAX_HANDS are tracked
+# hands keep their id across frames when the palm moved less than this,
+# as a fraction of the frame size, and for this long (s) after they are lost
+HAND_MATCH_DISTANCE = 0.15
+HAND_LOST_TIME = 0.5
+# One Euro smoothing of the fingertip, in frame-relative units: min cutoff
+# (Hz) sets jitter removal when still, beta how fast lag drops with speed
+SMOOTHING_MIN_CUTOFF = 1.0
+SMOOTHING_BETA = 10.0
+
+# Inference Server Settings
+INFERENCE_WORKERS = 0  # mediapipe worker processes, 0 runs it in the app's own process
+INFERENCE_SLOTS = 2  # shared memory frame slots per stream, the frames it can have in flight
+INFERENCE_PIN_CPUS = True  # pin each worker process to its own core where the OS allows it
+INFERENCE_TIMEOUT = 5.0  # seconds to wait for a worker before giving up
+
+# Gesture Settings
+# gesture distances are relative to the hand size (wrist to middle finger
+# base), so they do not depend on the resolution or distance to the camera
+PINCH_THRESHOLD = 0.35  # thumb to index tip distance to start drawing
+PINCH_RELEASE_THRESHOLD = 0.45  # distance they have to open to before drawing stops
+GESTURE_VOTE_WINDOW = 5  # frames
+GESTURE_VOTES_REQUIRED = 3  # frames out of the window needed to switch gesture
+CLEAR_HOLD_TIME = 3.0  # seconds to hold the clear gesture (thumb out, fist)
+
+# Gesture Model Settings
+# when this file exists gestures are classified by the model in it instead
+# of the hand-written rules. 'k' calibrates it to your hands (and creates it
+# if there is none), src/gesture_model.py trains one from labelled traces.
+GESTURE_MODEL = "aircanvas_gestures.npz"
+GESTURE_MODEL_KIND = "centroid"  # "centroid" (nearest centroid) or "linear" (softmax regression)
+GESTURE_CALIBRATION_TRACE = "aircanvas_calibration.npz"  # the labelled landmarks of the last calibration
+GESTURE_CALIBRATION_SECONDS = 3.0  # per gesture
+GESTURE_CALIBRATION_SETTLE = 1.0  # s at the start of each gesture that are not used
+GESTURE_CALIBRATION_WEIGHT = 0.5  # 0-1, how far calibration moves the model towards your samples
+
+# Pipeline Settings
+PIPELINE_MODE = True  # False falls back to the serial capture -> track -> draw loop
+PIPELINE_QUEUE_SIZE = 2
+
+
+# Quality Governor Settings
+# under load the governor steps down through these levels until frames fit
+# the budget again: (run inference every n frames, inference resolution
+# scale, draw the landmark skeleton). Frames between inferences move the
+# hands on at their last velocity.
+GOVERNOR_ENABLED = True
+GOVERNOR_TARGET_FPS = 30
+GOVERNOR_LATENCY_BUDGET = 0.1  # s from capture to display, None only holds the frame rate
+GOVERNOR_LEVELS = [
+    (1, 1.0, True),
+    (1, 1.0, False),
+    (1, 0.75, False),
+    (2, 0.75, False),
+    (2, 0.5, False),
+    (3, 0.5, False),
+]
+GOVERNOR_INTERVAL = 0.5  # s between decisions
+GOVERNOR_HEADROOM = 0.7  # quality only goes back up while the load is below this
+GOVERNOR_UPGRADE_AFTER = 3.0  # s of headroom before it does
+PREDICTION_LIMIT = 0.15  # s hands are moved on without inference before they stop
+
+
+# Canvas Settings, sizes in px at 1080p and scaled to the canvas height
+PEN_THICKNESS = 15
+ERASER_THICKNESS = 125
+CHECKPOINT_INTERVAL = 25  # strokes between raster checkpoints used by undo
+MAX_CHECKPOINTS = 4
+SESSION_FILE = "aircanvas_session.acv"
+# pen strokes get a width per point from how hard the hand "presses":
+# "pinch" is how tightly thumb and index tip are pinched, "depth" how far
+# the index tip is pushed towards the camera past the wrist (mediapipe's z),
+# None keeps every stroke at PEN_THICKNESS
+PEN_PRESSURE = "pinch"
+PEN_PINCH_RANGE = (0.1, 0.35)  # pinch distance (relative to the hand size) at full and no pressure
+PEN_DEPTH_RANGE = (0.0, 0.6)  # tip depth in front of the wrist (relative to the hand size) at no and full pressure
+PEN_WIDTH_RANGE = (0.4, 1.6)  # width at no and full pressure, as a multiple of PEN_THICKNESS
+PEN_PRESSURE_SMOOTHING = 0.3  # 0-1, how fast the width follows the pressure
+# the shape tool turns a freehand stroke into a line, rectangle or ellipse
+# when it is on average this close to one, relative to the shape's size
+SNAP_TOLERANCE = 0.12
+# "dense" keeps frame sized layers, "tiled" stores ink in lazily allocated
+# tiles over an unbounded workspace that can be panned and zoomed, on a
+# single layer
+CANVAS_BACKEND = "dense"
+TILE_SIZE = 256
+
+# Layer Settings
+MAX_LAYERS = 8
+LAYER_OPACITY_STEPS = (1.0, 0.75, 0.5, 0.25)  # 'o' steps the active layer through these
+# 'g' adds a layer for highlighting: translucent and multiplied with what is
+# underneath, so it tints without hiding anything
+HIGHLIGHTER_LAYER = ("highlighter", 0.5, "multiply")
+
+# Export Settings
+# 'x' exports the canvas, 'c' the canvas over the camera frame, as png, webp
+# or npy (raw, fastest to write and load)
+EXPORT_DIR = "exports"
+EXPORT_FORMAT = "png"
+EXPORT_PNG_COMPRESSION = 1  # 0-9, low is faster and bigger
+EXPORT_WEBP_QUALITY = 101  # above 100 is lossless
+EXPORT_WORKERS = 2  # background threads encoding and writing
+AUTOSAVE_PATH = "aircanvas_autosave.png"  # None turns autosave off
+AUTOSAVE_INTERVAL = 30.0  # seconds, skipped while nothing changes
+
+# Broadcast Settings
+# main.py --broadcast streams the canvas to src/viewer.py clients as
+# compressed deltas of the tiles that changed, with a keyframe when a viewer
+# joins. Viewers that fall behind skip intermediate deltas.
+BROADCAST_HOST = "127.0.0.1"  # "0.0.0.0" accepts viewers from other machines
+BROADCAST_PORT = 8765
+BROADCAST_RATE = 30  # most deltas per second
+BROADCAST_COMPRESSION = 1  # zlib level 1-9, low is faster and bigger
+BROADCAST_WINDOW = 2  # messages a viewer may have unacknowledged, later changes for it are coalesced
+
+# Voice Settings
+# "vosk" recognises offline with the model in VOICE_MODEL
+# (https://alphacephei.com/vosk/models), "google" uses the online speech
+# API, None turns voice commands off
+VOICE_BACKEND = "vosk"
+VOICE_MODEL = "models/vosk-model-small-en-us-0.15"
+VOICE_SOURCE = None  # None listens to the microphone, a .wav path plays that file instead
+VOICE_SAMPLE_RATE = 16000
+VOICE_VAD_THRESHOLD = 3.0  # loudness over the background noise that counts as speech
+VOICE_VAD_HANGOVER = 0.3  # seconds of silence that end a command
+
+# Profiling Settings
+PROFILING = True  # per-stage timers, False turns them into no-ops
+PROFILE_WINDOW = 300  # recent samples per stage the rolling percentiles are taken over
+PROFILE_TRACE_EVENTS = 200000  # most recent events kept for --profile-trace
+PROFILE_HUD_INTERVAL = 0.5  # seconds between HUD refreshes, 'h' toggles the HUD
+
+# Logging Settings
+LOG_LEVEL = "INFO"  # DEBUG shows per-frame gesture details, rate limited
@@ -0,0 +1,234 @@
+import time
+import cv2
+import numpy as np
+from config import *
+from gesture import GestureType, pen_pressure
+from drawing import DrawingCanvas, Tools
+from layers import BLEND_MODES
+from tiles import TiledCanvas
+from logging_utils import get_logger
+
+logger = get_logger("controller")
+
+
+def create_canvas(width, height):
+    if CANVAS_BACKEND == "tiled":
+        return TiledCanvas(width, height)
+    return DrawingCanvas(width, height)
+
+
+def track_hands(tracker, frame, draw=True, timestamp=None, infer=True):
+    # find and draw hands, returns the frame and a TrackedHands. infer=False
+    # skips inference and predicts where the hands moved instead.
+    if infer:
+        frame = tracker.find_hands(frame, draw=draw, timestamp=timestamp)
+    else:
+        frame = tracker.predict_hands(frame, draw=draw, timestamp=timestamp)
+    return frame, tracker.get_hands(frame)
+
+
+def scale_to_display(frame, fingers, display_size):
+    # frames and landmarks come in at the processing resolution, the canvas
+    # and UI work at the display resolution. fingers is (hands, 2).
+    height, width = frame.shape[:2]
+    if (width, height) == display_size:
+        return frame, fingers
+
+    frame = cv2.resize(frame, display_size, interpolation=cv2.INTER_LINEAR)
+    scale = np.array(display_size, dtype=np.float64) / (width, height)
+    return frame, (fingers * scale).astype(np.int32)
+
+
+def handle_hands(frame, gestures, hands, fingers, canvas, ui_manager):
+    # fingers are the hands' index finger tips at the display resolution
+    pressures = pen_pressure(hands.landmarks)
+    pressures = [None] * len(hands) if pressures is None else pressures.tolist()
+    for hand_id, gesture, finger, pressure in zip(hands.ids.tolist(), gestures, fingers.tolist(), pressures):
+        handle_gesture(frame, gesture, tuple(finger), canvas, ui_manager, hand_id, pressure)
+
+    # No hand detected, stop drawing. Pens of hands the tracker forgot are
+    # dropped, the others keep their tool and colour for when the hand is back.
+    present = set(hands.ids.tolist())
+    for hand_id in list(canvas.pens):
+        if hand_id not in hands.known:
+            canvas.remove_pen(hand_id)
+        elif hand_id not in present:
+            canvas.stop_drawing(hand_id)
+
+
+def handle_gesture(frame, gesture, index_finger, canvas, ui_manager, hand=0, pressure=None):
+    # Handle drawing actions
+    pen = canvas.pen(hand)
+    if index_finger:
+        if gesture == GestureType.SELECT:
+            # Reset to pen when selecting
+            canvas.set_tool(Tools.PEN, hand)
+
+            # Handle colour selection
+            colour_selected, colour_name = ui_manager.handle_selection(index_finger)
+            if colour_selected:
+                canvas.set_colour(colour_name, hand)
+                logger.debug("Hand %s selected %s", hand, colour_name)
+
+            canvas.stop_drawing(hand)
+
+        elif gesture == GestureType.DRAW:
+            # the pen, or the shape tool picked for drawing. A tool picked
+            # mid-stroke waits for the next stroke, only the eraser is
+            # switched away from straight away.
+            if not pen.drawing or pen.tool == Tools.ERASER:
+                canvas.set_tool(pen.draw_tool, hand)
+
+            if not pen.drawing:
+                canvas.start_drawing(index_finger, hand, pressure)
+            else:
+                canvas.draw(index_finger, hand, pressure)
+
+        elif gesture == GestureType.ERASE:
+            # Switch to eraser tool
+            canvas.set_tool(Tools.ERASER, hand)
+
+            # Draw eraser circle preview around finger
+            cv2.circle(
+                frame,
+                index_finger,
+                canvas.eraser_thickness // 2,  # Radius is half the thickness
+                (255, 0, 0),  # Blue circle
+                2,
+            )  # Line thickness
+
+            if not pen.drawing:
+                canvas.start_drawing(index_finger, hand)
+            else:
+                canvas.draw(index_finger, hand)
+        elif gesture == GestureType.CLEAR:
+            # thumb out fist held for GestureRecogniser.clear_hold_time
+            canvas.clear()
+        else:
+            # Stop drawing for any other gesture
+            canvas.stop_drawing(hand)
+    else:
+        # No hand detected, stop drawing
+        canvas.stop_drawing(hand)
+
+
+def load_session(canvas):
+    try:
+        canvas.load(SESSION_FILE)
+    except (OSError, ValueError) as e:
+        print(f"Could not load {SESSION_FILE}: {e}")
+
+
+def voice_commands(canvas, ui_manager):
+    # dispatch table for voice.VoiceCommand names, handlers take the argument
+    def set_colour(colour_name):
+        canvas.set_colour(colour_name)
+        ui_manager.set_colour(colour_name)
+
+    return {
+        "clear": lambda _: canvas.clear(),
+        "undo": lambda _: canvas.undo(),
+        "redo": lambda _: canvas.redo(),
+        "save": lambda _: canvas.save(SESSION_FILE),
+        "load": lambda _: load_session(canvas),
+        "colour": set_colour,
+        "tool": lambda tool_name: canvas.set_draw_tool(Tools[tool_name]),
+    }
+
+
+def handle_voice(voice, commands, stats=None):
+    # runs whatever the voice thread recognised since the last frame,
+    # returns (should_exit, text of the last command)
+    last_text = None
+    for command in voice.poll():
+        if command.name == "exit":
+            return True, command.text
+        commands[command.name](command.argument)
+        last_text = command.text
+        if stats is not None:
+            # end of speech -> canvas action
+            stats.add("voice", time.perf_counter() - command.spoken_at)
+    return False, last_text
+
+
+# keys that pick what the draw gesture draws
+DRAW_TOOL_KEYS = {
+    ord('p'): Tools.PEN,
+    ord('i'): Tools.LINE,
+    ord('r'): Tools.RECTANGLE,
+    ord('e'): Tools.ELLIPSE,
+    ord('f'): Tools.SNAP,
+}
+
+
+# keys that add, pick and change layers, dense canvas only
+LAYER_KEYS = frozenset(map(ord, "ng[]om"))
+
+
+def handle_layer_key(key, canvas):
+    try:
+        if key == ord('n'):
+            canvas.add_layer()
+        elif key == ord('g'):
+            canvas.add_layer(*HIGHLIGHTER_LAYER)
+        elif key == ord('['):
+            canvas.select_layer(canvas.active_layer - 1)
+        elif key == ord(']'):
+            canvas.select_layer(canvas.active_layer + 1)
+        elif key == ord('o'):
+            # the next opacity step down, wrapping around to the first
+            steps = LAYER_OPACITY_STEPS
+            below = [i for i, opacity in enumerate(steps) if opacity < canvas.layer.opacity - 1e-6]
+            canvas.set_layer(opacity=steps[below[0]] if below else steps[0])
+        elif key == ord('m'):
+            canvas.set_layer(blend=BLEND_MODES[(BLEND_MODES.index(canvas.layer.blend) + 1) % len(BLEND_MODES)])
+    except ValueError as e:
+        print(e)
+        return
+    layer = canvas.layer
+    logger.info(
+        "Layer %d/%d %s: %.0f%% %s", canvas.active_layer + 1, len(canvas.layers), layer.name,
+        100 * layer.opacity, layer.blend,
+    )
+
+
+def handle_key(key, canvas):
+    if key == ord('z'):
+        canvas.undo()
+    elif key == ord('y'):
+        canvas.redo()
+    elif key == ord('s'):
+        canvas.save(SESSION_FILE)
+    elif key == ord('l'):
+        load_session(canvas)
+    elif key in DRAW_TOOL_KEYS:
+        canvas.set_draw_tool(DRAW_TOOL_KEYS[key])
+    elif key in LAYER_KEYS and not canvas.tiled:
+        handle_layer_key(key, canvas)
+    elif canvas.tiled:
+        # pan with the number pad arrows, zoom with + / -
+        step = canvas.width // 8
+        if key == ord('4'):
+            canvas.pan(-step, 0)
+        elif key == ord('6'):
+            canvas.pan(step, 0)
+        elif key == ord('8'):
+            canvas.pan(0, -step)
+        elif key == ord('2'):
+            canvas.pan(0, step)
+        elif key in (ord('+'), ord('=')):
+            canvas.set_zoom(canvas.zoom * 1.25)
+        elif key == ord('-'):
+            canvas.set_zoom(canvas.zoom / 1.25)
+        elif key == ord('0'):
+            canvas.reset_view()
+
+
+def draw_status(ui_manager, gestures, canvas, hands):
+    # one status line per hand, the UI only redraws them when they change
+    layer = "" if canvas.tiled else f", Layer: {canvas.layer.name}"
+    ui_manager.set_status(
+        f"Hand {hand_id} - Gesture: {gesture.value}, Tool: {canvas.pen(hand_id).tool}, "
+        f"Colour: {canvas.pen(hand_id).colour_name}{layer}"
+        for hand_id, gesture in zip(hands.ids.tolist(), gestures)
+    )
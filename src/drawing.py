@@ -1,64 +1,479 @@
+import threading
 import cv2
 import numpy as np
-from enum import Enum
 from colours import Colours
+from compositor import ink_mask
+from config import (
+    CHECKPOINT_INTERVAL,
+    ERASER_THICKNESS,
+    MAX_CHECKPOINTS,
+    MAX_LAYERS,
+    PEN_PRESSURE_SMOOTHING,
+    PEN_THICKNESS,
+    PEN_WIDTH_RANGE,
+    SNAP_TOLERANCE,
+)
+from export import read_image
+from layers import BLEND_MODES, Layer, flatten_image
+from logging_utils import get_logger
+from strokes import (
+    CLEAR,
+    SHAPE_TOOLS,
+    SHAPE_TOOL_VALUES,
+    ClearCommand,
+    CommandLog,
+    Stroke,
+    Tools,
+    curve_bounds,
+    rasterise,
+    rasterise_shape,
+    segment_curve,
+    segment_widths,
+    snap_shape,
+)
 
+logger = get_logger("canvas")
 
-class Tools(Enum):
-    PEN = 1
-    ERASER = 2
+
+class Pen:
+    # drawing state of one hand, every hand has its own tool, colour and
+    # stroke in progress on the shared canvas
+    def __init__(self, colour_name, tool=Tools.PEN, draw_tool=Tools.PEN):
+        self.colour_name = colour_name
+        self.colour = Colours[colour_name]
+        self.tool = tool
+        # what the draw gesture draws with, the pen or a shape tool
+        self.draw_tool = draw_tool
+        self.drawing = False
+        self.start_point = None
+        self.stroke = None
+        # smoothed 0-1 pressure of the stroke being drawn, None for a fixed width
+        self.pressure = None
 
 
 class DrawingCanvas:
+    # canvas backed by a stack of dense layers the size of the frame
+    tiled = False
+
     def __init__(self, width, height):
         self.height = height
         self.width = width
-        self.canvas = np.zeros((self.height, self.width, 3), dtype=np.uint8)
-
-        # Current drawing settings
-        self.current_colour_name = Colours.RED.name
-        self.current_colour = Colours.RED
-        self.thickness = 15
-        self.eraser_thickness = 125
-        self.current_tool = Tools.PEN
-        self.drawing = False
-        self.start_point = None
+        # bumped on every change to the pixels, so autosave can skip an
+        # unchanged canvas. readers counts background readers of the
+        # pixels, see freeze.
+        self.version = 0
+        self.readers = 0
+        self.reader_lock = threading.Lock()
+        self._create_storage()
+
+        # Current drawing settings, new hands start with the last colour
+        # picked by any hand
+        self.default_colour_name = Colours.RED.name
+        self.default_draw_tool = Tools.PEN
+        self.thickness = max(1, round(PEN_THICKNESS * height / 1080))
+        self.eraser_thickness = max(1, round(ERASER_THICKNESS * height / 1080))
+
+        # hand id -> Pen, hand 0 is the default for single hand callers
+        self.pens = {}
+
+        # every finished stroke and clear goes into the history, strokes
+        # being drawn right now are only committed on stop_drawing. Strokes
+        # drawn at the same time are committed in the order they end.
+        self.history = CommandLog(width, height, CHECKPOINT_INTERVAL, MAX_CHECKPOINTS)
+
+    def pen(self, hand=0):
+        pen = self.pens.get(hand)
+        if pen is None:
+            pen = self.pens[hand] = Pen(self.default_colour_name, draw_tool=self.default_draw_tool)
+        return pen
+
+    def remove_pen(self, hand):
+        # the hand is gone for good, finish its stroke and forget it
+        if hand in self.pens:
+            self._commit_stroke(self.pens.pop(hand))
+
+    # single hand view of the default pen
+    @property
+    def drawing(self):
+        return self.pen().drawing
+
+    @property
+    def current_tool(self):
+        return self.pen().tool
+
+    @property
+    def current_colour(self):
+        return self.pen().colour
+
+    @property
+    def current_colour_name(self):
+        return self.pen().colour_name
 
-    def draw(self, point):
-        if not self.drawing or self.start_point is None:
+    @property
+    def stroke(self):
+        return self.pen().stroke
+
+    def to_canvas(self, point):
+        # screen (frame) coordinates to canvas coordinates
+        return point
+
+    def to_screen_stroke(self, stroke):
+        # the stroke in screen coordinates, for previews
+        return stroke
+
+    def pen_width(self, pen):
+        # width of the next point of a pen stroke, None for a fixed width
+        if pen.pressure is None:
+            return None
+        low, high = PEN_WIDTH_RANGE
+        return self.thickness * (low + (high - low) * pen.pressure)
+
+    def draw(self, point, hand=0, pressure=None):
+        pen = self.pen(hand)
+        if not pen.drawing or pen.start_point is None:
             return
 
-        if self.current_tool == Tools.PEN:
-            # Get the actual BGR color to use
-            bgr_colour = self.current_colour.value
-            # print(f"Drawing with colour: {self.current_colour_name}, BGR: {bgr_colour}")
-            cv2.line(self.canvas, self.start_point, point, bgr_colour, self.thickness)
-            self.start_point = point
+        pen.start_point = point
+        if pressure is not None:
+            pen.pressure = pressure if pen.pressure is None else pen.pressure + PEN_PRESSURE_SMOOTHING * (pressure - pen.pressure)
+        if pen.tool in SHAPE_TOOLS:
+            # rubber band, only the corner under the finger moves and nothing
+            # touches the canvas until the shape is committed
+            if pen.stroke.count < 2:
+                pen.stroke.add_point(self.to_canvas(point))
+            else:
+                pen.stroke.points[-1] = self.to_canvas(point)
             return
 
-        if self.current_tool == Tools.ERASER:
-            cv2.line(self.canvas, self.start_point, point, (0, 0, 0), self.eraser_thickness)
-            self.start_point = point
+        pen.stroke.add_point(self.to_canvas(point), self.pen_width(pen))
+        if pen.tool == Tools.SNAP:
+            # only previewed until it is known what it snaps to
+            return
+        if pen.stroke.count > 2:
+            # the previous segment can be drawn now that the point after it,
+            # which shapes the end of its curve, is known
+            self._paint_segment(pen.stroke, pen.stroke.count - 2)
 
-    def start_drawing(self, point):
-        self.drawing = True
-        self.start_point = point
-        print(f"Started drawing with: {self.current_colour_name}")
+    def _paint_segment(self, stroke, index):
+        curve = segment_curve(stroke.points, index)
+        widths = segment_widths(stroke, index, len(curve))
+        self.paint(
+            curve_bounds(curve, stroke.thickness if widths is None else widths.max()),
+            lambda image, origin: rasterise(image, curve, stroke, origin, widths),
+            erase=stroke.tool == Tools.ERASER.value,
+            layer=stroke.layer,
+        )
 
-    def stop_drawing(self):
-        self.drawing = False
-        self.start_point = None
+    def _paint_shape(self, stroke):
+        self.paint(
+            curve_bounds(stroke.points, stroke.thickness),
+            lambda image, origin: rasterise_shape(image, stroke, origin),
+            layer=stroke.layer,
+        )
+
+    def _snap(self, stroke):
+        # the shape a SNAP stroke is closest to, or the stroke as drawn
+        shape = snap_shape(stroke.points, SNAP_TOLERANCE)
+        if shape is None:
+            return Stroke(Tools.PEN.value, stroke.colour, stroke.thickness, stroke.points.copy(), layer=stroke.layer)
+        tool, points = shape
+        logger.debug("Snapped a %d point stroke to a %s", stroke.count, tool.name.lower())
+        return Stroke(tool.value, stroke.colour, stroke.thickness, points, layer=stroke.layer)
+
+    def previews(self):
+        # strokes being drawn that are not on the canvas yet (shapes being
+        # dragged, freehand waiting to be snapped) in screen coordinates
+        return [
+            self.to_screen_stroke(pen.stroke)
+            for pen in self.pens.values()
+            if pen.drawing and pen.stroke is not None and pen.stroke.count > 1
+            and (pen.tool in SHAPE_TOOLS or pen.tool == Tools.SNAP)
+        ]
+
+    def _new_stroke(self, pen, point):
+        if pen.tool == Tools.ERASER:
+            stroke = Stroke(pen.tool.value, (0, 0, 0), self.eraser_thickness)
+        else:
+            # Get the actual BGR color to use, only the pen has pressure
+            variable = pen.tool == Tools.PEN and pen.pressure is not None
+            stroke = Stroke(pen.tool.value, pen.colour.value, self.thickness, variable=variable)
+        stroke.layer = self.active_layer
+        stroke.add_point(self.to_canvas(point), self.pen_width(pen))
+        return stroke
+
+    def _commit_stroke(self, pen):
+        # single point strokes never put any ink down
+        if pen.stroke is not None and pen.stroke.count > 1:
+            stroke = pen.stroke
+            if stroke.tool == Tools.SNAP.value:
+                stroke = self._snap(stroke)
+                self.render(stroke)
+            elif stroke.tool in SHAPE_TOOL_VALUES:
+                self._paint_shape(stroke)
+            else:
+                # the last segment is still pending, see draw
+                self._paint_segment(stroke, stroke.count - 1)
+            self.history.push(stroke, self)
+        pen.stroke = None
+
+    # storage, TiledCanvas overrides these
+
+    def _create_storage(self):
+        # layers bottom first, strokes go on the active one and canvas is its
+        # BGRA image
+        self.layers = [Layer("ink", self.width, self.height)]
+        self.active_layer = 0
+        self.canvas = self.layers[0].image
+        # bumped when anything but the active layer's pixels changes, i.e.
+        # other layers or layer settings, the compositor then rebuilds the
+        # flattened layers it caches
+        self.layers_version = 0
+        # layers a frozen snapshot still shares, copied before they change
+        self.shared_layers = set()
+
+        # pixels the layers change, kept up to date by the compositor from
+        # the regions listed in dirty_rects as (x0, y0, x1, y1)
+        self.mask = np.zeros((self.height, self.width), dtype=np.uint8)
+        self.dirty_rects = []
+
+    def paint(self, bounds, draw, erase=False, layer=None):
+        # draw(image, origin) renders into an image whose top left pixel is at
+        # canvas position origin, on the active layer unless given
+        index = self.active_layer if layer is None else layer
+        self._modified(index)
+        draw(self.layers[index].image, (0, 0))
+        self.mark_dirty(bounds)
 
-    def set_colour(self, colour: str):
-        self.current_colour_name = colour
-        self.current_colour = Colours[colour]
-        print(f"Canvas colour set to: {colour}, BGR: {self.current_colour}")
+    def _modified(self, layer=None):
+        # called before the pixels of a layer, or of every layer, change
+        self.version += 1
+        if layer != self.active_layer:
+            self.layers_version += 1
+        with self.reader_lock:
+            for index in range(len(self.layers)) if layer is None else (layer,):
+                if index in self.shared_layers:
+                    # copy on write, a background writer still reads the old image
+                    self.layers[index].image = self.layers[index].image.copy()
+                    self.shared_layers.discard(index)
+        self.canvas = self.layer.image
 
-    def set_tool(self, tool: Tools):
-        self.current_tool = tool
+    def freeze(self):
+        # the layers as they are now, for reading on another thread without
+        # copying them. A layer is copied before its next change unless
+        # every reader has handed the snapshot back with thaw.
+        with self.reader_lock:
+            self.readers += 1
+            self.shared_layers = set(range(len(self.layers)))
+        return [layer.state() for layer in self.layers]
+
+    def thaw(self, frozen):
+        with self.reader_lock:
+            if self.readers:
+                self.readers -= 1
+                if not self.readers:
+                    self.shared_layers.clear()
+
+    def frozen_image(self, frozen, background=None):
+        # the image of a frozen canvas over a BGR background or black, called
+        # on the reader's thread
+        return flatten_image(frozen, background)
+
+    def mark_dirty(self, bounds):
+        x0, y0, x1, y1 = bounds
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.width), min(y1, self.height)
+        if x0 < x1 and y0 < y1:
+            self.dirty_rects.append((x0, y0, x1, y1))
+
+    def _clear_pixels(self):
+        self._modified()
+        for layer in self.layers:
+            layer.image[:] = 0
+        self.dirty_rects = [(0, 0, self.width, self.height)]
+
+    def snapshot(self):
+        return np.stack([layer.image for layer in self.layers])
+
+    def restore(self, snapshot):
+        # None restores a blank canvas, layers added since the snapshot are
+        # restored blank
+        self._modified()
+        for index, layer in enumerate(self.layers):
+            if snapshot is None or index >= len(snapshot):
+                layer.image[:] = 0
+            else:
+                layer.image[:] = snapshot[index]
+        self.dirty_rects = [(0, 0, self.width, self.height)]
+
+    def restore_image(self, image):
+        # a BGR image the size of the canvas goes onto the active layer with
+        # black as transparent, every other layer is cleared
+        if image.shape != (self.height, self.width, 3):
+            raise ValueError(f"{image.shape[1]}x{image.shape[0]} image does not fit a {self.width}x{self.height} canvas")
+        self._modified()
+        for layer in self.layers:
+            layer.image[:] = 0
+        self.canvas[..., :3] = image
+        self.canvas[..., 3] = cv2.compare(ink_mask(image), 0, cv2.CMP_GT)
+        self.dirty_rects = [(0, 0, self.width, self.height)]
+
+    def render(self, command):
+        # paint a whole command from the history
+        if command.kind == CLEAR:
+            self._clear_pixels()
+            return
+        if command.tool in SHAPE_TOOL_VALUES:
+            self._paint_shape(command)
+            return
+        for index in range(1, command.count):
+            self._paint_segment(command, index)
+
+    def to_image(self):
+        # every layer flattened over black
+        return flatten_image([layer.state() for layer in self.layers])
+
+    # layers
+
+    @property
+    def layer(self):
+        return self.layers[self.active_layer]
+
+    def add_layer(self, name=None, opacity=1.0, blend="normal"):
+        # a new empty layer on top of the stack, which becomes the active one
+        if len(self.layers) >= MAX_LAYERS:
+            raise ValueError(f"A canvas has at most {MAX_LAYERS} layers")
+        self.layers.append(Layer(name or f"layer {len(self.layers) + 1}", self.width, self.height, opacity, blend))
+        self._sync_layer_settings()
+        self.select_layer(len(self.layers) - 1)
+        return self.layer
+
+    def select_layer(self, index):
+        # strokes in progress end on the layer they started on
+        self.stop_drawing()
+        self.active_layer = index % len(self.layers)
+        self.canvas = self.layer.image
+        self.layers_version += 1
+        logger.debug("Drawing on layer %d (%s)", self.active_layer, self.layer.name)
+
+    def set_layer(self, index=None, opacity=None, blend=None, visible=None):
+        # changes the active layer's settings, or another's
+        layer = self.layers[self.active_layer if index is None else index]
+        if blend is not None and blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode {blend!r}, use one of {', '.join(BLEND_MODES)}")
+        if opacity is not None:
+            layer.opacity = float(np.clip(opacity, 0.0, 1.0))
+        if blend is not None:
+            layer.blend = blend
+        if visible is not None:
+            layer.visible = visible
+        self._sync_layer_settings()
+        # the canvas looks different, so exports and autosave do too
+        self.version += 1
+        self.layers_version += 1
+
+    def _sync_layer_settings(self):
+        # the history renders and saves strokes with the layers they are on
+        if not self.tiled:
+            self.history.layers = [(layer.name, layer.opacity, layer.blend, layer.visible) for layer in self.layers]
+
+    def _set_layers(self, settings):
+        # a new stack of empty layers from (name, opacity, blend, visible)
+        self.layers = [Layer(name, self.width, self.height, *rest) for name, *rest in settings]
+        self.active_layer = min(self.active_layer, len(self.layers) - 1)
+        self.canvas = self.layer.image
+        with self.reader_lock:
+            # readers keep the old images, nothing here is shared with them
+            self.shared_layers.clear()
+        self.layers_version += 1
+
+    def start_drawing(self, point, hand=0, pressure=None):
+        pen = self.pen(hand)
+        self._commit_stroke(pen)
+        pen.drawing = True
+        pen.start_point = point
+        pen.pressure = pressure
+        pen.stroke = self._new_stroke(pen, point)
+        logger.debug("Hand %s started drawing with %s", hand, pen.colour_name)
+
+    def stop_drawing(self, hand=None):
+        # None stops every hand
+        for pen in self.pens.values() if hand is None else [self.pen(hand)]:
+            self._commit_stroke(pen)
+            pen.drawing = False
+            pen.start_point = None
+
+    def _restart_stroke(self, pen):
+        # a stroke has a single tool and colour, switching mid-stroke ends it
+        # and continues with a new one from the same point
+        if pen.drawing and pen.start_point is not None:
+            self._commit_stroke(pen)
+            pen.stroke = self._new_stroke(pen, pen.start_point)
+
+    def set_colour(self, colour: str, hand=None):
+        # None sets the colour of every hand, e.g. from a voice command
+        self.default_colour_name = colour
+        for pen in self.pens.values() if hand is None else [self.pen(hand)]:
+            if Colours[colour] != pen.colour:
+                pen.colour_name = colour
+                pen.colour = Colours[colour]
+                self._restart_stroke(pen)
+        logger.debug("Canvas colour set to %s, BGR %s", colour, Colours[colour])
+
+    def set_draw_tool(self, tool: Tools, hand=None):
+        # the tool the draw gesture uses, None sets it for every hand. Takes
+        # effect from the next stroke.
+        self.default_draw_tool = tool
+        for pen in self.pens.values() if hand is None else [self.pen(hand)]:
+            pen.draw_tool = tool
+
+    def set_tool(self, tool: Tools, hand=0):
+        pen = self.pen(hand)
+        if tool != pen.tool:
+            pen.tool = tool
+            self._restart_stroke(pen)
 
     def get_display(self):
-        return self.canvas.copy()
+        return self.to_image().copy()
 
     def clear(self):
-        self.canvas = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self.stop_drawing()
+        self._clear_pixels()
+        self.history.push(ClearCommand(), self)
+
+    def undo(self):
+        self.stop_drawing()
+        self.history.undo(self)
+
+    def redo(self):
+        self.stop_drawing()
+        self.history.redo(self)
+
+    def save(self, path):
+        self.stop_drawing()
+        self._sync_layer_settings()
+        self.history.save(path)
+        print(f"Saved {self.history.position} strokes to {path}")
+
+    def load(self, path):
+        history = CommandLog.load(path, checkpoint_interval=CHECKPOINT_INTERVAL, max_checkpoints=MAX_CHECKPOINTS)
+        if not self.tiled and (history.width, history.height) != (self.width, self.height):
+            # drawn at another resolution, scaled to fit this canvas
+            print(f"Scaling {path} from {history.width}x{history.height} to {self.width}x{self.height}")
+            history = history.resized(self.width, self.height)
+        self.stop_drawing()
+        self.history = history
+        if not self.tiled:
+            self._set_layers(history.layers)
+        self.history.rebuild(self)
+        print(f"Loaded {self.history.position} strokes from {path}")
+
+    def load_image(self, path):
+        # an exported or autosaved image becomes the new starting point, undo
+        # goes back to it but not past it
+        image = read_image(path)
+        self.stop_drawing()
+        self.restore_image(image)
+        self.history = CommandLog(self.width, self.height, CHECKPOINT_INTERVAL, MAX_CHECKPOINTS)
+        self.history.base = self.snapshot()
+        self._sync_layer_settings()
+        print(f"Loaded {path}")
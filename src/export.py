@@ -0,0 +1,116 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
+import cv2
+import numpy as np
+from config import *
+from logging_utils import get_logger
+
+logger = get_logger("export")
+
+# file extension -> cv2.imencode parameters, .npy is written raw
+ENCODE_PARAMS = {
+    ".png": [cv2.IMWRITE_PNG_COMPRESSION, EXPORT_PNG_COMPRESSION],
+    ".webp": [cv2.IMWRITE_WEBP_QUALITY, EXPORT_WEBP_QUALITY],
+}
+RAW_EXTENSION = ".npy"
+
+
+def write_image(path, image):
+    # encoded by extension and written to a temporary file first, so an
+    # interrupted write never leaves a broken file behind
+    extension = os.path.splitext(path)[1].lower()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        if extension == RAW_EXTENSION:
+            np.save(f, image)
+        elif extension in ENCODE_PARAMS:
+            success, encoded = cv2.imencode(extension, image, ENCODE_PARAMS[extension])
+            if not success:
+                raise ValueError(f"Could not encode {path}")
+            f.write(encoded)
+        else:
+            raise ValueError(f"Unknown image format {extension!r}, use png, webp or npy")
+    os.replace(temporary, path)
+
+
+def read_image(path):
+    # raw files are memory-mapped, so restoring one is a single copy from
+    # the page cache into the canvas buffer
+    if path.lower().endswith(RAW_EXTENSION):
+        return np.load(path, mmap_mode="r")
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Could not read {path}")
+    return image
+
+
+def export_path(directory=EXPORT_DIR, extension=EXPORT_FORMAT):
+    return os.path.join(directory, time.strftime(f"aircanvas_%Y%m%d_%H%M%S.{extension}"))
+
+
+class CanvasWriter:
+    # encodes and writes canvas snapshots on a thread pool. The render loop
+    # only freezes the canvas (no copy, see DrawingCanvas.freeze) and hands
+    # it over, cv2.imencode and the disk are never waited on.
+    def __init__(self, workers=EXPORT_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+
+    def export(self, canvas, path, background=None):
+        # background is a camera frame to composite the ink over, it has to
+        # be a copy the render loop will not reuse
+        frozen = canvas.freeze()
+        return self.pool.submit(self._write, canvas, frozen, path, background)
+
+    def _write(self, canvas, frozen, path, background):
+        start = time.perf_counter()
+        try:
+            write_image(path, canvas.frozen_image(frozen, background))
+        except Exception as e:
+            logger.warning("Could not export %s: %s", path, e)
+            raise
+        finally:
+            canvas.thaw(frozen)
+        logger.info("Exported %s in %.0f ms", path, 1000 * (time.perf_counter() - start))
+        return path
+
+    def close(self):
+        # waits for exports still being written
+        self.pool.shutdown(wait=True)
+
+
+class Autosaver:
+    # saves the canvas every interval seconds on the writer's threads,
+    # unless nothing was drawn since the last save or one is still running
+    def __init__(self, canvas, writer, path=AUTOSAVE_PATH, interval=AUTOSAVE_INTERVAL):
+        self.canvas = canvas
+        self.writer = writer
+        self.path = path
+        self.interval = interval
+        self.last_save = time.perf_counter()
+        self.saved_version = canvas.version
+        self.pending = None
+
+    def tick(self, now=None):
+        # called once per frame, between frames
+        now = time.perf_counter() if now is None else now
+        if now - self.last_save < self.interval:
+            return False
+        self.last_save = now
+        return self.save()
+
+    def save(self, wait=False):
+        # wait=True, e.g. on exit, waits for a save still running instead of
+        # skipping this one
+        if self.canvas.version == self.saved_version:
+            return False
+        if self.pending is not None and not self.pending.done():
+            if not wait:
+                return False
+            wait_for_futures([self.pending])
+        self.saved_version = self.canvas.version
+        self.pending = self.writer.export(self.canvas, self.path)
+        return True
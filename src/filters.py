@@ -0,0 +1,90 @@
+import math
+import numpy as np
+
+
+def smoothing_factor(dt, cutoff):
+    r = 2 * math.pi * cutoff * dt
+    return r / (r + 1)
+
+
+def one_euro_step(x, x_prev, dx_prev, dt, min_cutoff, beta, d_cutoff):
+    # one update of the filter, returns (x_hat, dx_hat)
+    # smoothed speed decides how much to smooth the value itself
+    a_d = smoothing_factor(dt, d_cutoff)
+    dx = (x - x_prev) / dt
+    dx_hat = a_d * dx + (1 - a_d) * dx_prev
+
+    a = smoothing_factor(dt, min_cutoff + beta * np.abs(dx_hat))
+    x_hat = a * x + (1 - a) * x_prev
+    return x_hat, dx_hat
+
+
+class OneEuroFilter:
+    # adaptive low-pass filter (Casiez et al.), heavy smoothing while the
+    # input is slow to kill jitter, very little when it moves fast to keep
+    # lag down. Works elementwise on scalars or arrays.
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.x_prev = None
+        self.dx_prev = None
+        self.t_prev = None
+
+    def __call__(self, x, t):
+        x = np.asarray(x, dtype=np.float64)
+        if self.t_prev is None:
+            self.x_prev = x
+            self.dx_prev = np.zeros_like(x)
+            self.t_prev = t
+            return x
+
+        dt = t - self.t_prev
+        if dt <= 0:
+            return self.x_prev
+
+        self.x_prev, self.dx_prev = one_euro_step(
+            x, self.x_prev, self.dx_prev, dt, self.min_cutoff, self.beta, self.d_cutoff
+        )
+        self.t_prev = t
+        return self.x_prev
+
+
+class OneEuroFilterBank:
+    # a OneEuroFilter per key (e.g. hand id), x has one row per key and all
+    # rows are filtered together in one vectorised step
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        # key -> (x_prev, dx_prev, t_prev)
+        self.state = {}
+
+    def __call__(self, keys, x, t):
+        x = np.asarray(x, dtype=np.float64)
+        out = x.copy()
+        dx_out = np.zeros_like(x)
+        t_out = np.full(len(x), t, dtype=np.float64)
+
+        rows = [row for row, key in enumerate(keys) if key in self.state]
+        if rows:
+            x_prev, dx_prev, t_prev = (np.stack(s) for s in zip(*(self.state[keys[row]] for row in rows)))
+            dt = (t - t_prev).reshape((-1,) + (1,) * (x.ndim - 1))
+            # rows without a newer timestamp keep their previous output
+            stale = dt <= 0
+            x_hat, dx_hat = one_euro_step(
+                x[rows], x_prev, dx_prev, np.where(stale, 1.0, dt), self.min_cutoff, self.beta, self.d_cutoff
+            )
+            out[rows] = np.where(stale, x_prev, x_hat)
+            dx_out[rows] = np.where(stale, dx_prev, dx_hat)
+            t_out[rows] = np.maximum(t_prev, t)
+
+        for row, key in enumerate(keys):
+            self.state[key] = (out[row], dx_out[row], t_out[row])
+        return out
+
+    def retain(self, keys):
+        # forget every key not in keys
+        keys = set(keys)
+        for key in [key for key in self.state if key not in keys]:
+            del self.state[key]
@@ -1,6 +1,32 @@
+from collections import Counter, deque
 from enum import Enum
-import math
+import logging
 import time
+import numpy as np
+from config import (
+    CLEAR_HOLD_TIME,
+    GESTURE_VOTE_WINDOW,
+    GESTURE_VOTES_REQUIRED,
+    PEN_DEPTH_RANGE,
+    PEN_PINCH_RANGE,
+    PEN_PRESSURE,
+    PINCH_RELEASE_THRESHOLD,
+    PINCH_THRESHOLD,
+)
+from landmarks import (
+    FINGER_BASES,
+    FINGER_PIPS,
+    FINGER_TIPS,
+    INDEX_PIP,
+    INDEX_TIP,
+    MIDDLE_MCP,
+    PALM_POINTS,
+    THUMB_TIP,
+    WRIST,
+)
+from logging_utils import get_logger
+
+logger = get_logger("gesture", rate_limit=1.0)
 
 class GestureType(Enum):
     NONE = "none"
@@ -9,117 +35,223 @@ class GestureType(Enum):
     SELECT = "select"   # index pointing
     CLEAR = "clear"     # fist with thumb out 
 
+def classify_gestures(landmarks, drawing, pinch_threshold=PINCH_THRESHOLD, release_threshold=PINCH_RELEASE_THRESHOLD):
+    # single frame classification of every hand in one pass. landmarks is
+    # (hands, 21, 3), drawing marks hands that are pinching already and so
+    # use the release threshold. GestureRecogniser debounces the result.
+    if len(landmarks) == 0:
+        return []
+
+    fingers_extended = _check_fingers_extended(landmarks)
+
+    # calculate pinch distance, relative to the hand size so the same
+    # thresholds work at any resolution and distance from the camera
+    hand_size = _calculate_distance(landmarks[:, WRIST], landmarks[:, MIDDLE_MCP])
+    pinch_distance = _calculate_distance(
+        landmarks[:, THUMB_TIP],
+        landmarks[:, INDEX_TIP]
+    ) / np.maximum(hand_size, 1e-6)
+
+    # debug info, the rounding is only paid for when it is logged
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Pinch distance: %s, fingers extended: %s", np.round(pinch_distance, 2), fingers_extended)
+
+    threshold = np.where(drawing, release_threshold, pinch_threshold)
+
+    # first match wins: draw, erase, select, clear
+    gestures = np.select(
+        [
+            pinch_distance < threshold,
+            fingers_extended.all(axis=1),
+            _is_select_gesture(landmarks, fingers_extended),
+            fingers_extended[:, 0] & ~fingers_extended[:, 1:].any(axis=1),
+        ],
+        [1, 2, 3, 4],
+        default=0,
+    )
+    return [_GESTURES[g] for g in gestures.tolist()]
+
+
+_GESTURES = [GestureType.NONE, GestureType.DRAW, GestureType.ERASE, GestureType.SELECT, GestureType.CLEAR]
+
+
+def pen_pressure(landmarks, source=PEN_PRESSURE):
+    # (hands,) 0-1 pen pressure of every hand, see PEN_PRESSURE, or None
+    # when strokes have a fixed width
+    if source is None:
+        return None
+    hand_size = np.maximum(_calculate_distance(landmarks[:, WRIST], landmarks[:, MIDDLE_MCP]), 1e-6)
+    if source == "pinch":
+        # a tighter pinch presses harder
+        pinch_distance = _calculate_distance(landmarks[:, THUMB_TIP], landmarks[:, INDEX_TIP]) / hand_size
+        low, high = PEN_PINCH_RANGE
+        pressure = (high - pinch_distance) / (high - low)
+    elif source == "depth":
+        # z is smaller towards the camera and scaled like x
+        depth = (landmarks[:, WRIST, 2] - landmarks[:, INDEX_TIP, 2]) / hand_size
+        low, high = PEN_DEPTH_RANGE
+        pressure = (depth - low) / (high - low)
+    else:
+        raise ValueError(f"Unknown pen pressure source {source!r}, use 'pinch', 'depth' or None")
+    return np.clip(pressure, 0.0, 1.0)
+
+
+def _is_select_gesture(landmarks, fingers_extended):
+    index_extended = fingers_extended[:, 1]
+
+    other_fingers_curled = ~fingers_extended[:, 2:].any(axis=1)
+
+    # Calculate angle between index finger (PIP -> tip) and vertical
+    delta = (landmarks[:, INDEX_TIP, :2] - landmarks[:, INDEX_PIP, :2]).astype(np.float64)
+    angle = np.abs(np.degrees(np.arctan2(delta[:, 0], -delta[:, 1])))  # Negative dy because y increases downward
+
+    # Check if index is relatively straight and vertical
+    is_vertical = angle < 30  # Allow 30 degrees deviation from vertical
+
+    # Check if index is above the middle, ring and pinky tips
+    is_highest = (landmarks[:, INDEX_TIP, 1:2] < landmarks[:, FINGER_TIPS[1:], 1]).all(axis=1)
+
+    # Combined conditions for SELECT gesture
+    return index_extended & other_fingers_curled & is_vertical & is_highest
+
+
+def _calculate_distance(point1, point2):
+    return np.hypot(point1[..., 0] - point2[..., 0], point1[..., 1] - point2[..., 1]).astype(np.float64)
+
+
+def _check_fingers_extended(landmarks):
+    # (hands, 5) bool, thumb first
+    # get palm center
+    palm_x = landmarks[:, PALM_POINTS, 0].mean(axis=1)
+
+    thumb_extended = landmarks[:, THUMB_TIP, 0] < palm_x
+
+    # Index to Pinky: a finger is extended if its tip is higher (smaller y)
+    # than both its mid and base points
+    ys = landmarks[:, :, 1]
+    fingers = (ys[:, FINGER_TIPS] < ys[:, FINGER_PIPS]) & (ys[:, FINGER_PIPS] < ys[:, FINGER_BASES])
+
+    return np.concatenate((thumb_extended[:, None], fingers), axis=1)
+
+
 class GestureRecogniser:
+    # debounced gesture state of one hand
     def __init__(self):
-        self.pinch_threshold = 75
+        # pinch hysteresis, a pinch starts below pinch_threshold and only
+        # ends once the fingers open past pinch_release_threshold
+        self.pinch_threshold = PINCH_THRESHOLD
+        self.pinch_release_threshold = PINCH_RELEASE_THRESHOLD
         self.current_gesture = GestureType.NONE
-        # clear gesture timing
+
+        # a new gesture needs votes_required of the last vote_window frames
+        self.votes = deque(maxlen=GESTURE_VOTE_WINDOW)
+        self.votes_required = GESTURE_VOTES_REQUIRED
+        self.last_raw_gesture = GestureType.NONE
+        self.raw_transitions = 0
+        self.transitions = 0
+
+        # clear gesture timing, on monotonic timestamps
         self.clear_gesture_start = 0
-        self.clear_hold_time = 3.0
+        self.clear_hold_time = CLEAR_HOLD_TIME
         self.is_clear_gesture = False
 
-    def recognise_gesture(self, landmark_list):
-        if not landmark_list:
-            # reset clear gesture state when no hand detected
-            self.is_clear_gesture = False
-            self.clear_gesture_start = 0
+    def recognise_gesture(self, landmarks, timestamp=None):
+        # landmarks is the (21, 3) array from HandTracker.get_landmarks
+        if landmarks is not None and not isinstance(landmarks, np.ndarray):
+            # legacy [(id, x, y), ...] list
+            landmarks = np.array([(x, y, 0) for _, x, y in landmarks], dtype=np.float32) if landmarks else None
+
+        raw_gesture = GestureType.NONE
+        if landmarks is not None:
+            raw_gesture = classify_gestures(
+                landmarks[None],
+                [self.current_gesture == GestureType.DRAW],
+                self.pinch_threshold,
+                self.pinch_release_threshold,
+            )[0]
+        return self.update(raw_gesture, timestamp)
+
+    def update(self, raw_gesture, timestamp=None):
+        # feed one frame's classification, returns the debounced gesture
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        if raw_gesture != self.last_raw_gesture:
+            self.raw_transitions += 1
+            self.last_raw_gesture = raw_gesture
+
+        self.votes.append(raw_gesture)
+        candidate, count = Counter(self.votes).most_common(1)[0]
+        if candidate != self.current_gesture and count >= self.votes_required:
+            logger.debug("Gesture %s -> %s", self.current_gesture.value, candidate.value)
+            self.current_gesture = candidate
+            self.transitions += 1
+
+            # Start timing if we just entered clear gesture
+            self.is_clear_gesture = candidate == GestureType.CLEAR
+            self.clear_gesture_start = timestamp
+
+        if self.is_clear_gesture:
+            # Check if we've held the gesture long enough, fires once per hold
+            if self.clear_gesture_start is not None and timestamp - self.clear_gesture_start >= self.clear_hold_time:
+                self.clear_gesture_start = None
+                return GestureType.CLEAR
             return GestureType.NONE
-        
-        landmarks = dict([(id, (x, y)) for id, x, y in landmark_list])
-
-        fingers_extended = self._check_fingers_extended(landmarks)
-
-        # calculate pinch distance
-        pinch_distance = self._calculate_distance(
-            landmarks[4],
-            landmarks[8]
-        )
-
-        # debug info
-        print(f"Pinch distance: {pinch_distance}")
-        print(f"Fingers extended: {fingers_extended}")
-        
-        # check for draw gesture
-        if pinch_distance < self.pinch_threshold:
-            return GestureType.DRAW
-        
-        # check for erase gesture
-        fingers_extended = self._check_fingers_extended(landmarks)
-        if all(fingers_extended):
-            return GestureType.ERASE
-        
-        # check for select gesture 
-        if self._is_select_gesture(landmarks, fingers_extended):
-            return GestureType.SELECT
-        
-        # # check for clear gesture
-        # if fingers_extended[0] and not any(fingers_extended[1:]):
-        #     # Start timing if we just entered clear gesture
-        #     if not self.is_clear_gesture:
-        #         self.clear_gesture_start = time.time()
-        #         self.is_clear_gesture = True
-            
-        #     # Check if we've held the gesture long enough
-        #     if time.time() - self.clear_gesture_start >= self.clear_hold_time:
-        #         return GestureType.CLEAR
-        # else:
-        #     # Reset clear gesture state if hand position changes
-        #     self.is_clear_gesture = False
-        #     self.clear_gesture_start = 0
-        
-        return GestureType.NONE
-    
-    def _is_select_gesture(self, landmarks, fingers_extended):
-        index_extended = fingers_extended[1]
-
-        other_fingers_curled = not any([fingers_extended[2], fingers_extended[3], fingers_extended[4]])
-
-        # Check index finger angle (should be pointing upward)
-        index_tip = landmarks[8]    # Index tip
-        index_pip = landmarks[6]    # Index PIP (middle joint)
-        
-        # Calculate angle between index finger and vertical
-        dx = index_tip[0] - index_pip[0]
-        dy = index_tip[1] - index_pip[1]
-        angle = abs(math.degrees(math.atan2(dx, -dy)))  # Negative dy because y increases downward
-
-        # Check if index is relatively straight and vertical
-        is_vertical = angle < 30  # Allow 30 degrees deviation from vertical
-
-        # Check if index is above other fingers
-        index_tip_y = landmarks[8][1]
-        other_tips_y = [landmarks[i][1] for i in [12, 16, 20]]  # Middle, Ring, Pinky tips
-        is_highest = all(index_tip_y < y for y in other_tips_y)
-                         
-        # Combined conditions for SELECT gesture
-        return (index_extended and 
-                other_fingers_curled and 
-                is_vertical and 
-                is_highest)
-
-    def _calculate_distance(self, point1, point2):
-        return math.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
-    
-    def _check_fingers_extended(self, landmarks):
-        # get palm center 
-        palm_x = sum(landmarks[i][0] for i in [0, 5, 9, 13, 17]) / 5
-
-        thumb_extended = landmarks[4][0] < palm_x
-
-        # Other fingers - compare y positions
-        fingers = []
-        for tip, mid, base in [(8,6,5), (12,10,9), (16,14,13), (20,18,17)]:  # Index to Pinky
-            finger_tip_y = landmarks[tip][1]
-            finger_base_y = landmarks[base][1]
-            finger_mid_y = landmarks[mid][1]
-
-            # A finger is extended if its tip is higher (smaller y) than both its mid and base points
-            finger_extended = finger_tip_y < finger_mid_y < finger_base_y
-            fingers.append(finger_extended)
-
-        return [thumb_extended] + fingers
-    
-
-
-        
-        
\ No newline at end of file
+
+        return self.current_gesture
+
+    @property
+    def settled(self):
+        # back in the state of a new recogniser, nothing but NONE votes
+        return self.current_gesture == GestureType.NONE and all(v == GestureType.NONE for v in self.votes)
+
+
+class HandGestures:
+    # a GestureRecogniser per tracked hand id, all hands are classified
+    # together and only the cheap debouncing runs per hand. model is a
+    # gesture_model.GestureModel to classify with instead of the rules.
+    def __init__(self, model=None):
+        self.model = model
+        self.pinch_threshold = PINCH_THRESHOLD
+        self.pinch_release_threshold = PINCH_RELEASE_THRESHOLD
+        self.recognisers = {}
+        # transition counts of recognisers that were dropped
+        self.retired_raw_transitions = 0
+        self.retired_transitions = 0
+
+    def recognise(self, hands, timestamp=None):
+        # hands is a TrackedHands, returns one gesture per hand in its order
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        recognisers = [self.recognisers.setdefault(hand_id, GestureRecogniser()) for hand_id in hands.ids.tolist()]
+        if self.model is not None:
+            raw_gestures = self.model.classify(hands.landmarks, hands.handedness)
+        else:
+            raw_gestures = classify_gestures(
+                hands.landmarks,
+                [r.current_gesture == GestureType.DRAW for r in recognisers],
+                self.pinch_threshold,
+                self.pinch_release_threshold,
+            )
+        gestures = [r.update(raw, timestamp) for r, raw in zip(recognisers, raw_gestures)]
+
+        # hands missing from this frame vote NONE like a single hand always
+        # did, and are dropped once forgotten by the tracker or settled
+        present = set(hands.ids.tolist())
+        for hand_id in [hand_id for hand_id in self.recognisers if hand_id not in present]:
+            recogniser = self.recognisers[hand_id]
+            recogniser.update(GestureType.NONE, timestamp)
+            if hand_id not in hands.known or recogniser.settled:
+                self.retired_raw_transitions += recogniser.raw_transitions
+                self.retired_transitions += recogniser.transitions
+                del self.recognisers[hand_id]
+        return gestures
+
+    @property
+    def raw_transitions(self):
+        return self.retired_raw_transitions + sum(r.raw_transitions for r in self.recognisers.values())
+
+    @property
+    def transitions(self):
+        return self.retired_transitions + sum(r.transitions for r in self.recognisers.values())
@@ -0,0 +1,291 @@
+import argparse
+import time
+import numpy as np
+from config import *
+from gesture import GestureType, classify_gestures
+from landmarks import FINGER_BASES, FINGER_TIPS, LEFT_HAND, MIDDLE_MCP, THUMB_TIP, UNKNOWN_HAND, WRIST
+from traces import UNLABELLED, LandmarkTrace, TraceRecorder
+
+# classes are indices into this, in traces and in models
+GESTURES = list(GestureType)
+MODEL_KINDS = ("centroid", "linear")
+MODEL_VERSION = 1
+
+_TIPS = [THUMB_TIP] + FINGER_TIPS
+_TIP_PAIRS = np.triu_indices(len(_TIPS), 1)
+_INDEX_MCP, _PINKY_MCP = FINGER_BASES[0], FINGER_BASES[-1]
+
+
+def hand_features(landmarks, handedness=None):
+    # (hands, 21, 3) landmarks -> (hands, 70) float32 that do not depend on
+    # where the hand is, its size, its roll or which hand it is: the other
+    # 20 landmarks relative to the wrist in units of hand size, turned so the
+    # wrist to middle finger base points up, with left hands mirrored onto
+    # right ones, and the distances between the five fingertips.
+    points = landmarks.astype(np.float32) - landmarks[:, WRIST:WRIST + 1]
+    xy = points[..., 0] + 1j * points[..., 1]
+    axis = xy[:, MIDDLE_MCP]
+    size = np.maximum(np.abs(axis), 1e-6)
+    # y grows downwards, so up is -1j
+    xy *= (-1j * np.conj(axis) / size ** 2)[:, None]
+    z = points[..., 2] / size[:, None]
+
+    # unknown hands are mirrored by where the index finger is, so the same
+    # pose always ends up the same way round
+    handedness = np.full(len(landmarks), UNKNOWN_HAND) if handedness is None else np.asarray(handedness)
+    left = np.where(
+        handedness == UNKNOWN_HAND,
+        xy[:, _INDEX_MCP].real > xy[:, _PINKY_MCP].real,
+        handedness == LEFT_HAND,
+    )
+    x = np.where(left[:, None], -xy.real, xy.real)
+
+    coords = np.stack((x, xy.imag, z), axis=-1)
+    tips = coords[:, _TIPS]
+    gaps = np.linalg.norm(tips[:, _TIP_PAIRS[0]] - tips[:, _TIP_PAIRS[1]], axis=-1)
+    return np.concatenate((coords[:, 1:].reshape(len(landmarks), -1), gaps), axis=1).astype(np.float32)
+
+
+def trace_samples(path, label=None):
+    # (landmarks, handedness, labels) of every labelled hand in a trace.
+    # label (a GestureType) labels every hand, otherwise the labels recorded
+    # with the trace are used
+    trace = LandmarkTrace(path)
+    if label is not None:
+        labels = np.full(len(trace), GESTURES.index(label), dtype=np.int8)
+    elif trace.labels is not None:
+        labels = trace.labels
+    else:
+        raise ValueError(f"{path} has no labels, give one as {path}:GESTURE")
+    labels = np.broadcast_to(labels[:, None], trace.present.shape)
+    keep = trace.present & (labels != UNLABELLED)
+    return trace.landmarks[keep], trace.handedness[keep], labels[keep].astype(np.intp)
+
+
+def load_samples(specs):
+    # PATH or PATH:GESTURE specs -> all their samples together
+    samples = []
+    names = {g.value: g for g in GESTURES}
+    for spec in specs:
+        path, _, name = spec.rpartition(":")
+        if name in names:
+            samples.append(trace_samples(path, names[name]))
+        else:
+            samples.append(trace_samples(spec))
+    return tuple(np.concatenate(arrays) for arrays in zip(*samples))
+
+
+class GestureModel:
+    # a nearest centroid or softmax regression classifier over standardised
+    # hand_features. Rows of weights belong to the gestures in classes.
+    def __init__(self, kind=GESTURE_MODEL_KIND):
+        if kind not in MODEL_KINDS:
+            raise ValueError(f"Unknown gesture model {kind!r}, use one of {', '.join(MODEL_KINDS)}")
+        self.kind = kind
+        self.mean = None
+        self.scale = None
+        self.classes = np.empty(0, dtype=np.intp)
+        self.weights = None
+        self.bias = None
+
+    def _standardise(self, features):
+        return (features - self.mean) / self.scale
+
+    def fit(self, features, labels, steps=500):
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0) + 1e-3
+        self.classes = np.unique(labels)
+        x = self._standardise(features)
+        if self.kind == "centroid":
+            self.weights = np.stack([x[labels == c].mean(axis=0) for c in self.classes])
+            self.bias = np.zeros(len(self.classes), dtype=np.float32)
+        else:
+            self.weights = np.zeros((len(self.classes), x.shape[1]), dtype=np.float32)
+            self.bias = np.zeros(len(self.classes), dtype=np.float32)
+            self._descend(x, np.searchsorted(self.classes, labels), steps)
+        return self
+
+    def _descend(self, x, targets, steps, rate=0.5, l2=1e-3, anchor=None):
+        # full batch gradient descent on the cross entropy, with the weights
+        # held towards anchor (or zero)
+        onehot = np.eye(len(self.classes), dtype=np.float32)[targets]
+        anchor = np.zeros_like(self.weights) if anchor is None else anchor
+        for _ in range(steps):
+            logits = x @ self.weights.T + self.bias
+            logits -= logits.max(axis=1, keepdims=True)
+            p = np.exp(logits)
+            p /= p.sum(axis=1, keepdims=True)
+            error = (p - onehot) / len(x)
+            self.weights -= rate * (error.T @ x + l2 * (self.weights - anchor))
+            self.bias -= rate * error.sum(axis=0)
+
+    def calibrate(self, features, labels, weight=GESTURE_CALIBRATION_WEIGHT, steps=100):
+        # moves the model towards one user's samples. The standardisation
+        # stays as trained, gestures the model did not know are added.
+        x = self._standardise(features)
+        for label in np.setdiff1d(labels, self.classes):
+            row = np.searchsorted(self.classes, label)
+            self.classes = np.insert(self.classes, row, label)
+            start = x[labels == label].mean(axis=0) if self.kind == "centroid" else 0
+            self.weights = np.insert(self.weights, row, start, axis=0)
+            self.bias = np.insert(self.bias, row, 0)
+        if self.kind == "centroid":
+            for row, label in enumerate(self.classes.tolist()):
+                if np.any(labels == label):
+                    self.weights[row] += weight * (x[labels == label].mean(axis=0) - self.weights[row])
+        else:
+            self._descend(x, np.searchsorted(self.classes, labels), steps, l2=1 - weight, anchor=self.weights.copy())
+        return self
+
+    def scores(self, features):
+        # (hands, classes), higher is more likely
+        x = self._standardise(features)
+        if self.kind == "centroid":
+            # minus the squared distance to each centroid, without the |x|^2
+            # every centroid shares
+            return 2 * x @ self.weights.T - (self.weights ** 2).sum(axis=1)
+        return x @ self.weights.T + self.bias
+
+    def predict(self, features):
+        # (hands,) indices into GESTURES
+        if len(features) == 0:
+            return np.empty(0, dtype=np.intp)
+        return self.classes[self.scores(features).argmax(axis=1)]
+
+    def classify(self, landmarks, handedness=None):
+        # one GestureType per hand, the drop-in for gesture.classify_gestures
+        if len(landmarks) == 0:
+            return []
+        return [GESTURES[g] for g in self.predict(hand_features(landmarks, handedness)).tolist()]
+
+    def save(self, path):
+        np.savez(
+            path,
+            version=MODEL_VERSION,
+            kind=self.kind,
+            mean=self.mean,
+            scale=self.scale,
+            classes=self.classes,
+            weights=self.weights,
+            bias=self.bias,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            version = int(data["version"])
+            if version != MODEL_VERSION:
+                raise ValueError(f"{path} has unsupported gesture model version {version}")
+            model = cls(str(data["kind"]))
+            model.mean = data["mean"]
+            model.scale = data["scale"]
+            model.classes = data["classes"].astype(np.intp)
+            model.weights = data["weights"]
+            model.bias = data["bias"]
+        return model
+
+
+class Calibration:
+    # asks for each gesture in turn for a few seconds and records the hands
+    # shown for it, after a moment to get into position
+    PROMPTS = {
+        GestureType.DRAW: "pinch index finger and thumb",
+        GestureType.ERASE: "show an open palm",
+        GestureType.SELECT: "point up with the index finger",
+        GestureType.CLEAR: "make a fist with the thumb out",
+        GestureType.NONE: "relax your hand",
+    }
+
+    def __init__(self, width, height, seconds=GESTURE_CALIBRATION_SECONDS, settle=GESTURE_CALIBRATION_SETTLE):
+        self.recorder = TraceRecorder(width, height)
+        self.seconds = seconds
+        self.settle = settle
+        self.started = None
+        self.prompt = None
+
+    def add(self, hands, timestamp):
+        # one frame's TrackedHands, returns False once every gesture is done
+        if self.started is None:
+            self.started = timestamp
+        step, into = divmod(timestamp - self.started, self.seconds)
+        gestures = list(self.PROMPTS)
+        if step >= len(gestures):
+            return False
+        gesture = gestures[int(step)]
+        self.prompt = f"{int(step) + 1}/{len(gestures)}: {self.PROMPTS[gesture]} ({self.seconds - into:.0f})"
+        if into >= self.settle and len(hands):
+            self.recorder.add(hands.landmarks, timestamp, hands.handedness, GESTURES.index(gesture))
+        return True
+
+    def finish(self, model=None, path=GESTURE_MODEL, trace_path=GESTURE_CALIBRATION_TRACE):
+        # calibrates model, or trains a new one on these samples alone when
+        # there is none, and saves it. Returns the model to use from now on.
+        if not self.recorder.frames:
+            print("No hands seen, calibration skipped")
+            return model
+        self.recorder.save(trace_path)
+        landmarks, handedness, labels = trace_samples(trace_path)
+        features = hand_features(landmarks, handedness)
+        if model is None:
+            model = GestureModel().fit(features, labels)
+        else:
+            model.calibrate(features, labels)
+        missing = [g.value for i, g in enumerate(GESTURES) if i not in model.classes]
+        if missing:
+            print(f"Gesture model does not know {', '.join(missing)}, no hand was seen for them")
+        model.save(path)
+        print(f"Saved gesture model to {path}")
+        return model
+
+
+def benchmark(model, landmarks, handedness, labels, repeat=10):
+    # accuracy of the model and of the rules (without the pinch hysteresis)
+    # on the same hands, and how long each takes to classify all of them in
+    # one call
+    drawing = np.zeros(len(landmarks), dtype=bool)
+    classifiers = {
+        "rules": lambda: classify_gestures(landmarks, drawing),
+        model.kind: lambda: model.classify(landmarks, handedness),
+    }
+    results = {}
+    for name, classify in classifiers.items():
+        predicted = np.array([GESTURES.index(g) for g in classify()])
+        start = time.perf_counter()
+        for _ in range(repeat):
+            classify()
+        elapsed = (time.perf_counter() - start) / repeat
+        per_class = ", ".join(
+            f"{g.value} {np.mean(predicted[labels == i] == i):.0%}"
+            for i, g in enumerate(GESTURES) if np.any(labels == i)
+        )
+        print(
+            f"{name:>8}: accuracy {np.mean(predicted == labels):6.1%} ({per_class}), "
+            f"{len(labels) / elapsed:,.0f} hands/s"
+        )
+        results[name] = (predicted, elapsed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a gesture model from labelled landmark traces, or compare one with the rules")
+    parser.add_argument("command", choices=("train", "benchmark"))
+    parser.add_argument("traces", nargs="+", help="traces with recorded labels (e.g. a calibration), or PATH:GESTURE to label every hand in PATH, e.g. pinch.npz:draw")
+    parser.add_argument("--model", default=GESTURE_MODEL, help="model to write (train) or test (benchmark)")
+    parser.add_argument("--kind", default=GESTURE_MODEL_KIND, choices=MODEL_KINDS, help="model to train")
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs over the samples for benchmark")
+    args = parser.parse_args()
+
+    landmarks, handedness, labels = load_samples(args.traces)
+    counts = ", ".join(f"{g.value} {np.sum(labels == i)}" for i, g in enumerate(GESTURES))
+    print(f"{len(labels)} labelled hands: {counts}")
+    if args.command == "train":
+        model = GestureModel(args.kind).fit(hand_features(landmarks, handedness), labels)
+        model.save(args.model)
+        accuracy = np.mean(model.predict(hand_features(landmarks, handedness)) == labels)
+        print(f"Saved {args.kind} gesture model to {args.model}, {accuracy:.1%} of the training hands right")
+    else:
+        benchmark(GestureModel.load(args.model), landmarks, handedness, labels, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import time
+from config import *
+from controller import track_hands
+from logging_utils import get_logger
+
+logger = get_logger("governor")
+
+
+class QualityLevel:
+    __slots__ = ("interval", "scale", "draw_landmarks")
+
+    def __init__(self, interval, scale, draw_landmarks):
+        self.interval = interval  # run inference on every interval-th frame
+        self.scale = scale  # of the inference resolution
+        self.draw_landmarks = draw_landmarks
+
+    def describe(self):
+        return (
+            f"inference every {self.interval} frame{'s' if self.interval > 1 else ''} at {self.scale:.2f}x, "
+            f"skeleton {'on' if self.draw_landmarks else 'off'}"
+        )
+
+
+class MovingAverage:
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, sample):
+        self.value = sample if self.value is None else self.value + self.alpha * (sample - self.value)
+
+
+class QualityGovernor:
+    # holds a frame rate (and optionally a capture to display latency) by
+    # stepping along GOVERNOR_LEVELS, from full quality at 0 to the cheapest.
+    # Quality drops as soon as a frame costs more than its budget and only
+    # comes back after GOVERNOR_UPGRADE_AFTER seconds of clear headroom, so
+    # it does not flap around the limit.
+    def __init__(self, target_fps=GOVERNOR_TARGET_FPS, latency_budget=GOVERNOR_LATENCY_BUDGET,
+                 levels=GOVERNOR_LEVELS, parallel=PIPELINE_MODE):
+        self.frame_budget = 1.0 / target_fps
+        self.latency_budget = latency_budget
+        self.levels = [QualityLevel(*level) for level in levels]
+        # with the pipeline, inference and rendering overlap and the slower
+        # one sets the frame rate, otherwise they add up
+        self.parallel = parallel
+
+        self.level = 0
+        self.frames = 0
+        # per frame seconds, inference includes the frames it skips
+        self.inference_cost = MovingAverage()
+        self.render_cost = MovingAverage()
+        self.latency = MovingAverage()
+        self.last_decision = None
+        self.headroom_since = None
+        self.changes = 0
+
+    @property
+    def current(self):
+        return self.levels[self.level]
+
+    @property
+    def frame_cost(self):
+        inference = self.inference_cost.value or 0.0
+        render = self.render_cost.value or 0.0
+        return max(inference, render) if self.parallel else inference + render
+
+    def track(self, tracker, frame, timestamp=None):
+        # one frame through the tracker the way the current level says,
+        # called from whichever thread runs inference
+        start = time.perf_counter()
+        level = self.current
+        infer = self.frames % level.interval == 0
+        self.frames += 1
+        tracker.inference_scale = level.scale
+        result = track_hands(tracker, frame, level.draw_landmarks, timestamp, infer)
+        self.inference_cost.add(time.perf_counter() - start)
+        return result
+
+    def update(self, render_seconds, latency=None, now=None):
+        # called once per displayed frame with the time spent on it outside
+        # inference, and how long ago it was captured. Returns True when the
+        # level changed.
+        now = time.perf_counter() if now is None else now
+        self.render_cost.add(render_seconds)
+        if latency is not None:
+            self.latency.add(latency)
+        if self.last_decision is None:
+            self.last_decision = now
+            return False
+        if now - self.last_decision < GOVERNOR_INTERVAL:
+            return False
+        self.last_decision = now
+
+        load = self.load()
+        if load > 1.0:
+            self.headroom_since = None
+            if self.level < len(self.levels) - 1:
+                return self._set_level(self.level + 1, load)
+        elif load < GOVERNOR_HEADROOM and self.level > 0:
+            if self.headroom_since is None:
+                self.headroom_since = now
+            elif now - self.headroom_since >= GOVERNOR_UPGRADE_AFTER:
+                self.headroom_since = now
+                return self._set_level(self.level - 1, load)
+        else:
+            self.headroom_since = None
+        return False
+
+    def load(self):
+        # the larger of frame cost / frame budget and latency / latency budget
+        load = self.frame_cost / self.frame_budget
+        if self.latency_budget and self.latency.value is not None:
+            load = max(load, self.latency.value / self.latency_budget)
+        return load
+
+    def _set_level(self, level, load):
+        previous = self.level
+        self.level = level
+        self.changes += 1
+        logger.info(
+            "Quality %d -> %d (%s): frame %.1f ms of %.1f ms, inference %.1f ms, latency %.0f ms, load %.2f",
+            previous,
+            level,
+            self.current.describe(),
+            1000 * self.frame_cost,
+            1000 * self.frame_budget,
+            1000 * (self.inference_cost.value or 0.0),
+            1000 * (self.latency.value or 0.0),
+            load,
+        )
+        return True
+
+    def state(self):
+        # the current decisions and what they were based on
+        return {
+            "level": self.level,
+            "levels": len(self.levels),
+            "inference_interval": self.current.interval,
+            "inference_scale": self.current.scale,
+            "draw_landmarks": self.current.draw_landmarks,
+            "frame_ms": round(1000 * self.frame_cost, 2),
+            "frame_budget_ms": round(1000 * self.frame_budget, 2),
+            "inference_ms": round(1000 * (self.inference_cost.value or 0.0), 2),
+            "latency_ms": round(1000 * (self.latency.value or 0.0), 2),
+            "load": round(self.load(), 3),
+            "changes": self.changes,
+        }
+
+    def hud_lines(self):
+        return [f"quality {self.level}/{len(self.levels) - 1}: {self.current.describe()}"]
@@ -1,117 +1,388 @@
-import mediapipe as mp 
+import time
 import cv2
+import numpy as np
 from config import *
+from filters import OneEuroFilterBank
+from profiling import profiler
+from landmarks import (
+    FINGER_PIPS,
+    FINGER_TIPS,
+    HAND_CONNECTIONS,
+    HANDEDNESS,
+    INDEX_TIP,
+    PALM_POINTS,
+    THUMB_IP,
+    THUMB_TIP,
+    UNKNOWN_HAND,
+)
 
-class HandTracker:
-    def __init__(self):
-        # initialise mediapipe hands
-        self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands(
-            max_num_hands = MAX_HANDS,
-            min_detection_confidence = MIN_DETECTION_CONFIDENCE,
-            min_tracking_confidence = MIN_TRACKING_CONFIDENCE
+
+def create_hands_model(max_hands=MAX_HANDS, static=False):
+    # imported here so replaying recorded landmarks works without mediapipe.
+    # static=True runs palm detection on every image instead of tracking.
+    import mediapipe as mp
+
+    return mp.solutions.hands.Hands(
+        static_image_mode = static,
+        max_num_hands = max_hands,
+        min_detection_confidence = MIN_DETECTION_CONFIDENCE,
+        min_tracking_confidence = MIN_TRACKING_CONFIDENCE
+    )
+
+
+def extract_hands(results):
+    # mediapipe results -> (hands, 21, 3) float32 landmarks normalised to the
+    # image that was processed, and (hands,) int8 handedness
+    hands = results.multi_hand_landmarks
+    if not hands:
+        return np.empty((0, 21, 3), dtype=np.float32), np.empty(0, dtype=np.int8)
+
+    landmarks = np.array(
+        [[(lm.x, lm.y, lm.z) for lm in hand.landmark] for hand in hands],
+        dtype=np.float32,
+    )
+    labels = results.multi_handedness
+    if not labels or len(labels) != len(hands):
+        return landmarks, np.full(len(hands), UNKNOWN_HAND, dtype=np.int8)
+    handedness = np.array(
+        [HANDEDNESS.get(hand.classification[0].label, UNKNOWN_HAND) for hand in labels],
+        dtype=np.int8,
+    )
+    return landmarks, handedness
+
+
+class HandModels:
+    # mediapipe in tracking mode takes each image to follow on from the last
+    # one in the same image space. Region of interest crops do, they follow
+    # the hands so the hands stay put within them, but a full frame search
+    # in between does not. Searches go to a static graph of their own, and
+    # the tracking graph is reset when crops start again after one.
+    def __init__(self, max_hands=MAX_HANDS, factory=create_hands_model):
+        self.max_hands = max_hands
+        self.factory = factory
+        self.tracking = factory(max_hands)
+        # created on the first search, never without region of interest tracking
+        self.search = None
+        self.continues = False
+
+    def process(self, rgb, search=False):
+        if search:
+            if self.search is None:
+                self.search = self.factory(self.max_hands, static=True)
+            self.continues = False
+            return self.search.process(rgb)
+        if not self.continues and hasattr(self.tracking, "reset"):
+            self.tracking.reset()
+        self.continues = True
+        return self.tracking.process(rgb)
+
+    def close(self):
+        for model in (self.tracking, self.search):
+            if hasattr(model, "close"):
+                model.close()
+
+
+class TrackedHands:
+    # every hand found in one frame, row i of each array is the same hand
+    __slots__ = ("landmarks", "ids", "handedness", "fingers", "known")
+
+    def __init__(self, landmarks, ids, handedness, fingers, known):
+        self.landmarks = landmarks  # (hands, 21, 3) float32 pixels
+        self.ids = ids  # (hands,) stable ids
+        self.handedness = handedness  # (hands,) LEFT_HAND / RIGHT_HAND / UNKNOWN_HAND
+        self.fingers = fingers  # (hands, 2) int32 smoothed index finger tips
+        # ids the tracker still remembers, including hands that were lost
+        # for less than HAND_LOST_TIME. Anything else can be forgotten.
+        self.known = known
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.empty((0, 21, 3), dtype=np.float32),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int8),
+            np.empty((0, 2), dtype=np.int32),
+            frozenset(),
         )
-        self.mp_draw = mp.solutions.drawing_utils
 
-        # track previous postiions for smoothing
+
+class HandTracker:
+    def __init__(self, roi_tracking=ROI_TRACKING):
+        self._create_model()
+
+        # track previous positions keyed by (hand id, finger id), and a
+        # smoothing filter bank per finger holding every hand's state
         self.prev_positions = {}
+        self.filters = {}
+        self.timestamp = 0.0
+
+        # (hands, 21, 3) float32 pixel coordinates for the current frame,
+        # z is scaled by the frame width like mediapipe does
+        self.results = None
+        self.landmarks = np.empty((0, 21, 3), dtype=np.float32)
+        self.handedness = np.empty(0, dtype=np.int8)
+
+        # stable ids, row i of landmarks is hand hand_ids[i]. tracked holds
+        # id -> (palm centre, handedness, last seen) of recently seen hands.
+        self.hand_ids = np.empty(0, dtype=np.int64)
+        self.tracked = {}
+        self.next_id = 0
+
+        # region of interest (x0, y0, x1, y1) around the last detection,
+        # None means the next frame searches the whole (downscaled) frame
+        self.roi_tracking = roi_tracking
+        self.roi = None
+        self.frames_since_search = 0
+        # reused for the colour conversion whenever the input size repeats
+        self.rgb = None
+        # multiplies the inference resolution, lowered by the quality governor
+        self.inference_scale = 1.0
+
+        # landmarks of the last inference and their velocity in px/s, so
+        # frames without inference can move the hands on, see predict_hands
+        self.detected = self.landmarks
+        self.detected_at = None
+        self.velocity = np.zeros_like(self.landmarks)
+
+    def _create_model(self):
+        # initialise mediapipe hands
+        self.hands = HandModels()
+
+    def _detect(self, rgb, search=False):
+        # normalised landmarks and handedness of the hands in an RGB image,
+        # search is a full frame one between region of interest crops
+        self.results = self.hands.process(rgb, search)
+        return extract_hands(self.results)
+
+    def warm_up(self, width, height):
+        # mediapipe builds its graph on the first frame, which takes many
+        # times longer than any frame after it. A blank frame the size of the
+        # camera's pays for that before the first real one arrives.
+        self.find_hands(np.zeros((height, width, 3), dtype=np.uint8), draw=False, timestamp=0.0)
+        if self.roi_tracking:
+            # that was a search, the crops go to the tracking graph
+            size = min(ROI_MAX_SIZE, width, height)
+            self._detect(np.zeros((size, size, 3), dtype=np.uint8))
+        self.results = None
+        self.roi = None
+        self.detected_at = None
+
+    def find_hands(self, frame, draw=True, timestamp=None):
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        height, width = frame.shape[:2]
+        if self.roi_tracking and self.roi is not None and not self._search_due():
+            x0, y0, x1, y1 = self.roi
+            max_size = ROI_MAX_SIZE * self.inference_scale
+            self.frames_since_search += 1
+            search = False
+        else:
+            x0, y0, x1, y1 = 0, 0, width, height
+            max_size = max(width, height) * (SEARCH_SCALE if self.roi_tracking else 1) * self.inference_scale
+            self.frames_since_search = 0
+            # without region of interest tracking every frame is the whole
+            # frame, which the tracking graph can follow
+            search = self.roi_tracking
+
+        with profiler.time("preprocess"):
+            # crop (a view, no copy) and downscale before the colour conversion
+            # so both only touch the pixels that are actually fed to mediapipe
+            region = frame[y0:y1, x0:x1]
+            scale = max_size / max(x1 - x0, y1 - y0)
+            if scale < 1:
+                region = cv2.resize(region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
-    def find_hands(self, frame, draw=True):
-        # Convert BGR to RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # Convert BGR to RGB
+            self.rgb = cv2.cvtColor(region, cv2.COLOR_BGR2RGB, dst=self.rgb)
     
         # Process the frame
-        self.results = self.hands.process(rgb_frame)
-    
-        if self.results.multi_hand_landmarks:
-            for hand_landmarks in self.results.multi_hand_landmarks:
-                if draw:
-                    landmarks_style = self.mp_draw.DrawingSpec(
-                        color=(255, 255, 255),  # White
-                        thickness=2,
-                        circle_radius=6
-                    )
-                    connections_style = self.mp_draw.DrawingSpec(
-                        color=(255, 255, 255),  # White
-                        thickness=1,
-                        circle_radius=2
-                    )
-
-                    self.mp_draw.draw_landmarks(
-                        frame,
-                        hand_landmarks,
-                        self.mp_hands.HAND_CONNECTIONS,
-                        landmarks_style,
-                        connections_style
-                    )
+        with profiler.time("mediapipe"):
+            normalised, self.handedness = self._detect(self.rgb, search)
+        with profiler.time("landmarks"):
+            previous_ids, previous = self.hand_ids, self.detected
+            self.landmarks = self._to_pixels(normalised, (x0, y0, x1, y1))
+            self._assign_ids(width, height)
+            self._update_velocity(previous_ids, previous)
+
+        if self.roi_tracking:
+            self.roi = self._next_roi(width, height)
+
+        if draw:
+            self._draw_hands(frame)
                     
         return frame
-    
-    def get_hand_position(self, frame, hand_number=0):
-        landmark_list = []
 
-        if self.results.multi_hand_landmarks:
-            if len(self.results.multi_hand_landmarks) > hand_number:
-                hand = self.results.multi_hand_landmarks[hand_number]
-                for id, landmark in enumerate(hand.landmark):
-                    height, width, _ = frame.shape
-                    cx, cy = int(landmark.x * width), int(landmark.y * height)
-                    landmark_list.append((id, cx, cy))
+    def predict_hands(self, frame, draw=True, timestamp=None):
+        # a frame without inference, the hands found last carry on at their
+        # last velocity for up to PREDICTION_LIMIT seconds
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.detected_at is not None:
+            elapsed = min(max(self.timestamp - self.detected_at, 0.0), PREDICTION_LIMIT)
+            self.landmarks = self.detected + self.velocity * np.float32(elapsed)
+        if draw:
+            self._draw_hands(frame)
+        return frame
+
+    def _update_velocity(self, previous_ids, previous):
+        # per hand, from the last two inference frames the hand was in
+        self.velocity = np.zeros_like(self.landmarks)
+        if self.detected_at is not None and self.timestamp > self.detected_at:
+            rows = {hand_id: row for row, hand_id in enumerate(previous_ids.tolist())}
+            elapsed = np.float32(self.timestamp - self.detected_at)
+            for row, hand_id in enumerate(self.hand_ids.tolist()):
+                if hand_id in rows:
+                    self.velocity[row] = (self.landmarks[row] - previous[rows[hand_id]]) / elapsed
+        self.detected = self.landmarks
+        self.detected_at = self.timestamp
+
+    def _to_pixels(self, landmarks, region):
+        # normalised coordinates are relative to the region that was fed to
+        # mediapipe, map them back to full frame pixels
+        x0, y0, x1, y1 = region
+        landmarks = landmarks * np.array([x1 - x0, y1 - y0, x1 - x0], dtype=np.float32)
+        landmarks[..., 0] += x0
+        landmarks[..., 1] += y0
+        return landmarks
+
+    def _search_due(self):
+        # the crop only contains the hands already tracked, look at the
+        # whole frame now and then so another hand can join
+        return len(self.landmarks) < MAX_HANDS and self.frames_since_search >= HAND_SEARCH_INTERVAL
+
+    def _assign_ids(self, width, height):
+        # match this frame's hands to recently seen ones by palm position and
+        # handedness, so each hand keeps its id and with it its smoothing,
+        # gesture state, tool, colour and stroke
+        centres = self.landmarks[:, PALM_POINTS, :2].mean(axis=1) / np.float32(max(width, height))
+        ids = np.full(len(centres), -1, dtype=np.int64)
+
+        self.tracked = {
+            hand_id: hand for hand_id, hand in self.tracked.items()
+            if self.timestamp - hand[2] <= HAND_LOST_TIME
+        }
+        if self.tracked and len(centres):
+            known = list(self.tracked)
+            known_centres = np.array([self.tracked[hand_id][0] for hand_id in known])
+            known_handedness = np.array([self.tracked[hand_id][1] for hand_id in known])
+
+            # all pairs at once, (hands, known hands)
+            distance = np.linalg.norm(centres[:, None] - known_centres[None], axis=2)
+            # mediapipe sometimes flips handedness for a frame, so a mismatch
+            # only loses against a matching hand instead of ruling it out
+            mismatch = (
+                (self.handedness[:, None] != known_handedness[None])
+                & (self.handedness[:, None] != UNKNOWN_HAND)
+                & (known_handedness[None] != UNKNOWN_HAND)
+            )
+            cost = np.where(distance <= HAND_MATCH_DISTANCE, distance + mismatch * HAND_MATCH_DISTANCE, np.inf)
+
+            # greedy, cheapest pairs first
+            matched = set()
+            for row, col in zip(*np.unravel_index(np.argsort(cost, axis=None), cost.shape)):
+                if np.isinf(cost[row, col]):
+                    break
+                if ids[row] < 0 and col not in matched:
+                    ids[row] = known[col]
+                    matched.add(col)
+
+        for row in np.flatnonzero(ids < 0):
+            ids[row] = self.next_id
+            self.next_id += 1
+        for hand_id, centre, handedness in zip(ids, centres, self.handedness):
+            self.tracked[int(hand_id)] = (centre, int(handedness), self.timestamp)
+        self.hand_ids = ids
+
+        # a hand that comes back starts with fresh smoothing
+        for bank in self.filters.values():
+            bank.retain(ids.tolist())
+        self.prev_positions = {key: pos for key, pos in self.prev_positions.items() if key[0] in self.tracked}
+
+    def _next_roi(self, width, height):
+        if len(self.landmarks) == 0:
+            return None
+
+        points = self.landmarks[..., :2].reshape(-1, 2)
+        (bx0, by0), (bx1, by1) = points.min(axis=0), points.max(axis=0)
 
-        return landmark_list
+        # square box around every hand, padded so the next frame still
+        # contains the hand after it moves
+        size = max(bx1 - bx0, by1 - by0) * (1 + 2 * ROI_PADDING)
+        cx, cy = (bx0 + bx1) / 2, (by0 + by1) / 2
+        x0 = max(int(cx - size / 2), 0)
+        y0 = max(int(cy - size / 2), 0)
+        x1 = min(int(cx + size / 2), width)
+        y1 = min(int(cy + size / 2), height)
+        if x1 - x0 < 32 or y1 - y0 < 32:
+            return None
+        return (x0, y0, x1, y1)
+
+    def _draw_hands(self, frame):
+        for hand in self.landmarks:
+            points = hand[:, :2].astype(np.int32)
+            for start, end in HAND_CONNECTIONS:
+                cv2.line(frame, tuple(points[start]), tuple(points[end]), (255, 255, 255), 1)
+            for point in points:
+                cv2.circle(frame, tuple(point), 6, (255, 255, 255), 2)
+
+    def get_landmarks(self, hand_number=0):
+        # (21, 3) array shared by every consumer, None when the hand is missing
+        if len(self.landmarks) > hand_number:
+            return self.landmarks[hand_number]
+        return None
+
+    def get_hand_position(self, frame, hand_number=0):
+        landmarks = self.get_landmarks(hand_number)
+        if landmarks is None:
+            return []
+
+        points = landmarks[:, :2].astype(np.int32).tolist()
+        return [(id, x, y) for id, (x, y) in enumerate(points)]
     
+    def get_finger_positions(self, frame, finger_id):
+        # (hands, 2) int32 positions of one finger on every hand
+        if len(self.landmarks) == 0:
+            return np.empty((0, 2), dtype=np.int32)
+
+        # apply smoothing, in frame-relative units so the filter behaves the
+        # same at every processing resolution. Every hand is filtered in one pass.
+        height, width = frame.shape[:2]
+        scale = np.array([width, height], dtype=np.float64)
+        if finger_id not in self.filters:
+            self.filters[finger_id] = OneEuroFilterBank(SMOOTHING_MIN_CUTOFF, SMOOTHING_BETA)
+        ids = self.hand_ids.tolist()
+        positions = (self.filters[finger_id](ids, self.landmarks[:, finger_id, :2] / scale, self.timestamp) * scale).astype(np.int32)
+
+        for hand_id, position in zip(ids, positions.tolist()):
+            self.prev_positions[(hand_id, finger_id)] = tuple(position)
+        return positions
+
     def get_finger_position(self, frame, finger_id, hand_number=0):
-        positions = self.get_hand_position(frame, hand_number)
-        if not positions:
-            return None
-        
-        finger_pos = None
-        for id, x, y in positions:
-            if id == finger_id:
-                finger_pos = (x, y)
-                break
-
-        if finger_pos is None:
+        if self.get_landmarks(hand_number) is None:
             return None
-        
-        # apply smoothing 
-        if finger_id in self.prev_positions:
-            # simple exponential smoothing
-            alpha = 0.5
-            smooth_x = int(alpha * finger_pos[0] + (1 - alpha) * self.prev_positions[finger_id][0])
-            smooth_y = int(alpha * finger_pos[1] + (1 - alpha) * self.prev_positions[finger_id][1])
-            finger_pos = (smooth_x, smooth_y)
-
-        self.prev_positions[finger_id] = finger_pos
-        return finger_pos
+        x, y = self.get_finger_positions(frame, finger_id)[hand_number].tolist()
+        return (x, y)
+
+    def get_hands(self, frame, finger_id=INDEX_TIP):
+        return TrackedHands(
+            self.landmarks,
+            self.hand_ids,
+            self.handedness,
+            self.get_finger_positions(frame, finger_id),
+            frozenset(self.tracked),
+        )
     
     def get_finger_up_status(self, frame, hand_number=0):
-        positions = self.get_hand_position(frame, hand_number)
-        if not positions:
+        landmarks = self.get_landmarks(hand_number)
+        if landmarks is None:
             return [False] * 5 # Return all fingers down if no hand detected
-        
-        landmarks = dict([(id, (x, y)) for id, x, y in positions])
-
-        # Finger MCP (base) joints
-        finger_bases = [5, 9, 13, 17]  # Index, Middle, Ring, Pinky
-        # Finger PIP joints
-        finger_pips = [6, 10, 14, 18]  # Index, Middle, Ring, Pinky
-        # Finger tip positions
-        finger_tips = [8, 12, 16, 20]  # Index, Middle, Ring, Pinky
-        
-        fingers_up = []
-        
-        # Thumb (special case)
-        if landmarks[4][0] > landmarks[3][0]:  # For right hand
-            fingers_up.append(True)
-        else:
-            fingers_up.append(False)
-            
-        # Other fingers
-        for tip, pip in zip(finger_tips, finger_pips):
-            if landmarks[tip][1] < landmarks[pip][1]:  # Check if tip is above PIP
-                fingers_up.append(True)
-            else:
-                fingers_up.append(False)
-                
-        return fingers_up
\ No newline at end of file
+
+        # Thumb (special case), tip right of IP joint for a right hand
+        thumb_up = landmarks[THUMB_TIP, 0] > landmarks[THUMB_IP, 0]
+
+        # Other fingers, tip above PIP for Index, Middle, Ring, Pinky
+        ys = landmarks[:, 1]
+        fingers_up = ys[FINGER_TIPS] < ys[FINGER_PIPS]
+
+        return [bool(thumb_up)] + fingers_up.tolist()
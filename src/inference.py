@@ -0,0 +1,307 @@
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+from config import *
+from hand_tracker import HandModels, HandTracker, create_hands_model, extract_hands
+from logging_utils import get_logger
+
+logger = get_logger("inference")
+
+# hand inference in a pool of worker processes. Each stream of frames (a
+# camera or a session) gets a block of shared memory with a ring of frame
+# slots and room for the results, so only small tuples ever go through the
+# queues and frames are never pickled:
+#
+#   client: copy the RGB image into a free slot -> ("frame", client, slot, ticket, h, w, search)
+#   worker: mediapipe on the slot, landmarks into the slot -> (client, slot, ticket, count, error)
+#
+# the ticket numbers the frames through a slot, so a reply that comes after
+# its frame was given up on is not taken for the next frame's
+
+
+def _block_layout(slots, frame_bytes, max_hands):
+    # byte offsets of (handedness, frames) and the total size, the landmark
+    # results come first
+    landmark_bytes = slots * max_hands * 21 * 3 * 4
+    handedness_bytes = slots * max_hands
+    # frames start on a cache line
+    frames_offset = -(-(landmark_bytes + handedness_bytes) // 64) * 64
+    return landmark_bytes, frames_offset, frames_offset + slots * frame_bytes
+
+
+def _slot_arrays(buffer, slots, frame_bytes, max_hands):
+    # (slots, hands, 21, 3) float32 normalised landmarks, (slots, hands) int8
+    # handedness and (slots, frame_bytes) uint8 frames, all views of buffer
+    handedness_offset, frames_offset, _ = _block_layout(slots, frame_bytes, max_hands)
+    landmarks = np.ndarray((slots, max_hands, 21, 3), dtype=np.float32, buffer=buffer)
+    handedness = np.ndarray((slots, max_hands), dtype=np.int8, buffer=buffer, offset=handedness_offset)
+    frames = np.ndarray((slots, frame_bytes), dtype=np.uint8, buffer=buffer, offset=frames_offset)
+    return landmarks, handedness, frames
+
+
+class _AttachedClient:
+    # a worker's side of one stream: the mapped block and its own mediapipe
+    # graphs, since tracking state must not mix between streams
+    def __init__(self, name, slots, frame_bytes, max_hands, models):
+        # workers share the app's resource tracker, which the client
+        # unregisters the block from when it unlinks it
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.landmarks, self.handedness, self.frames = _slot_arrays(self.memory.buf, slots, frame_bytes, max_hands)
+        self.max_hands = max_hands
+        self.models = models
+
+    def process(self, slot, height, width, search):
+        rgb = self.frames[slot, :height * width * 3].reshape(height, width, 3)
+        landmarks, handedness = extract_hands(self.models.process(rgb, search))
+        count = min(len(landmarks), self.max_hands)
+        self.landmarks[slot, :count] = landmarks[:count]
+        self.handedness[slot, :count] = handedness[:count]
+        return count
+
+    def close(self):
+        # the views have to go before the mapping can be closed
+        self.landmarks = self.handedness = self.frames = None
+        self.memory.close()
+        self.models.close()
+
+
+def _worker_main(tasks, results, model_factory, max_hands, cpu):
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError:
+            pass
+
+    clients = {}
+    try:
+        while True:
+            message = tasks.get()
+            if message is None:
+                break
+            kind, client_id = message[:2]
+            if kind == "frame":
+                _, _, slot, ticket, height, width, search = message
+                try:
+                    results.put((client_id, slot, ticket, clients[client_id].process(slot, height, width, search), None))
+                except Exception as e:
+                    results.put((client_id, slot, ticket, 0, f"{type(e).__name__}: {e}"))
+            elif kind == "attach":
+                _, _, name, slots, frame_bytes = message
+                clients[client_id] = _AttachedClient(name, slots, frame_bytes, max_hands, HandModels(max_hands, model_factory))
+            elif kind == "detach":
+                client = clients.pop(client_id, None)
+                if client:
+                    client.close()
+    finally:
+        for client in clients.values():
+            client.close()
+
+
+class InferenceClient:
+    # one stream of frames. A stream always goes to the same worker, which
+    # keeps mediapipe's tracking state for it between frames.
+    def __init__(self, server, client_id, worker, frame_bytes, slots):
+        self.server = server
+        self.id = client_id
+        self.worker = worker
+        self.frame_bytes = frame_bytes
+        self.slots = slots
+        self.tasks = server.tasks[worker]
+
+        _, _, size = _block_layout(slots, frame_bytes, server.max_hands)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        self.landmarks, self.handedness, self.frames = _slot_arrays(self.memory.buf, slots, frame_bytes, server.max_hands)
+        self.tasks.put(("attach", self.id, self.memory.name, slots, frame_bytes))
+
+        # free slots, a stream has at most `slots` frames in flight
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.done = [threading.Event() for _ in range(slots)]
+        self.tickets = [0] * slots
+        # held while a slot's ticket changes or a reply is matched against it
+        self.ticket_lock = threading.Lock()
+        self.counts = [0] * slots
+        self.errors = [None] * slots
+        self.closed = False
+
+    def submit(self, rgb, search=False, timeout=INFERENCE_TIMEOUT):
+        # copies a contiguous RGB image into a free slot and queues it. Blocks
+        # while every slot is in flight, so a stream can never get further
+        # ahead of its worker than its slots.
+        if rgb.nbytes > self.frame_bytes:
+            raise ValueError(f"{rgb.shape} image does not fit a {self.frame_bytes} byte slot")
+        try:
+            slot = self.free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"inference worker {self.worker} is not keeping up") from None
+
+        height, width = rgb.shape[:2]
+        np.copyto(self.frames[slot, :rgb.nbytes].reshape(rgb.shape), rgb)
+        with self.ticket_lock:
+            self.tickets[slot] += 1
+            self.done[slot].clear()
+        self.tasks.put(("frame", self.id, slot, self.tickets[slot], height, width, search))
+        return slot
+
+    def result(self, slot, timeout=INFERENCE_TIMEOUT):
+        # (hands, 21, 3) normalised landmarks and (hands,) handedness of a
+        # submitted frame, frees its slot even when the worker does not answer
+        try:
+            if not self.done[slot].wait(timeout):
+                # the late reply no longer matches the slot's ticket
+                with self.ticket_lock:
+                    self.tickets[slot] += 1
+                raise TimeoutError(f"inference worker {self.worker} did not answer within {timeout} s")
+            count, error = self.counts[slot], self.errors[slot]
+            landmarks = self.landmarks[slot, :count].copy()
+            handedness = self.handedness[slot, :count].copy()
+        finally:
+            self.free.put(slot)
+        if error:
+            raise RuntimeError(f"inference worker {self.worker} failed: {error}")
+        return landmarks, handedness
+
+    def process(self, rgb, search=False):
+        # search, see HandModels
+        return self.result(self.submit(rgb, search))
+
+    def _complete(self, slot, ticket, count, error):
+        # called from the server's result thread
+        with self.ticket_lock:
+            if ticket != self.tickets[slot]:
+                return
+            self.counts[slot] = count
+            self.errors[slot] = error
+            self.done[slot].set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.tasks.put(("detach", self.id))
+        self.landmarks = self.handedness = self.frames = None
+        self.memory.close()
+        self.memory.unlink()
+        self.server._disconnect(self)
+
+
+class InferenceServer:
+    # mediapipe in worker processes, so several sessions or cameras on one
+    # machine run their inference in parallel instead of taking turns on
+    # the GIL. Streams are spread over the workers, fewest streams first.
+    def __init__(self, workers=INFERENCE_WORKERS, model_factory=create_hands_model, max_hands=MAX_HANDS,
+                 pin_cpus=INFERENCE_PIN_CPUS):
+        if workers < 1:
+            raise ValueError("an inference server needs at least one worker")
+        # fork is not safe with mediapipe's and our own threads running
+        context = multiprocessing.get_context("spawn")
+        self.max_hands = max_hands
+        self.results = context.Queue()
+        self.tasks = []
+        self.processes = []
+        # streams per worker
+        self.load = [0] * workers
+
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+        for index in range(workers):
+            tasks = context.Queue()
+            cpu = cpus[index % len(cpus)] if pin_cpus and len(cpus) > 1 else None
+            process = context.Process(
+                target=_worker_main,
+                args=(tasks, self.results, model_factory, max_hands, cpu),
+                name=f"inference-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.tasks.append(tasks)
+            self.processes.append(process)
+        logger.info("Started %d inference workers", workers)
+
+        self.clients = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.router = threading.Thread(target=self._route_results, name="inference-results", daemon=True)
+        self.router.start()
+
+    @property
+    def workers(self):
+        return len(self.processes)
+
+    def connect(self, frame_bytes, slots=INFERENCE_SLOTS):
+        # a new stream for images of up to frame_bytes
+        with self.lock:
+            worker = min(range(self.workers), key=self.load.__getitem__)
+            self.load[worker] += 1
+            client_id = self.next_id
+            self.next_id += 1
+            client = InferenceClient(self, client_id, worker, frame_bytes, slots)
+            self.clients[client_id] = client
+        return client
+
+    def _disconnect(self, client):
+        with self.lock:
+            if self.clients.pop(client.id, None) is not None:
+                self.load[client.worker] -= 1
+
+    def _route_results(self):
+        while True:
+            message = self.results.get()
+            if message is None:
+                break
+            client_id, slot, ticket, count, error = message
+            client = self.clients.get(client_id)
+            if client is not None:
+                client._complete(slot, ticket, count, error)
+
+    def close(self):
+        for client in list(self.clients.values()):
+            client.close()
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self.router.join(timeout=1.0)
+
+
+class RemoteHandTracker(HandTracker):
+    # a HandTracker whose mediapipe runs in an InferenceServer worker. The
+    # region of interest, ids and smoothing stay in this process.
+    def __init__(self, server, roi_tracking=ROI_TRACKING):
+        self.server = server
+        self.client = None
+        super().__init__(roi_tracking)
+
+    def _create_model(self):
+        pass
+
+    def find_hands(self, frame, draw=True, timestamp=None):
+        # the image sent is a crop and / or downscale of the frame, so a slot
+        # the size of the frame always fits it
+        if self.client is None or frame.nbytes > self.client.frame_bytes:
+            self.close()
+            self.client = self.server.connect(frame.nbytes)
+        return super().find_hands(frame, draw, timestamp)
+
+    def _detect(self, rgb, search=False):
+        try:
+            return self.client.process(rgb, search)
+        except TimeoutError as e:
+            # a frame the worker is too slow for has no hands, the next
+            # frames get its slot back
+            logger.warning("%s", e)
+            return np.empty((0, 21, 3), dtype=np.float32), np.empty(0, dtype=np.int8)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
@@ -0,0 +1,28 @@
+# mediapipe hand landmark indices
+WRIST = 0
+THUMB_IP = 3
+THUMB_TIP = 4
+INDEX_PIP = 6
+INDEX_TIP = 8
+MIDDLE_MCP = 9
+
+FINGER_TIPS = [8, 12, 16, 20]  # Index, Middle, Ring, Pinky
+FINGER_PIPS = [6, 10, 14, 18]
+FINGER_BASES = [5, 9, 13, 17]
+PALM_POINTS = [0, 5, 9, 13, 17]
+
+# same as mediapipe's HAND_CONNECTIONS, kept here so code that only works
+# with recorded landmarks does not need mediapipe
+HAND_CONNECTIONS = [
+    (0, 1), (1, 2), (2, 3), (3, 4),
+    (0, 5), (5, 6), (6, 7), (7, 8),
+    (5, 9), (9, 10), (10, 11), (11, 12),
+    (9, 13), (13, 14), (14, 15), (15, 16),
+    (13, 17), (0, 17), (17, 18), (18, 19), (19, 20),
+]
+
+# handedness as reported by mediapipe, stored as small ints in arrays
+LEFT_HAND = 0
+RIGHT_HAND = 1
+UNKNOWN_HAND = -1
+HANDEDNESS = {"Left": LEFT_HAND, "Right": RIGHT_HAND}
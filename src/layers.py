@@ -0,0 +1,93 @@
+import numpy as np
+
+# how a layer combines with what is under it, "multiply" darkens like a
+# highlighter, "screen" lightens and "add" glows
+BLEND_MODES = ("normal", "multiply", "screen", "add")
+
+
+class Layer:
+    # one named layer of a DrawingCanvas. image is (H, W, 4) uint8 BGRA with
+    # premultiplied colour: strokes are rasterised onto transparent black
+    # with alpha 255, so anti-aliased edges come out premultiplied already.
+    def __init__(self, name, width, height, opacity=1.0, blend="normal", visible=True):
+        if blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode {blend!r}, use one of {', '.join(BLEND_MODES)}")
+        self.name = name
+        self.opacity = float(opacity)
+        self.blend = blend
+        self.visible = visible
+        self.image = np.zeros((height, width, 4), dtype=np.uint8)
+
+    def state(self):
+        # what compositing needs, also what a frozen canvas keeps
+        return self.image, self.opacity, self.blend, self.visible
+
+
+def layer_transfer(image, opacity, blend):
+    # every blend mode turns the backdrop B under a layer into offset + gain * B
+    # per channel, all in 0-1. Returns (offset, gain) as (h, w, 3) float32.
+    colour = image[..., :3].astype(np.float32)
+    colour *= opacity / 255
+    if blend == "screen":
+        return colour, 1 - colour
+    if blend == "add":
+        return colour, np.ones_like(colour)
+    alpha = image[..., 3:].astype(np.float32)
+    alpha *= opacity / 255
+    if blend == "multiply":
+        return np.zeros_like(colour), (1 - alpha) + colour
+    return colour, np.broadcast_to(1 - alpha, colour.shape)
+
+
+def over(lower, upper):
+    # the (offset, gain) of upper applied on top of lower, None is a stack
+    # with nothing in it
+    if lower is None:
+        return upper
+    if upper is None:
+        return lower
+    return upper[0] + upper[1] * lower[0], upper[1] * lower[1]
+
+
+def flatten(layers, region=np.s_[:, :], below=None):
+    # composes layer states (see Layer.state) bottom up over a region, on
+    # top of an (offset, gain) below, into one (offset, gain). Since each
+    # layer is affine in its backdrop so is the whole stack.
+    result = below
+    for image, opacity, blend, visible in layers:
+        if visible and opacity > 0:
+            result = over(result, layer_transfer(image[region], opacity, blend))
+    return result
+
+
+def to_premultiplied(stack):
+    # (offset, gain) as the uint8 premultiplied colour and inverse alpha
+    # that two saturating passes blend with, like the UI panels do
+    offset, gain = stack
+    return (
+        np.clip(offset * 255 + 0.5, 0, 255).astype(np.uint8),
+        np.clip(gain * 255 + 0.5, 0, 255).astype(np.uint8),
+    )
+
+
+def from_premultiplied(cached, region=np.s_[:, :]):
+    # a region of a to_premultiplied buffer back as (offset, gain)
+    if cached is None:
+        return None
+    colour, inverse_alpha = cached
+    return colour[region].astype(np.float32) / 255, inverse_alpha[region].astype(np.float32) / 255
+
+
+def flatten_image(layers, background=None):
+    # the layers over a BGR background, or over black
+    stack = flatten(layers)
+    if background is None:
+        if stack is None:
+            height, width = layers[0][0].shape[:2]
+            return np.zeros((height, width, 3), dtype=np.uint8)
+        return to_premultiplied(stack)[0]
+    if stack is None:
+        return background
+    offset, gain = stack
+    image = offset + gain * (background.astype(np.float32) / 255)
+    return np.clip(image * 255 + 0.5, 0, 255).astype(np.uint8)
@@ -0,0 +1,27 @@
+import logging
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    # lets each logging call site through at most once every interval
+    # seconds, for debug output from code that runs every frame
+    def __init__(self, interval=1.0):
+        super().__init__()
+        self.interval = interval
+        self.last_emitted = {}
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        last = self.last_emitted.get(key)
+        if last is not None and now - last < self.interval:
+            return False
+        self.last_emitted[key] = now
+        return True
+
+
+def get_logger(name, rate_limit=None):
+    logger = logging.getLogger(f"aircanvas.{name}")
+    if rate_limit and not any(isinstance(f, RateLimitFilter) for f in logger.filters):
+        logger.addFilter(RateLimitFilter(rate_limit))
+    return logger
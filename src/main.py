@@ -1,223 +1,295 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from config import *
-from hand_tracker import HandTracker
-from gesture import GestureRecogniser, GestureType
-from drawing import DrawingCanvas, Tools
+from hand_tracker import TrackedHands
+from gesture import GestureType, HandGestures
+from gesture_model import Calibration, GestureModel
+from controller import (
+    create_canvas,
+    track_hands,
+    scale_to_display,
+    handle_hands,
+    handle_key,
+    handle_voice,
+    voice_commands,
+    draw_status,
+)
 from ui import UIManager
+from compositor import Compositor
+from export import Autosaver, CanvasWriter, export_path
+from governor import QualityGovernor
+from pipeline import Pipeline
+from profiling import profiler
+from sources import create_source
+from startup import StartupProfile, load_tracker, when_loaded
+from traces import TraceRecorder
+from voice import create_voice_engine
 import time
-from colours import Colours
-import threading
-import speech_recognition as sr
 
 
-last_recognized_word = None
-working_recognizer = False
-
-
-def initialise_camera():
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
-    cap.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
-
-    # Getting the actual dimensions of the camera (if it ignores the above set)
-    actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    print(f"Camera running at: {actual_width}x{actual_height}")
-
-    return cap, actual_width, actual_height
-
-
-def audio_recognition():
-    global last_recognized_word, working_recognizer
-
-    recognizer = sr.Recognizer()
-
-    microphone = sr.Microphone()
-
-    if not isinstance(recognizer, sr.Recognizer):
-        raise TypeError("`recognizer` must be `Recognizer` instance")
-
-    if not isinstance(microphone, sr.Microphone):
-        raise TypeError("`microphone` must be `Microphone` instance")
-
-    with microphone as source:
-        print(f"Energy threshold: {recognizer.energy_threshold}")
-        recognizer.adjust_for_ambient_noise(source)
-
-        while True:
-            try:
-                print("Waiting audio command ...")
-                audio = recognizer.listen(source, timeout=5, phrase_time_limit=5)
-
-                working_recognizer = True
-                time.sleep(0.5)
-                text = recognizer.recognize_google(audio, language="en-US")
-
-                print(f"You said: {text}")
-                last_recognized_word = text.lower()
-            except sr.UnknownValueError:
-                print("It was not possible to understand what you said.")
-            except sr.RequestError as e:
-                print(f"Error recognizing what was said: {e}")
-            except sr.WaitTimeoutError:
-                pass  # Timeout without audio
-            finally:
-                working_recognizer = False
+def parse_args():
+    parser = argparse.ArgumentParser(description="AirCanvas")
+    parser.add_argument("--source", help="camera index (default CAMERA_INDEX), video file, image directory or pattern, or 'synthetic'")
+    parser.add_argument("--record-trace", help="record hand landmarks to this .npz file for src/replay.py")
+    parser.add_argument("--inference-workers", type=int, default=INFERENCE_WORKERS, help="run mediapipe in this many worker processes, 0 runs it in-process")
+    parser.add_argument("--open", help="start from this exported or autosaved image")
+    parser.add_argument("--hud", action="store_true", help="start with the profiling HUD shown ('h' toggles it)")
+    parser.add_argument("--profile-csv", help="write per-stage timings to this .csv file on exit")
+    parser.add_argument("--profile-trace", help="record every timed stage and write a Chrome trace (.json) on exit")
+    parser.add_argument("--broadcast", nargs="?", type=int, const=BROADCAST_PORT, metavar="PORT", help="stream the canvas to src/viewer.py on this port (default BROADCAST_PORT)")
+    parser.add_argument("--startup-profile", action="store_true", help="print when each startup milestone was reached and exit once everything has loaded (see src/startup.py)")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+    startup = StartupProfile()
+    startup.mark("main")
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s: %(message)s")
     last_audio_command = None
-    global last_recognized_word, working_recognizer
-    cap, cam_width, cam_height = initialise_camera()
-    tracker = HandTracker()
-    gesture_recogniser = GestureRecogniser()
-    canvas = DrawingCanvas(cam_width, cam_height)
-    ui_manager = UIManager(cam_width, cam_height)
-    center = (cam_width // 2, cam_height // 2)
+    if args.profile_trace:
+        profiler.reset(trace=True)
+
+    # the hand model and the voice engine take seconds to load, they load
+    # on their own threads while the camera opens and the first frames are
+    # shown. Frames go through untracked until the hand model is ready.
+    loader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+    warm_up_size = (PROCESSING_WIDTH, PROCESSING_HEIGHT) if PROCESSING_WIDTH and PROCESSING_HEIGHT else (CAMERA_WIDTH, CAMERA_HEIGHT)
+    tracker_loading = loader.submit(load_tracker, args.inference_workers, warm_up_size)
+    voice_loading = loader.submit(create_voice_engine)
+    loader.shutdown(wait=False)
+
+    # processing happens at the camera's resolution unless a separate
+    # processing resolution is set, then the canvas uses the configured one
+    if PROCESSING_WIDTH and PROCESSING_HEIGHT:
+        source = create_source(args.source, (PROCESSING_WIDTH, PROCESSING_HEIGHT))
+        display_size = (CAMERA_WIDTH, CAMERA_HEIGHT)
+    else:
+        source = create_source(args.source)
+        display_size = (source.width, source.height)
+    processing_size = (source.width, source.height)
+    print(f"Processing at {processing_size[0]}x{processing_size[1]}, displaying at {display_size[0]}x{display_size[1]}")
+    startup.mark("camera")
+
+    gesture_model = None
+    if os.path.exists(GESTURE_MODEL):
+        try:
+            gesture_model = GestureModel.load(GESTURE_MODEL)
+            print(f"Classifying gestures with {GESTURE_MODEL}")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load {GESTURE_MODEL}, using the gesture rules: {e}")
+    hand_gestures = HandGestures(gesture_model)
+    calibration = None
+    canvas = create_canvas(*display_size)
+    compositor = Compositor(canvas)
+    ui_manager = UIManager(*display_size)
+    recorder = TraceRecorder(*processing_size) if args.record_trace else None
 
     # Set initial colour
     canvas.set_colour(ui_manager.selected_colour)
-
-    # Inicia a thread de reconhecimento de áudio
-    audio_thread = threading.Thread(target=audio_recognition, daemon=True)
-    audio_thread.start()
+    if args.open:
+        try:
+            canvas.load_image(args.open)
+        except (OSError, ValueError) as e:
+            print(f"Could not open {args.open}: {e}")
+
+    # exports and autosaves are encoded and written on background threads
+    writer = CanvasWriter()
+    autosaver = Autosaver(canvas, writer) if AUTOSAVE_PATH else None
+    export_request = None
+
+    # viewers on other screens get the tiles that changed, sent from the
+    # broadcast thread
+    broadcaster = None
+    if args.broadcast is not None:
+        # imported here, asyncio is only needed while broadcasting
+        from broadcast import BroadcastServer
+
+        try:
+            broadcaster = BroadcastServer(compositor, port=args.broadcast)
+        except (OSError, ValueError) as e:
+            print(f"Could not broadcast: {e}")
+
+    # voice commands are recognised on their own thread and picked up
+    # from a queue every frame, once the engine has loaded
+    voice = None
+    commands = voice_commands(canvas, ui_manager)
+
+    # trades inference rate, resolution and the skeleton overlay for frame
+    # rate when the machine cannot keep up
+    governor = QualityGovernor() if GOVERNOR_ENABLED else None
+    track = governor.track if governor else track_hands
+
+    def track_loaded(frame, timestamp=None):
+        # called from whichever thread runs inference
+        if not tracker_loading.done() or tracker_loading.exception():
+            return frame, TrackedHands.empty()
+        return track(tracker_loading.result()[1], frame, timestamp=timestamp)
+
+    pipeline = None
+    if PIPELINE_MODE:
+        # capture and hand inference run on their own threads, this loop only
+        # composites and displays whatever the newest finished frame is
+        pipeline = Pipeline(
+            source.read,
+            track_loaded,
+            queue_size=PIPELINE_QUEUE_SIZE,
+        )
+        pipeline.start()
+
+    show_hud = args.hud
+    hud_updated = 0.0
+    tracker_pending = True
 
     while True:
-        success, frame = cap.read()
-        if not success:
-            print("Failed to get frame from camera")
-            break
+        if pipeline:
+            packet = pipeline.get()
+            if packet is None:
+                if pipeline.finished:
+                    break
+                continue
+            frame, hands = packet.frame, packet.hands
+            timestamp = packet.timestamp
+        else:
+            timestamp = time.perf_counter()
+            with profiler.time("capture"):
+                success, frame = source.read()
+            if not success:
+                print("Failed to get frame from camera")
+                break
 
-        # flip frame if enabled because i look ugly mirrored
-        if FLIP_CAMERA:
-            frame = cv2.flip(frame, 1)
-
-        # find and draw hands
-        frame = tracker.find_hands(frame, draw=True)
-        landmark_list = tracker.get_hand_position(frame)
-
-        # recognise gesture
-        gesture = gesture_recogniser.recognise_gesture(landmark_list)
-        index_finger = tracker.get_finger_position(frame, 8) if landmark_list else None
-
-        # Handle drawing actions
-        if index_finger:
-            if gesture == GestureType.SELECT:
-                # Reset to pen when selecting
-                canvas.set_tool(Tools.PEN)
-
-                # Handle colour selection
-                colour_selected, colour_name = ui_manager.handle_selection(index_finger)
-                if colour_selected:
-                    canvas.set_colour(colour_name)
-                    print(f"Selected colour: {colour_name}")
-
-                canvas.stop_drawing()
-
-            elif gesture == GestureType.DRAW:
-                # Ensure we're using pen tool
-                canvas.set_tool(Tools.PEN)
-
-                if not canvas.drawing:
-                    canvas.start_drawing(index_finger)
-                else:
-                    canvas.draw(index_finger)
-
-            elif gesture == GestureType.ERASE:
-                # Switch to eraser tool
-                canvas.set_tool(Tools.ERASER)
-
-                # Draw eraser circle preview around finger
-                cv2.circle(
-                    frame,
-                    index_finger,
-                    canvas.eraser_thickness // 2,  # Radius is half the thickness
-                    (255, 0, 0),  # Blue circle
-                    2,
-                )  # Line thickness
-
-                if not canvas.drawing:
-                    canvas.start_drawing(index_finger)
-                else:
-                    canvas.draw(index_finger)
+            with profiler.time("inference"):
+                frame, hands = track_loaded(frame, timestamp=timestamp)
+
+        frame_ready = time.perf_counter()
+
+        if recorder:
+            recorder.add(hands.landmarks, timestamp, hands.handedness)
+
+        # recognise gestures, every hand in one pass
+        with profiler.time("gesture"):
+            gestures = hand_gestures.recognise(hands, timestamp)
+        if calibration:
+            # the hands only show gestures to learn from, nothing is drawn
+            gestures = [GestureType.NONE] * len(hands)
+            if not calibration.add(hands, timestamp):
+                hand_gestures.model = calibration.finish(hand_gestures.model)
+                calibration = None
+
+        with profiler.time("scale"):
+            frame, fingers = scale_to_display(frame, hands.fingers, display_size)
+
+        if export_request:
+            # at the frame boundary, before this frame's ink and UI go on.
+            # The frame is copied since its buffer gets reused.
+            writer.export(canvas, export_path(), frame.copy() if export_request == "camera" else None)
+            export_request = None
+        if autosaver:
+            autosaver.tick(timestamp)
+
+        with profiler.time("drawing"):
+            handle_hands(frame, gestures, hands, fingers, canvas, ui_manager)
+
+        if tracker_pending and tracker_loading.done():
+            tracker_pending = False
+            if tracker_loading.exception():
+                # missing mediapipe or model, the camera keeps running
+                print(f"Hand tracking disabled: {tracker_loading.exception()}")
             else:
-                # Stop drawing for any other gesture
-                canvas.stop_drawing()
-        else:
-            # No hand detected, stop drawing
-            canvas.stop_drawing()
-
-        if last_recognized_word:
-            if "clear" in last_recognized_word:
-                canvas.clear()
-                last_audio_command = last_recognized_word
-            elif "exit" in last_recognized_word:
+                startup.mark("tracker")
+        if voice_loading and voice_loading.done():
+            voice = voice_loading.result()
+            voice_loading = None
+            startup.mark("voice")
+
+        if voice:
+            should_exit, command_text = handle_voice(voice, commands, profiler)
+            if should_exit:
                 break
-            elif "blue" in last_recognized_word:
-                canvas.set_colour(Colours.BLUE.name)
-                ui_manager.set_colour(Colours.BLUE.name)
-                last_audio_command = last_recognized_word
-            elif "red" in last_recognized_word:
-                canvas.set_colour(Colours.RED.name)
-                ui_manager.set_colour(Colours.RED.name)
-                last_audio_command = last_recognized_word
-            elif "green" in last_recognized_word:
-                canvas.set_colour(Colours.GREEN.name)
-                ui_manager.set_colour(Colours.GREEN.name)
-                last_audio_command = last_recognized_word
-            elif "yellow" in last_recognized_word:
-                canvas.set_colour(Colours.YELLOW.name)
-                ui_manager.set_colour(Colours.YELLOW.name)
-                last_audio_command = last_recognized_word
-            elif "white" in last_recognized_word:
-                canvas.set_colour(Colours.WHITE.name)
-                ui_manager.set_colour(Colours.WHITE.name)
-                last_audio_command = last_recognized_word
-
-            last_recognized_word = None
+            last_audio_command = command_text or last_audio_command
 
         # Combine canvas with camera feed
-        # Draw canvas content
-        drawing_display = canvas.get_display()
-        # Only show camera feed where there is no drawing
-        mask = cv2.cvtColor(drawing_display, cv2.COLOR_BGR2GRAY)
-        mask = cv2.threshold(mask, 1, 255, cv2.THRESH_BINARY)[1]
-
-        # Ensure mask is uint8
-        if mask.dtype != np.uint8:
-            mask = mask.astype(np.uint8)
-
-        # Ensure mask is the same size as the frame
-        if mask.shape != frame.shape[:2]:
-            mask = cv2.resize(mask, (frame.shape[1], frame.shape[0]))
-
-        # Combine the camera feed and drawing
-        frame_bg = cv2.bitwise_and(frame, frame, mask=cv2.bitwise_not(mask))
-        drawing_fg = cv2.bitwise_and(drawing_display, drawing_display, mask=mask)
-        frame = cv2.add(frame_bg, drawing_fg)
-
-        if working_recognizer:
-            ui_manager.draw_text(frame, "Recognizing...", x=center[0] - 15, y=center[1])
-
-        # Add UI elements
-        ui_manager.draw(frame, last_audio_command)
-
-        if landmark_list:
-            cv2.putText(frame, f"Gesture: {gesture.value}", (10, CAMERA_HEIGHT - 60),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            cv2.putText(frame, f"Tool: {canvas.current_tool}", (10, CAMERA_HEIGHT - 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-
-        cv2.imshow('AirCanvas', frame)
-
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        with profiler.time("composite"):
+            frame = compositor.blend(frame)
+        if broadcaster:
+            with profiler.time("broadcast"):
+                broadcaster.tick(timestamp)
+
+        with profiler.time("ui"):
+            if tracker_pending:
+                ui_manager.set_notice("Loading hand tracking...")
+            elif calibration:
+                ui_manager.set_notice(calibration.prompt)
+            else:
+                ui_manager.set_notice("Recognizing..." if voice and voice.busy.is_set() else None)
+            # the percentiles are only re-sorted a couple of times a second
+            if show_hud and timestamp - hud_updated >= PROFILE_HUD_INTERVAL:
+                ui_manager.set_hud(profiler.hud_lines() + (governor.hud_lines() if governor else []))
+                hud_updated = timestamp
+
+            # Add UI elements
+            draw_status(ui_manager, gestures, canvas, hands)
+            ui_manager.draw(frame, last_audio_command)
+
+        with profiler.time("display"):
+            cv2.imshow('AirCanvas', frame)
+            key = cv2.waitKey(1) & 0xFF
+        startup.mark("first_frame")
+        if startup.reached("tracker"):
+            startup.mark("first_tracked_frame")
+        if governor:
+            displayed = time.perf_counter()
+            governor.update(displayed - frame_ready, displayed - timestamp, displayed)
+
+        if key == ord('q'):
             break
-
-    cap.release()
+        if args.startup_profile and not tracker_pending and not voice_loading:
+            break
+        if key == ord('h'):
+            show_hud = not show_hud
+            hud_updated = 0.0
+            ui_manager.set_hud(None)
+        elif key == ord('x'):
+            export_request = "canvas"
+        elif key == ord('c'):
+            export_request = "camera"
+        elif key == ord('k') and calibration is None:
+            calibration = Calibration(*processing_size)
+        handle_key(key, canvas)
+
+    if pipeline:
+        pipeline.stop()
+        if pipeline.error:
+            print(f"Stopped after an error: {pipeline.error!r}")
+    # whatever is still loading is shut down once it has loaded, instead of
+    # keeping the window open until then
+    if voice_loading:
+        when_loaded(voice_loading, lambda voice: voice and voice.stop())
+    elif voice:
+        voice.stop()
+    source.release()
+    if autosaver:
+        autosaver.save(wait=True)
+    writer.close()
+    if broadcaster:
+        broadcaster.close()
+    when_loaded(tracker_loading, lambda loaded: loaded[0] and loaded[0].close())
     cv2.destroyAllWindows()
+    if recorder:
+        recorder.save(args.record_trace)
+    print(profiler.summary())
+    if args.startup_profile:
+        startup.report()
+    if args.profile_csv:
+        profiler.export_csv(args.profile_csv)
+    if args.profile_trace:
+        profiler.export_chrome_trace(args.profile_trace)
+    if pipeline and pipeline.error:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+from logging_utils import get_logger
+from profiling import profiler
+
+logger = get_logger("pipeline")
+
+
+class FramePacket:
+    __slots__ = ("seq", "timestamp", "frame", "hands")
+
+    def __init__(self, seq, frame):
+        self.seq = seq
+        self.timestamp = time.perf_counter()
+        self.frame = frame
+        self.hands = None
+
+
+class FrameQueue:
+    # bounded queue that drops the oldest item when full, so a slow consumer
+    # always picks up the freshest frame instead of building up latency
+    def __init__(self, maxsize=2):
+        self.items = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Pipeline:
+    # capture -> inference run on worker threads, the caller (main thread)
+    # pulls finished packets and does compositing / display
+    def __init__(self, read_frame, track_hands, queue_size=2, stats=None):
+        self.read_frame = read_frame
+        self.track_hands = track_hands
+        self.capture_queue = FrameQueue(queue_size)
+        self.output_queue = FrameQueue(queue_size)
+        self.stats = stats if stats is not None else profiler
+        self.running = False
+        self.last_seq = -1
+        self.threads = []
+        # the exception a worker thread stopped on, the pipeline finishes
+        # after it instead of waiting for frames that never come
+        self.error = None
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name="capture", daemon=True),
+            threading.Thread(target=self._inference_loop, name="inference", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.capture_queue.close()
+        self.output_queue.close()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+
+    @property
+    def finished(self):
+        return self.output_queue.closed and not self.output_queue.items
+
+    def get(self, timeout=0.1):
+        packet = self.output_queue.get(timeout)
+        if packet is None:
+            return None
+        # a packet can never arrive out of order with a single worker, but
+        # guard anyway so compositing never goes backwards in time
+        if packet.seq <= self.last_seq:
+            return None
+        self.stats.skipped_frames += packet.seq - self.last_seq - 1
+        self.last_seq = packet.seq
+        return packet
+
+    def _fail(self, stage, error):
+        logger.error("%s thread stopped", stage, exc_info=error)
+        if self.error is None:
+            self.error = error
+
+    def _capture_loop(self):
+        seq = 0
+        try:
+            while self.running:
+                with self.stats.time("capture"):
+                    success, frame = self.read_frame()
+                if not success:
+                    print("Failed to get frame from camera")
+                    break
+                self.capture_queue.put(FramePacket(seq, frame))
+                seq += 1
+        except Exception as e:
+            self._fail("capture", e)
+        finally:
+            self.capture_queue.close()
+
+    def _inference_loop(self):
+        try:
+            while self.running:
+                packet = self.capture_queue.get(timeout=0.1)
+                if packet is None:
+                    if self.capture_queue.closed:
+                        break
+                    continue
+                with self.stats.time("inference"):
+                    packet.frame, packet.hands = self.track_hands(packet.frame)
+                self.output_queue.put(packet)
+        except Exception as e:
+            self._fail("inference", e)
+        finally:
+            # the capture thread stops too, nothing would take its frames
+            self.running = False
+            self.output_queue.close()
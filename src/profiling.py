@@ -0,0 +1,208 @@
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+from config import PROFILING, PROFILE_TRACE_EVENTS, PROFILE_WINDOW
+
+
+class StageStats:
+    # totals since the start, plus the most recent `window` samples in a
+    # ring buffer for rolling percentiles. keep_samples keeps every sample
+    # instead, for exact percentiles over a whole (replay) run.
+    def __init__(self, window=PROFILE_WINDOW, keep_samples=False):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.window = np.zeros(window, dtype=np.float64)
+        self.samples = [] if keep_samples else None
+
+    def add(self, seconds):
+        self.window[self.count % len(self.window)] = seconds
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+        if self.samples is not None:
+            self.samples.append(seconds)
+
+    def recent(self):
+        return self.window[:min(self.count, len(self.window))]
+
+    def percentile_ms(self, q):
+        samples = np.sort(self.samples if self.samples is not None else self.recent())
+        if not len(samples):
+            return 0.0
+        index = min(int(round(q / 100 * (len(samples) - 1))), len(samples) - 1)
+        return 1000 * float(samples[index])
+
+    @property
+    def avg_ms(self):
+        return 1000 * self.total / self.count if self.count else 0.0
+
+
+class _Timer:
+    __slots__ = ("profiler", "stage", "start")
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler.add(self.stage, end - self.start, self.start)
+        return False
+
+
+class _NullTimer:
+    # shared by every disabled timer, so timing costs one attribute check
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Profiler:
+    # per-stage timings for the whole app. Stages are timed with
+    #   with profiler.time("stage"): ...
+    # or the @profiler.timed("stage") decorator, from any thread.
+    def __init__(self, enabled=PROFILING, keep_samples=False):
+        self.enabled = enabled
+        self.reset(keep_samples)
+
+    def reset(self, keep_samples=False, trace=False):
+        self.keep_samples = keep_samples
+        self.stages = {}
+        self.skipped_frames = 0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        # (stage, thread id, start, duration) for the Chrome trace export,
+        # only recorded while tracing
+        self.events = deque(maxlen=PROFILE_TRACE_EVENTS) if trace else None
+        self.thread_names = {}
+        self.hud_mark = (self.started, 0)
+
+    @property
+    def tracing(self):
+        return self.events is not None
+
+    def time(self, stage):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def timed(self, stage):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Timer(self, stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, stage, seconds, start=None):
+        if not self.enabled:
+            return
+        stats = self.stages.get(stage)
+        if stats is None:
+            with self.lock:
+                stats = self.stages.setdefault(stage, StageStats(keep_samples=self.keep_samples))
+        stats.add(seconds)
+
+        if self.events is not None:
+            thread = threading.current_thread()
+            self.thread_names.setdefault(thread.ident, thread.name)
+            start = time.perf_counter() - seconds if start is None else start
+            self.events.append((stage, thread.ident, start, seconds))
+
+    def percentiles(self, stage):
+        # rolling (p50, p95, p99) in ms
+        stats = self.stages[stage]
+        return tuple(stats.percentile_ms(q) for q in (50, 95, 99))
+
+    def hud_lines(self):
+        lines = [f"{'stage':<12}{'p50':>7}{'p95':>7}{'p99':>7} ms"]
+        for name, stats in list(self.stages.items()):
+            p50, p95, p99 = (stats.percentile_ms(q) for q in (50, 95, 99))
+            lines.append(f"{name:<12}{p50:7.2f}{p95:7.2f}{p99:7.2f}")
+        if "display" in self.stages:
+            # frame rate since the previous call
+            now, count = time.perf_counter(), self.stages["display"].count
+            last_time, last_count = self.hud_mark
+            if now > last_time and count > last_count:
+                lines.append(f"fps {(count - last_count) / (now - last_time):.1f}")
+            self.hud_mark = (now, count)
+        return lines
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        lines = []
+        for name, stats in self.stages.items():
+            lines.append(
+                f"{name:>10}: {stats.count:6d} calls, avg {stats.avg_ms:7.2f} ms, "
+                f"p50 {stats.percentile_ms(50):7.2f} ms, p95 {stats.percentile_ms(95):7.2f} ms, "
+                f"p99 {stats.percentile_ms(99):7.2f} ms, max {1000 * stats.max:7.2f} ms"
+            )
+        if "display" in self.stages and elapsed > 0:
+            lines.append(f"{'fps':>10}: {self.stages['display'].count / elapsed:.1f}")
+        lines.append(f"{'skipped':>10}: {self.skipped_frames} frames")
+        return "\n".join(lines)
+
+    def export_csv(self, path):
+        # one row per stage
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+            for name, stats in self.stages.items():
+                writer.writerow([
+                    name,
+                    stats.count,
+                    round(stats.avg_ms, 4),
+                    *(round(stats.percentile_ms(q), 4) for q in (50, 95, 99)),
+                    round(1000 * stats.max, 4),
+                ])
+        print(f"Wrote stage timings to {path}")
+
+    def export_chrome_trace(self, path):
+        # trace-event JSON, open it in chrome://tracing or ui.perfetto.dev
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.thread_names.items()
+        ]
+        events.extend(
+            {
+                "name": stage,
+                "ph": "X",
+                "pid": pid,
+                "tid": tid,
+                "ts": round((start - self.started) * 1e6, 3),
+                "dur": round(seconds * 1e6, 3),
+            }
+            for stage, tid, start, seconds in list(self.events or ())
+        )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Wrote {len(events) - len(self.thread_names)} trace events to {path}")
+
+
+# shared by every module, so stages deep inside e.g. the hand tracker are
+# timed without passing a stats object around
+profiler = Profiler()
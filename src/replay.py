@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import json
+import platform
+import sys
+import time
+from collections import Counter
+import cv2
+import numpy as np
+from config import *
+from gesture import GestureType, HandGestures
+from compositor import Compositor
+from ui import UIManager
+from controller import create_canvas, track_hands, scale_to_display, handle_hands, draw_status
+from profiling import profiler
+from sources import create_source
+from traces import LandmarkTrace, TraceRecorder, TraceTracker
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class VideoSource:
+    # a video, image sequence or synthetic frames (see sources.create_source)
+    # run through the real hand tracker
+    def __init__(self, path):
+        from hand_tracker import HandTracker
+
+        self.frames = create_source(path)
+        self.width = self.frames.width
+        self.height = self.frames.height
+        self.fps = self.frames.fps
+        self.tracker = HandTracker()
+
+    def read(self, index):
+        return self.frames.read()
+
+    def timestamp(self, index):
+        return index / self.fps
+
+    def release(self):
+        self.frames.release()
+
+
+class TraceSource:
+    def __init__(self, path):
+        self.trace = LandmarkTrace(path)
+        self.width = self.trace.width
+        self.height = self.trace.height
+        self.tracker = TraceTracker(self.trace)
+        self.background = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+
+    def read(self, index):
+        if index >= len(self.trace):
+            return False, None
+        return True, self.background.copy()
+
+    def timestamp(self, index):
+        return float(self.trace.timestamps[index])
+
+    def release(self):
+        pass
+
+
+def run_headless(source_path, max_frames=None, record_trace=None, draw_landmarks=False, display_size=None):
+    # the same per-frame work as main.main, minus the window
+    source = TraceSource(source_path) if source_path.endswith(".npz") else VideoSource(source_path)
+    display_size = display_size or (source.width, source.height)
+    hand_gestures = HandGestures()
+    canvas = create_canvas(*display_size)
+    compositor = Compositor(canvas)
+    ui_manager = UIManager(*display_size)
+    canvas.set_colour(ui_manager.selected_colour)
+
+    recorder = TraceRecorder(source.width, source.height) if record_trace else None
+    # every sample is kept so the percentiles cover the whole run
+    profiler.reset(keep_samples=True, trace=profiler.tracing)
+    stats = profiler
+    gestures = Counter()
+    hand_counts = Counter()
+
+    frames = 0
+    started = time.perf_counter()
+    while max_frames is None or frames < max_frames:
+        frame_start = time.perf_counter()
+        with stats.time("capture"):
+            success, frame = source.read(frames)
+        if not success:
+            break
+
+        with stats.time("tracking"):
+            frame, hands = track_hands(source.tracker, frame, draw_landmarks, source.timestamp(frames))
+        if recorder:
+            recorder.add(hands.landmarks, source.timestamp(frames), hands.handedness)
+        hand_counts[len(hands)] += 1
+
+        with stats.time("gesture"):
+            frame_gestures = hand_gestures.recognise(hands, source.timestamp(frames))
+        # per hand per frame, frames without a hand count as none
+        gestures.update(gesture.value for gesture in frame_gestures or [GestureType.NONE])
+
+        with stats.time("scale"):
+            frame, fingers = scale_to_display(frame, hands.fingers, display_size)
+
+        with stats.time("drawing"):
+            handle_hands(frame, frame_gestures, hands, fingers, canvas, ui_manager)
+
+        with stats.time("composite"):
+            frame = compositor.blend(frame)
+
+        with stats.time("ui"):
+            draw_status(ui_manager, frame_gestures, canvas, hands)
+            ui_manager.draw(frame, None)
+
+        stats.add("frame", time.perf_counter() - frame_start)
+        frames += 1
+
+    elapsed = time.perf_counter() - started
+    # duration of the recorded input, not of the replay
+    duration = source.timestamp(frames - 1) if frames > 1 else 0.0
+    source.release()
+    canvas.stop_drawing()
+    if recorder:
+        recorder.save(record_trace)
+
+    return {
+        "source": source_path,
+        "mode": type(source).__name__,
+        "frames": frames,
+        "resolution": [source.width, source.height],
+        "display_resolution": list(display_size),
+        "settings": {
+            "ROI_TRACKING": ROI_TRACKING,
+            "MAX_HANDS": MAX_HANDS,
+            "CANVAS_BACKEND": CANVAS_BACKEND,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+        },
+        "stages": {
+            name: {
+                "count": stage.count,
+                "mean_ms": round(stage.avg_ms, 3),
+                "p50_ms": round(stage.percentile_ms(50), 3),
+                "p95_ms": round(stage.percentile_ms(95), 3),
+                "p99_ms": round(stage.percentile_ms(99), 3),
+                "max_ms": round(1000 * stage.max, 3),
+            }
+            for name, stage in stats.stages.items()
+        },
+        "fps": round(frames / elapsed, 2) if elapsed > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+        # deterministic outputs, these should only change with behaviour
+        "gestures": dict(sorted(gestures.items())),
+        # number of frames with 0, 1, 2... hands, and distinct hand ids seen
+        "hands": {str(count): frames for count, frames in sorted(hand_counts.items())},
+        "hand_ids": source.tracker.next_id,
+        # per-frame classifications vs debounced gesture state changes
+        "gesture_transitions": {
+            "raw": hand_gestures.raw_transitions,
+            "debounced": hand_gestures.transitions,
+            "raw_per_s": round(hand_gestures.raw_transitions / duration, 3) if duration > 0 else None,
+            "debounced_per_s": round(hand_gestures.transitions / duration, 3) if duration > 0 else None,
+        },
+        "strokes": canvas.history.position,
+        "canvas_sha256": hashlib.sha256(canvas.to_image().tobytes()).hexdigest(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run AirCanvas headless on a video or a recorded landmark trace")
+    parser.add_argument("source", help="video file, image directory or pattern, 'synthetic', or a .npz landmark trace")
+    parser.add_argument("--frames", type=int, default=None, help="stop after this many frames")
+    parser.add_argument("--report", help="write the JSON report here instead of stdout")
+    parser.add_argument("--record-trace", help="record the landmarks seen during the run to this .npz file")
+    parser.add_argument("--display-size", help="canvas resolution as WIDTHxHEIGHT, defaults to the source resolution")
+    parser.add_argument("--draw-landmarks", action="store_true", help="include the landmark overlay in the timings")
+    parser.add_argument("--profile-trace", help="write every timed stage as a Chrome trace (.json)")
+    args = parser.parse_args()
+
+    if args.profile_trace:
+        profiler.reset(trace=True)
+
+    display_size = tuple(int(v) for v in args.display_size.split("x")) if args.display_size else None
+    report = run_headless(args.source, args.frames, args.record_trace, args.draw_landmarks, display_size)
+    if args.profile_trace:
+        profiler.export_chrome_trace(args.profile_trace)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text + "\n")
+        print(f"Wrote report to {args.report}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import glob
+import os
+import threading
+import time
+import cv2
+import numpy as np
+from config import *
+from profiling import profiler
+
+# CAMERA_API names -> OpenCV capture backends
+CAMERA_APIS = {
+    "v4l2": cv2.CAP_V4L2,
+    "dshow": cv2.CAP_DSHOW,
+    "msmf": cv2.CAP_MSMF,
+    "avfoundation": cv2.CAP_AVFOUNDATION,
+    "gstreamer": cv2.CAP_GSTREAMER,
+    "ffmpeg": cv2.CAP_FFMPEG,
+}
+
+
+def fourcc_name(value):
+    value = int(value)
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip("\0")
+
+
+class FrameSource:
+    # where frames come from. read() returns (success, frame) like
+    # cv2.VideoCapture, with the frame resized to size and flipped. Frames
+    # are written into a ring of preallocated buffers instead of allocated,
+    # so a frame stays valid for the next `buffers - 1` reads.
+    def __init__(self, size=None, flip=FLIP_CAMERA, buffers=FRAME_BUFFERS):
+        self.size = size
+        self.flip = flip
+        self.buffer_count = buffers
+        self.buffers = []
+        self.next_buffer = 0
+        self.scaled = None
+        self.width = self.height = None
+        self.fps = CAMERA_FPS
+
+    def _set_native_size(self, width, height):
+        # the size frames come out at, after any resize
+        self.width, self.height = self.size or (width, height)
+
+    def read(self):
+        success, raw = self._read_raw()
+        if not success:
+            return False, None
+        return True, self._finish(raw)
+
+    def _read_raw(self):
+        raise NotImplementedError
+
+    @profiler.timed("flip")
+    def _finish(self, raw):
+        # the camera may ignore the requested resolution
+        if self.size is not None and (raw.shape[1], raw.shape[0]) != self.size:
+            self.scaled = cv2.resize(raw, self.size, dst=self.scaled, interpolation=cv2.INTER_AREA)
+            raw = self.scaled
+
+        if not self.buffers or self.buffers[0].shape != raw.shape:
+            self.buffers = [np.empty_like(raw) for _ in range(self.buffer_count)]
+        frame = self.buffers[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % self.buffer_count
+
+        # flip frame if enabled because i look ugly mirrored
+        if self.flip:
+            cv2.flip(raw, 1, dst=frame)
+        else:
+            np.copyto(frame, raw)
+        return frame
+
+    def release(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    def __init__(self, index=CAMERA_INDEX, size=None, threaded=CAMERA_THREADED, **kwargs):
+        super().__init__(size, **kwargs)
+        self.cap = cv2.VideoCapture(index, CAMERA_APIS.get(CAMERA_API, cv2.CAP_ANY))
+        if not self.cap.isOpened():
+            raise OSError(f"Could not open camera {index}")
+
+        # the format has to be negotiated before the size, many webcams only
+        # deliver their higher resolutions at full frame rate as MJPEG
+        if CAMERA_FOURCC:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*CAMERA_FOURCC))
+        width, height = size or (CAMERA_WIDTH, CAMERA_HEIGHT)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.cap.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
+        # keep the driver from queueing stale frames, where supported
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        # Getting the actual dimensions of the camera (if it ignores the above set)
+        actual_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        actual_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or CAMERA_FPS
+        self.fourcc = fourcc_name(self.cap.get(cv2.CAP_PROP_FOURCC))
+        self._set_native_size(actual_width, actual_height)
+        print(f"Camera running at: {actual_width}x{actual_height} {self.fps:.0f} fps {self.fourcc or '?'}")
+        if CAMERA_FOURCC and self.fourcc and self.fourcc != CAMERA_FOURCC:
+            print(f"Camera did not accept {CAMERA_FOURCC}, using {self.fourcc}")
+
+        # the grab thread reads into back and swaps it with front, read()
+        # only ever sees the newest frame and never waits on the driver's queue
+        self.threaded = threaded
+        self.front = None
+        self.back = None
+        self.seq = 0
+        self.read_seq = 0
+        self.dropped = 0
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = None
+        if threaded:
+            self.running = True
+            self.thread = threading.Thread(target=self._grab_loop, name="grab", daemon=True)
+            self.thread.start()
+
+    def _grab_loop(self):
+        while self.running:
+            success, self.back = self.cap.read(self.back)
+            with self.condition:
+                if not success:
+                    self.running = False
+                    self.condition.notify_all()
+                    break
+                if self.seq > self.read_seq:
+                    # the previous frame was never read
+                    self.dropped += 1
+                self.front, self.back = self.back, self.front
+                self.seq += 1
+                self.condition.notify_all()
+
+    def read(self):
+        if not self.threaded:
+            return super().read()
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > self.read_seq or not self.running, timeout=1.0)
+            if self.seq == self.read_seq:
+                return False, None
+            self.read_seq = self.seq
+            # under the lock so the grab thread cannot swap front meanwhile
+            return True, self._finish(self.front)
+
+    def _read_raw(self):
+        success, self.back = self.cap.read(self.back)
+        return success, self.back
+
+    def release(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self.cap.release()
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, size=None, loop=False, **kwargs):
+        super().__init__(size, **kwargs)
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or CAMERA_FPS
+        self.loop = loop
+        self.raw = None
+        self._set_native_size(int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def _read_raw(self):
+        success, self.raw = self.cap.read(self.raw)
+        if not success and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, self.raw = self.cap.read(self.raw)
+        return success, self.raw
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource(FrameSource):
+    # a directory of images or a glob pattern, in sorted order
+    def __init__(self, pattern, size=None, fps=CAMERA_FPS, loop=False, **kwargs):
+        super().__init__(size, **kwargs)
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        extensions = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+        self.paths = sorted(p for p in glob.glob(pattern) if p.lower().endswith(extensions))
+        if not self.paths:
+            raise ValueError(f"No images match {pattern}")
+        self.fps = fps
+        self.loop = loop
+        self.index = 0
+        first = cv2.imread(self.paths[0])
+        self._set_native_size(first.shape[1], first.shape[0])
+
+    def _read_raw(self):
+        if self.index >= len(self.paths):
+            if not self.loop:
+                return False, None
+            self.index = 0
+        image = cv2.imread(self.paths[self.index])
+        self.index += 1
+        return image is not None, image
+
+
+class SyntheticSource(FrameSource):
+    # generated frames for running without any camera or files, a
+    # gradient with a moving disc so every frame differs
+    def __init__(self, size=None, fps=CAMERA_FPS, frames=None, realtime=False, **kwargs):
+        super().__init__(size, **kwargs)
+        width, height = size or (CAMERA_WIDTH, CAMERA_HEIGHT)
+        self._set_native_size(width, height)
+        self.fps = fps
+        self.frames = frames
+        self.realtime = realtime
+        self.index = 0
+        self.started = None
+
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self.background = np.stack(
+            [np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), np.full((height, width), 96, np.float32)],
+            axis=2,
+        ).astype(np.uint8)
+        self.raw = np.empty_like(self.background)
+
+    def _read_raw(self):
+        if self.frames is not None and self.index >= self.frames:
+            return False, None
+        if self.realtime:
+            # paced like a camera
+            if self.started is None:
+                self.started = time.perf_counter()
+            time.sleep(max(self.started + self.index / self.fps - time.perf_counter(), 0))
+
+        np.copyto(self.raw, self.background)
+        t = self.index / self.fps
+        centre = (
+            int(self.width * (0.5 + 0.35 * np.cos(t))),
+            int(self.height * (0.5 + 0.35 * np.sin(1.3 * t))),
+        )
+        cv2.circle(self.raw, centre, max(self.height // 10, 1), (40, 160, 230), -1)
+        self.index += 1
+        return True, self.raw
+
+
+def create_source(spec=None, size=None, **kwargs):
+    # None or a number is a camera index, "synthetic" generates frames, a
+    # directory or a pattern with * is an image sequence, anything else a video
+    if spec is None:
+        return CameraSource(CAMERA_INDEX, size, **kwargs)
+    if str(spec).isdigit():
+        return CameraSource(int(spec), size, **kwargs)
+    if spec == "synthetic":
+        return SyntheticSource(size, **kwargs)
+    if os.path.isdir(spec) or any(c in spec for c in "*?["):
+        return ImageSequenceSource(spec, size, **kwargs)
+    return VideoFileSource(spec, size, **kwargs)
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from config import *
+
+# main.py --startup-profile prints its milestones on one line starting with this
+MILESTONE_PREFIX = "startup milestones: "
+# in the order they normally happen
+MILESTONES = ("main", "camera", "first_frame", "tracker", "first_tracked_frame", "voice")
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def load_tracker(workers=INFERENCE_WORKERS, warm_up_size=None):
+    # runs on a startup thread while the camera opens: imports mediapipe,
+    # builds the hand model (in worker processes with workers > 0) and warms
+    # it up. Returns (InferenceServer or None, tracker).
+    if workers:
+        # imported here, shared memory and multiprocessing are only needed
+        # with workers
+        from inference import InferenceServer, RemoteHandTracker
+
+        server = InferenceServer(workers)
+        tracker = RemoteHandTracker(server)
+    else:
+        from hand_tracker import HandTracker
+
+        server, tracker = None, HandTracker()
+    if warm_up_size:
+        tracker.warm_up(*warm_up_size)
+    return server, tracker
+
+
+def when_loaded(loading, close):
+    # calls close(result) on what a startup future loads, now if it is done
+    # or else once it is, so shutting down never waits for a slow load.
+    # Nothing is called when it was never started or failed.
+    if loading.cancel():
+        return
+    loading.add_done_callback(lambda future: future.exception() is None and close(future.result()))
+
+
+class StartupProfile:
+    # wall clock time of each startup milestone, the first time it is reached
+    def __init__(self):
+        self.times = {}
+
+    def mark(self, name):
+        self.times.setdefault(name, time.time())
+
+    def reached(self, name):
+        return name in self.times
+
+    def report(self):
+        print(MILESTONE_PREFIX + json.dumps(self.times), flush=True)
+
+
+def parse_import_times(stderr):
+    # python -X importtime output -> {module: (self s, cumulative s)} of the
+    # modules imported directly by the script, not their dependencies
+    imports = {}
+    for own, cumulative, indent, name in IMPORT_TIME.findall(stderr):
+        if not indent:
+            imports[name] = (int(own) / 1e6, int(cumulative) / 1e6)
+    return imports
+
+
+def profile_run(source, timeout):
+    # main.py from launch until it has loaded everything, returns
+    # (milestone -> seconds after launch, imports)
+    command = [sys.executable, "-X", "importtime", os.path.join(os.path.dirname(__file__), "main.py"), "--startup-profile"]
+    if source is not None:
+        command += ["--source", source]
+    launched = time.time()
+    run = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    for line in run.stdout.splitlines():
+        if line.startswith(MILESTONE_PREFIX):
+            times = json.loads(line[len(MILESTONE_PREFIX):])
+            return {name: at - launched for name, at in times.items()}, parse_import_times(run.stderr)
+    raise RuntimeError(f"main.py exited with {run.returncode} before reporting:\n{run.stdout}{run.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time AirCanvas startup: imports and time to the first frame")
+    parser.add_argument("--source", help="source for main.py, e.g. 'synthetic' to leave the camera out")
+    parser.add_argument("--runs", type=int, default=3, help="launches to take the median of")
+    parser.add_argument("--imports", type=int, default=10, help="slowest direct imports to list")
+    parser.add_argument("--max-first-frame", type=float, help="exit with an error when the first frame takes longer (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for each launch")
+    args = parser.parse_args()
+
+    runs = [profile_run(args.source, args.timeout) for _ in range(args.runs)]
+
+    print(f"Seconds after launch, median of {args.runs}:")
+    for name in MILESTONES:
+        times = [milestones[name] for milestones, _ in runs if name in milestones]
+        if times:
+            print(f"  {name:>26}: {statistics.median(times):7.3f}")
+        else:
+            print(f"  {name:>26}: not reached")
+
+    print("Slowest imports, cumulative s (own s):")
+    modules = {name for _, imports in runs for name in imports}
+    medians = {
+        name: tuple(statistics.median(imports[name][i] for _, imports in runs if name in imports) for i in (0, 1))
+        for name in modules
+    }
+    for name, (own, cumulative) in sorted(medians.items(), key=lambda item: -item[1][1])[:args.imports]:
+        print(f"  {name:>26}: {cumulative:7.3f} ({own:.3f})")
+
+    first_frame = statistics.median(milestones.get("first_frame", float("inf")) for milestones, _ in runs)
+    if args.max_first_frame is not None and first_frame > args.max_first_frame:
+        print(f"First frame took {first_frame:.3f} s, over the {args.max_first_frame:.3f} s budget")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+import os
+from enum import Enum
+import cv2
+import numpy as np
+from layers import BLEND_MODES, flatten_image
+
+
+class Tools(Enum):
+    PEN = 1
+    ERASER = 2
+    LINE = 3
+    RECTANGLE = 4
+    ELLIPSE = 5
+    # freehand that becomes a line, rectangle or ellipse when it is close
+    # enough to one, only ever stored as one of those or as a PEN stroke
+    SNAP = 6
+
+
+# dragged out from the pinch to the release, stored as two corner points
+SHAPE_TOOLS = (Tools.LINE, Tools.RECTANGLE, Tools.ELLIPSE)
+SHAPE_TOOL_VALUES = frozenset(tool.value for tool in SHAPE_TOOLS)
+
+
+STROKE = 0
+CLEAR = 1
+
+SESSION_MAGIC = b"ACVS"
+SESSION_VERSION = 4
+
+HEADER_FIELDS = [
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("width", "<u4"),
+    ("height", "<u4"),
+    ("commands", "<u4"),
+    ("points", "<u8"),
+]
+HEADER_DTYPE = np.dtype(HEADER_FIELDS + [("layers", "<u2")])
+COMMAND_FIELDS = [
+    ("kind", "u1"),
+    ("tool", "u1"),
+    ("colour", "u1", 3),
+    ("thickness", "<u2"),
+    ("start", "<u8"),
+    ("count", "<u4"),
+]
+# the stroke has a width per point, see Stroke.widths, and the index of the
+# layer it is on
+COMMAND_DTYPE = np.dtype(COMMAND_FIELDS + [("variable", "u1"), ("layer", "u1")])
+# version 1 and 2 files have no variable strokes and no widths block,
+# version 3 files no layers. Version 1 only differs from 2 in being drawn
+# with straight segments, its strokes now replay as splines.
+SESSION_DTYPES = {
+    1: (np.dtype(HEADER_FIELDS), np.dtype(COMMAND_FIELDS)),
+    2: (np.dtype(HEADER_FIELDS), np.dtype(COMMAND_FIELDS)),
+    3: (np.dtype(HEADER_FIELDS), np.dtype(COMMAND_FIELDS + [("variable", "u1")])),
+    4: (HEADER_DTYPE, COMMAND_DTYPE),
+}
+# the layer stack follows the command table, blend is an index into BLEND_MODES
+LAYER_DTYPE = np.dtype([
+    ("name", "S32"),
+    ("opacity", "<f4"),
+    ("blend", "u1"),
+    ("visible", "u1"),
+])
+
+
+class Stroke:
+    # one pen or eraser stroke, points is an (N, 2) int32 array. A shape is
+    # a stroke of its two corners (or the ends of a line). A variable stroke
+    # also has an (N,) float32 width per point, e.g. from pinch pressure,
+    # and thickness is only its nominal width.
+    kind = STROKE
+
+    def __init__(self, tool, colour, thickness, points=None, widths=None, variable=False, layer=0):
+        self.tool = tool
+        self.colour = tuple(int(c) for c in colour)
+        self.thickness = int(thickness)
+        self.layer = layer
+        if points is None:
+            self._points = np.empty((16, 2), dtype=np.int32)
+            self._widths = np.empty(16, dtype=np.float32) if variable else None
+            self.count = 0
+        else:
+            self._points = points
+            self._widths = widths
+            self.count = len(points)
+
+    @property
+    def points(self):
+        return self._points[:self.count]
+
+    @property
+    def variable(self):
+        return self._widths is not None
+
+    @property
+    def widths(self):
+        return None if self._widths is None else self._widths[:self.count]
+
+    def add_point(self, point, width=None):
+        # width is ignored by fixed width strokes, a variable stroke keeps
+        # its nominal thickness where it is not given
+        if self.count == len(self._points):
+            grown = np.empty((2 * len(self._points), 2), dtype=np.int32)
+            grown[:self.count] = self._points[:self.count]
+            self._points = grown
+            if self._widths is not None:
+                widths = np.empty(len(grown), dtype=np.float32)
+                widths[:self.count] = self._widths[:self.count]
+                self._widths = widths
+        self._points[self.count] = point
+        if self._widths is not None:
+            self._widths[self.count] = self.thickness if width is None else width
+        self.count += 1
+
+
+class ClearCommand:
+    kind = CLEAR
+
+
+# curve samples are rasterised with this many fractional bits
+SUBPIXEL_SHIFT = 3
+# distance in px between samples along a curved segment
+SPLINE_STEP = 4
+# outline points on each round end of a variable width segment
+CAP_STEPS = 12
+# half a turn from the left side to the right clockwise, as unit complex
+# numbers relative to the normal, and a whole turn for dots
+_CAP = np.exp(-1j * np.linspace(0.0, np.pi, CAP_STEPS))
+_CIRCLE = np.exp(1j * np.linspace(0.0, 2 * np.pi, 2 * CAP_STEPS, endpoint=False))
+
+
+def catmull_rom(p0, p1, p2, p3, samples):
+    # uniform Catmull-Rom curve from p1 to p2, (samples, 2) float array
+    t = np.linspace(0.0, 1.0, samples)[:, None]
+    t2 = t * t
+    t3 = t2 * t
+    return 0.5 * (
+        2 * p1
+        + (p2 - p0) * t
+        + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t2
+        + (3 * p1 - p0 - 3 * p2 + p3) * t3
+    )
+
+
+def segment_curve(points, index):
+    # curve from points[index - 1] to points[index]. It bends towards
+    # points[index + 1], so live drawing renders each segment once the next
+    # point is known and the last one when the stroke ends.
+    count = len(points)
+    p1 = points[index - 1].astype(np.float64)
+    p2 = points[index].astype(np.float64)
+    p0 = points[index - 2].astype(np.float64) if index >= 2 else p1
+    p3 = points[index + 1].astype(np.float64) if index + 1 < count else p2
+
+    length = float(np.hypot(*(p2 - p1)))
+    samples = min(max(int(length / SPLINE_STEP) + 2, 2), 64)
+    return catmull_rom(p0, p1, p2, p3, samples)
+
+
+def segment_widths(stroke, index, samples):
+    # widths along segment_curve(stroke.points, index), going linearly from
+    # one point's width to the next. None for fixed width strokes.
+    if not stroke.variable:
+        return None
+    widths = stroke.widths
+    return np.linspace(float(widths[index - 1]), float(widths[index]), samples)
+
+
+def stroke_outline(curve, widths):
+    # closed (M, 2) float outline of a curve drawn with a width per sample
+    # and round ends: the left side forward, the end cap, the right side
+    # back and the start cap. Points are complex numbers x + iy in here.
+    points = curve[:, 0] + 1j * curve[:, 1]
+    radius = widths / 2
+    steps = np.diff(points)
+    lengths = np.abs(steps)
+    moving = lengths > 1e-6
+    if not moving.all():
+        # repeated samples have no direction
+        keep = np.concatenate(([True], moving))
+        points, radius, steps, lengths = points[keep], radius[keep], steps[moving], lengths[moving]
+    if len(points) < 2:
+        # a dot
+        outline = points[0] + radius[0] * _CIRCLE
+        return np.stack((outline.real, outline.imag), axis=1)
+
+    directions = steps / lengths
+    # the tangent at a sample halves the angle between the steps either side,
+    # a step straight back keeps the direction it came from
+    tangents = np.concatenate((directions[:1], directions[:-1] + directions[1:], directions[-1:]))
+    norms = np.abs(tangents)
+    flat = norms < 1e-6
+    if flat.any():
+        tangents[flat] = np.concatenate((directions, directions[-1:]))[flat]
+        norms[flat] = 1.0
+    normals = 1j * tangents / norms
+
+    # on the inside of a bend the offset is limited to the radius of
+    # curvature, past it the outline folds over itself and the even-odd
+    # fill of cv2.fillPoly would leave a hole. A positive turn bends towards
+    # the left (+normal) side.
+    left = radius
+    right = radius
+    if len(points) > 2:
+        turn = np.angle(directions[1:] / directions[:-1])
+        limit = np.full(len(points), np.inf)
+        limit[1:-1] = (lengths[:-1] + lengths[1:]) / (2 * np.maximum(np.abs(turn), 1e-12))
+        bend = np.concatenate(([0.0], turn, [0.0]))
+        left = np.where(bend > 0, np.minimum(radius, limit), radius)
+        right = np.where(bend < 0, np.minimum(radius, limit), radius)
+
+    end_cap = points[-1] + radius[-1] * normals[-1] * _CAP
+    start_cap = points[0] - radius[0] * normals[0] * _CAP
+    outline = np.concatenate((points + normals * left, end_cap, (points - normals * right)[::-1], start_cap))
+    return np.stack((outline.real, outline.imag), axis=1)
+
+
+def ink_colour(image, stroke):
+    # a layer (BGRA) gets full alpha where ink goes and none where the eraser
+    # goes, a BGR image just the colour
+    if image.shape[2] == 3:
+        return stroke.colour
+    return (*stroke.colour, 0 if stroke.tool == Tools.ERASER.value else 255)
+
+
+def rasterise(image, curve, stroke, origin=(0, 0), widths=None):
+    # a whole curve in a single draw call, origin is the canvas position of
+    # image[0, 0] when drawing into a tile. Live drawing and replay both go
+    # through here so a replayed session is pixel identical. With widths the
+    # curve is filled as one outline polygon instead of a polyline.
+    scale = 1 << SUBPIXEL_SHIFT
+    if widths is not None:
+        fixed = np.round((stroke_outline(curve, widths) - origin) * scale).astype(np.int32)
+        cv2.fillPoly(image, [fixed], ink_colour(image, stroke), cv2.LINE_AA, SUBPIXEL_SHIFT)
+        return
+    fixed = np.round((curve - origin) * scale).astype(np.int32)
+    # the eraser has hard edges so it removes ink completely
+    line_type = cv2.LINE_8 if stroke.tool == Tools.ERASER.value else cv2.LINE_AA
+    cv2.polylines(image, [fixed], False, ink_colour(image, stroke), stroke.thickness, line_type, SUBPIXEL_SHIFT)
+
+
+def curve_bounds(curve, thickness):
+    # (x0, y0, x1, y1) covering a thick polyline, padded for the round caps
+    pad = int(np.ceil(thickness)) // 2 + 2
+    (min_x, min_y), (max_x, max_y) = curve.min(axis=0), curve.max(axis=0)
+    return (
+        int(np.floor(min_x)) - pad,
+        int(np.floor(min_y)) - pad,
+        int(np.ceil(max_x)) + pad + 1,
+        int(np.ceil(max_y)) + pad + 1,
+    )
+
+
+def rasterise_shape(image, stroke, origin=(0, 0)):
+    # a line, rectangle or ellipse from the stroke's two points
+    (x0, y0), (x1, y1) = ((stroke.points[:2] - origin) * (1 << SUBPIXEL_SHIFT)).tolist()
+    colour = ink_colour(image, stroke)
+    if stroke.tool == Tools.LINE.value:
+        cv2.line(image, (x0, y0), (x1, y1), colour, stroke.thickness, cv2.LINE_AA, SUBPIXEL_SHIFT)
+    elif stroke.tool == Tools.RECTANGLE.value:
+        cv2.rectangle(image, (x0, y0), (x1, y1), colour, stroke.thickness, cv2.LINE_AA, SUBPIXEL_SHIFT)
+    else:
+        # the ellipse inscribed in the rectangle of the two points
+        centre = ((x0 + x1) // 2, (y0 + y1) // 2)
+        axes = (abs(x1 - x0) // 2, abs(y1 - y0) // 2)
+        cv2.ellipse(image, centre, axes, 0, 0, 360, colour, stroke.thickness, cv2.LINE_AA, SUBPIXEL_SHIFT)
+
+
+def render_stroke(image, stroke, origin=(0, 0)):
+    # a whole stroke at once, for previews. Freehand strokes are drawn
+    # through their points without the curve smoothing.
+    if stroke.tool in SHAPE_TOOL_VALUES:
+        rasterise_shape(image, stroke, origin)
+    else:
+        rasterise(image, stroke.points, stroke, origin, stroke.widths)
+
+
+def snap_shape(points, tolerance):
+    # (tool, (2, 2) int32 points) of the line, rectangle or ellipse a
+    # freehand stroke was meant to be, or None when it is neither. Closed
+    # strokes are compared against the outlines of the rectangle and the
+    # ellipse filling their bounding box, open ones against a straight line.
+    points = points.astype(np.float64)
+    start, end = points[0], points[-1]
+    low, high = points.min(axis=0), points.max(axis=0)
+    size = float(max(high - low))
+    if size < 1:
+        return None
+
+    if np.hypot(*(end - start)) > 2 * tolerance * size:
+        chord = end - start
+        length = float(np.hypot(*chord))
+        offsets = points - start
+        distance = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        if distance.max() > tolerance * length:
+            return None
+        return Tools.LINE, np.array([start, end]).round().astype(np.int32)
+
+    # -1..1 across the bounding box, where both outlines are at distance 1
+    half = np.maximum((high - low) / 2, 1.0)
+    u, v = np.abs((points - (low + high) / 2) / half).T
+    errors = {
+        Tools.RECTANGLE: np.abs(np.maximum(u, v) - 1).mean(),
+        Tools.ELLIPSE: np.abs(np.hypot(u, v) - 1).mean(),
+    }
+    tool = min(errors, key=errors.get)
+    if errors[tool] > tolerance:
+        return None
+    return tool, np.array([low, high]).round().astype(np.int32)
+
+
+def render_segment(image, stroke, index):
+    # draws the segment ending at points[index], returns its curve
+    curve = segment_curve(stroke.points, index)
+    rasterise(image, curve, stroke, widths=segment_widths(stroke, index, len(curve)))
+    return curve
+
+
+def scale_stroke(stroke, scale_x, scale_y=None):
+    # the stroke on a canvas scaled by scale_x across and scale_y down,
+    # widths follow the height like the pen and eraser sizes do
+    scale_y = scale_x if scale_y is None else scale_y
+    points = np.round(stroke.points * np.array([scale_x, scale_y])).astype(np.int32)
+    thickness = max(1, int(round(stroke.thickness * scale_y)))
+    widths = None if stroke.widths is None else stroke.widths * np.float32(scale_y)
+    return Stroke(stroke.tool, stroke.colour, thickness, points, widths, layer=stroke.layer)
+
+
+def render_command(image, command, scale=1.0):
+    if command.kind == CLEAR:
+        image[:] = 0
+        return
+
+    if scale != 1.0:
+        # re-render at another resolution
+        command = scale_stroke(command, scale)
+
+    if command.tool in SHAPE_TOOL_VALUES:
+        rasterise_shape(image, command)
+        return
+    for index in range(1, command.count):
+        render_segment(image, command, index)
+
+
+class CommandLog:
+    # append-only log of strokes with undo / redo, the canvas at any position
+    # is rebuilt from the nearest raster checkpoint plus replay
+    def __init__(self, width, height, checkpoint_interval=25, max_checkpoints=4):
+        self.width = width
+        self.height = height
+        self.commands = []
+        self.position = 0
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.checkpoints = {}
+        # canvas snapshot the log starts from instead of a blank canvas, e.g.
+        # a loaded image. Not part of the saved session.
+        self.base = None
+        # (name, opacity, blend, visible) of the canvas layers the strokes
+        # refer to, bottom first, set by the canvas before saving
+        self.layers = [("ink", 1.0, "normal", True)]
+
+    def push(self, command, canvas):
+        # canvas must already have the command rendered on it
+        del self.commands[self.position:]
+        for position in [p for p in self.checkpoints if p > self.position]:
+            del self.checkpoints[position]
+
+        self.commands.append(command)
+        self.position += 1
+
+        if self.position % self.checkpoint_interval == 0:
+            self.checkpoints[self.position] = canvas.snapshot()
+            if len(self.checkpoints) > self.max_checkpoints:
+                del self.checkpoints[min(self.checkpoints)]
+
+    @property
+    def can_undo(self):
+        return self.position > 0
+
+    @property
+    def can_redo(self):
+        return self.position < len(self.commands)
+
+    def undo(self, canvas):
+        if not self.can_undo:
+            return False
+        self.position -= 1
+        self.rebuild(canvas)
+        return True
+
+    def redo(self, canvas):
+        if not self.can_redo:
+            return False
+        canvas.render(self.commands[self.position])
+        self.position += 1
+        return True
+
+    def rebuild(self, canvas):
+        # canvas is anything with snapshot / restore / render, i.e. a
+        # DrawingCanvas or one of its storage backends
+        base = max((p for p in self.checkpoints if p <= self.position), default=0)
+        # nothing before the last clear can show up, skip replaying it
+        for index in range(self.position - 1, base - 1, -1):
+            if self.commands[index].kind == CLEAR:
+                base = index
+                break
+
+        canvas.restore(self.checkpoints.get(base, self.base if base == 0 else None))
+        for command in self.commands[base:self.position]:
+            canvas.render(command)
+
+    def resized(self, width, height):
+        # the same strokes on a canvas of another size, e.g. a session drawn
+        # at another camera resolution. Checkpoints are left behind.
+        log = CommandLog(width, height, self.checkpoint_interval, self.max_checkpoints)
+        scale_x, scale_y = width / self.width, height / self.height
+        log.commands = [
+            command if command.kind == CLEAR else scale_stroke(command, scale_x, scale_y)
+            for command in self.commands
+        ]
+        log.position = self.position
+        log.layers = list(self.layers)
+        return log
+
+    def render(self, scale=1.0):
+        # every stroke on its own layer, flattened over black like the canvas
+        height, width = int(round(self.height * scale)), int(round(self.width * scale))
+        commands = self.commands[:self.position]
+        count = max([len(self.layers)] + [command.layer + 1 for command in commands if command.kind == STROKE])
+        images = np.zeros((count, height, width, 4), dtype=np.uint8)
+        for command in commands:
+            if command.kind == CLEAR:
+                images[:] = 0
+            else:
+                render_command(images[command.layer], command, scale)
+        settings = self.layers + [(None, 1.0, "normal", True)] * (count - len(self.layers))
+        return flatten_image([(image, opacity, blend, visible) for image, (_, opacity, blend, visible) in zip(images, settings)])
+
+    def save(self, path):
+        commands = self.commands[:self.position]
+        table = np.zeros(len(commands), dtype=COMMAND_DTYPE)
+        start = 0
+        for row, command in zip(table, commands):
+            row["kind"] = command.kind
+            if command.kind == STROKE:
+                row["tool"] = command.tool
+                row["colour"] = command.colour
+                row["thickness"] = command.thickness
+                row["start"] = start
+                row["count"] = command.count
+                row["variable"] = command.variable
+                row["layer"] = command.layer
+                start += command.count
+
+        layers = np.zeros(len(self.layers), dtype=LAYER_DTYPE)
+        for row, (name, opacity, blend, visible) in zip(layers, self.layers):
+            row["name"] = name.encode()[:LAYER_DTYPE["name"].itemsize]
+            row["opacity"] = opacity
+            row["blend"] = BLEND_MODES.index(blend)
+            row["visible"] = visible
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header[0] = (SESSION_MAGIC, SESSION_VERSION, self.width, self.height, len(commands), start, len(layers))
+
+        # written next to the file and moved over it, the strokes of a loaded
+        # session are still views of the file being replaced
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(header.tobytes())
+            f.write(table.tobytes())
+            f.write(layers.tobytes())
+            for command in commands:
+                if command.kind == STROKE:
+                    f.write(np.ascontiguousarray(command.points, dtype="<i4").tobytes())
+            # then a width for every point, fixed width strokes repeat their
+            # thickness so the widths line up with the points
+            for command in commands:
+                if command.kind == STROKE:
+                    widths = command.widths if command.variable else np.full(command.count, command.thickness)
+                    f.write(np.ascontiguousarray(widths, dtype="<f4").tobytes())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        # memory-mapped, stroke points are views into the file
+        data = np.memmap(path, mode="r", dtype=np.uint8)
+        version = int(data[4:6].view("<u2")[0]) if len(data) >= 6 else None
+        if data[:4].tobytes() != SESSION_MAGIC or version not in SESSION_DTYPES:
+            raise ValueError(f"{path} is not an AirCanvas session file")
+        header_dtype, command_dtype = SESSION_DTYPES[version]
+        header = data[:header_dtype.itemsize].view(header_dtype)[0]
+
+        offset = header_dtype.itemsize
+        table_end = offset + int(header["commands"]) * command_dtype.itemsize
+        table = data[offset:table_end].view(command_dtype)
+        layers = None
+        if "layers" in header_dtype.names:
+            layers_end = table_end + int(header["layers"]) * LAYER_DTYPE.itemsize
+            layers = data[table_end:layers_end].view(LAYER_DTYPE)
+            table_end = layers_end
+        points_end = table_end + int(header["points"]) * 8
+        points = data[table_end:points_end].view("<i4").reshape(-1, 2)
+        widths = None
+        if "variable" in command_dtype.names:
+            widths = data[points_end:points_end + int(header["points"]) * 4].view("<f4")
+
+        log = cls(int(header["width"]), int(header["height"]), **kwargs)
+        if layers is not None:
+            log.layers = [
+                (row["name"].decode(errors="ignore"), float(row["opacity"]), BLEND_MODES[row["blend"]], bool(row["visible"]))
+                for row in layers
+            ]
+        has_layers = "layer" in command_dtype.names
+        for row in table:
+            if row["kind"] == CLEAR:
+                log.commands.append(ClearCommand())
+                continue
+            start, count = int(row["start"]), int(row["count"])
+            stroke_widths = widths[start:start + count] if widths is not None and row["variable"] else None
+            log.commands.append(Stroke(
+                int(row["tool"]), row["colour"], int(row["thickness"]), points[start:start + count], stroke_widths,
+                layer=int(row["layer"]) if has_layers else 0,
+            ))
+        log.position = len(log.commands)
+        return log
@@ -0,0 +1,228 @@
+import cv2
+import numpy as np
+from config import TILE_SIZE
+from compositor import ink_mask
+from drawing import DrawingCanvas
+from strokes import Stroke
+
+
+class TiledCanvas(DrawingCanvas):
+    # canvas over an unbounded workspace, stored as fixed size tiles that are
+    # only allocated where there is ink. width x height is the viewport (the
+    # camera frame), which can be panned and zoomed over the workspace.
+    tiled = True
+
+    def __init__(self, width, height, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+
+        # workspace position of the viewport's top left corner, and screen
+        # pixels per workspace pixel
+        self.origin = np.zeros(2, dtype=np.float64)
+        self.zoom = 1.0
+
+        super().__init__(width, height)
+
+    # viewport
+
+    def to_canvas(self, point):
+        x, y = np.asarray(point, dtype=np.float64) / self.zoom + self.origin
+        return (int(round(x)), int(round(y)))
+
+    def to_screen_stroke(self, stroke):
+        points = np.round((stroke.points - self.origin) * self.zoom).astype(np.int32)
+        thickness = max(1, int(round(stroke.thickness * self.zoom)))
+        widths = None if stroke.widths is None else stroke.widths * np.float32(self.zoom)
+        return Stroke(stroke.tool, stroke.colour, thickness, points, widths)
+
+    def pan(self, dx, dy):
+        # move the viewport by (dx, dy) screen pixels
+        self.stop_drawing()
+        self.origin += np.array([dx, dy], dtype=np.float64) / self.zoom
+
+    def set_zoom(self, zoom, center=None):
+        # zoom around a screen point, the viewport centre by default
+        self.stop_drawing()
+        if center is None:
+            center = (self.width / 2, self.height / 2)
+        anchor = np.asarray(center, dtype=np.float64) / self.zoom + self.origin
+        self.zoom = float(np.clip(zoom, 0.125, 8.0))
+        self.origin = anchor - np.asarray(center, dtype=np.float64) / self.zoom
+
+    def reset_view(self):
+        self.stop_drawing()
+        self.origin[:] = 0
+        self.zoom = 1.0
+
+    def pen_width(self, pen):
+        width = super().pen_width(pen)
+        return None if width is None else width / self.zoom
+
+    def _new_stroke(self, pen, point):
+        # thickness is set in screen pixels, strokes store workspace pixels
+        stroke = super()._new_stroke(pen, point)
+        stroke.thickness = max(1, int(round(stroke.thickness / self.zoom)))
+        return stroke
+
+    # storage
+
+    def _create_storage(self):
+        # (tx, ty) -> (tile_size, tile_size, 3) image and its ink mask, the
+        # dense buffers of DrawingCanvas are never allocated
+        self.tiles = {}
+        self.tile_masks = {}
+        # tiles a frozen snapshot still shares, copied before they change
+        self.shared_tiles = set()
+        self.canvas = None
+        self.mask = None
+        self.dirty_rects = []
+        # a single layer, see _single_layer
+        self.active_layer = 0
+
+    def _tile_range(self, bounds):
+        x0, y0, x1, y1 = bounds
+        ts = self.tile_size
+        return range(x0 // ts, -(-x1 // ts)), range(y0 // ts, -(-y1 // ts))
+
+    def _single_layer(self, *args, **kwargs):
+        raise ValueError("The tiled canvas has a single layer, layers need CANVAS_BACKEND = \"dense\"")
+
+    add_layer = select_layer = set_layer = _single_layer
+
+    def paint(self, bounds, draw, erase=False, layer=None):
+        # render into one scratch region covering the bounds and scatter it
+        # back, so strokes rasterise exactly as on a dense canvas instead of
+        # being clipped differently at every tile edge
+        self.version += 1
+        x0, y0, x1, y1 = bounds
+        region = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        xs, ys = self._tile_range(bounds)
+        ts = self.tile_size
+        overlaps = []
+        for ty in ys:
+            for tx in xs:
+                # overlap of tile (tx, ty) and the region, in canvas coordinates
+                ox0, oy0 = max(tx * ts, x0), max(ty * ts, y0)
+                ox1, oy1 = min((tx + 1) * ts, x1), min((ty + 1) * ts, y1)
+                tile_view = (slice(oy0 - ty * ts, oy1 - ty * ts), slice(ox0 - tx * ts, ox1 - tx * ts))
+                region_view = (slice(oy0 - y0, oy1 - y0), slice(ox0 - x0, ox1 - x0))
+                tile = self.tiles.get((tx, ty))
+                if tile is not None:
+                    region[region_view] = tile[tile_view]
+                overlaps.append(((tx, ty), tile_view, region_view))
+
+        draw(region, (x0, y0))
+
+        for key, tile_view, region_view in overlaps:
+            tile = self.tiles.get(key)
+            if tile is None:
+                # tiles are only allocated on first ink
+                if erase or not region[region_view].any():
+                    continue
+                tile = self.tiles[key] = np.zeros((ts, ts, 3), dtype=np.uint8)
+            elif key in self.shared_tiles:
+                tile = self.tiles[key] = tile.copy()
+                self.shared_tiles.discard(key)
+
+            tile[tile_view] = region[region_view]
+            mask = ink_mask(tile)
+            if not mask.any():
+                del self.tiles[key]
+                self.tile_masks.pop(key, None)
+            else:
+                self.tile_masks[key] = mask
+
+    def _clear_pixels(self):
+        # O(allocated tiles), nothing is reallocated
+        self.version += 1
+        self.tiles.clear()
+        self.tile_masks.clear()
+        self.shared_tiles.clear()
+
+    def freeze(self):
+        # the tiles and view as they are now. Tiles are shared with the
+        # snapshot until they are next painted on, then copied.
+        self.shared_tiles = set(self.tiles)
+        return dict(self.tiles), dict(self.tile_masks), self.origin.copy(), self.zoom
+
+    def thaw(self, frozen):
+        pass
+
+    def frozen_image(self, frozen, background=None):
+        # the viewport as it looked when frozen, over a BGR background or black
+        if background is None:
+            background = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        return self.composite(background, frozen)
+
+    def restore_image(self, image):
+        # placed at the viewport's top left corner at zoom 1
+        x0, y0 = np.round(self.origin).astype(int)
+        height, width = image.shape[:2]
+        self._clear_pixels()
+        self.paint((x0, y0, x0 + width, y0 + height), lambda region, origin: np.copyto(region, image))
+
+    def snapshot(self):
+        # checkpoints cost memory in proportion to the ink, not the workspace
+        return {key: tile.copy() for key, tile in self.tiles.items()}
+
+    def restore(self, snapshot):
+        self._clear_pixels()
+        if snapshot:
+            for key, tile in snapshot.items():
+                self.tiles[key] = tile.copy()
+                self.tile_masks[key] = ink_mask(tile)
+
+    @property
+    def allocated_bytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    # compositing
+
+    def _view(self):
+        # (tiles, masks, origin, zoom), the same shape as a frozen snapshot
+        return self.tiles, self.tile_masks, self.origin, self.zoom
+
+    def visible_tiles(self, view=None):
+        # tile keys that intersect the viewport
+        tiles, _, origin, zoom = view or self._view()
+        x0, y0 = np.floor(origin).astype(int)
+        x1 = int(np.ceil(origin[0] + self.width / zoom))
+        y1 = int(np.ceil(origin[1] + self.height / zoom))
+        xs, ys = self._tile_range((x0, y0, x1, y1))
+        if len(xs) * len(ys) > len(tiles):
+            return [key for key in tiles if key[0] in xs and key[1] in ys]
+        return [(tx, ty) for ty in ys for tx in xs if (tx, ty) in tiles]
+
+    def _screen_rect(self, tx, ty, origin, zoom):
+        # screen rectangle of a tile, computed from both edges so neighbouring
+        # tiles meet without gaps at fractional zoom levels
+        ts = self.tile_size
+        sx0, sy0 = np.round((np.array([tx * ts, ty * ts]) - origin) * zoom).astype(int)
+        sx1, sy1 = np.round((np.array([(tx + 1) * ts, (ty + 1) * ts]) - origin) * zoom).astype(int)
+        return sx0, sy0, sx1, sy1
+
+    def composite(self, frame, view=None):
+        # view is a frozen snapshot to draw instead of the live tiles
+        view = view or self._view()
+        tiles, masks, origin, zoom = view
+        for key in self.visible_tiles(view):
+            tile, mask = tiles[key], masks[key]
+            sx0, sy0, sx1, sy1 = self._screen_rect(*key, origin, zoom)
+            if sx1 <= sx0 or sy1 <= sy0:
+                continue
+            if (sx1 - sx0, sy1 - sy0) != (self.tile_size, self.tile_size):
+                tile = cv2.resize(tile, (sx1 - sx0, sy1 - sy0), interpolation=cv2.INTER_LINEAR)
+                mask = cv2.resize(mask, (sx1 - sx0, sy1 - sy0), interpolation=cv2.INTER_NEAREST)
+
+            # clip the tile against the frame
+            cx0, cy0 = max(sx0, 0), max(sy0, 0)
+            cx1, cy1 = min(sx1, self.width), min(sy1, self.height)
+            if cx1 <= cx0 or cy1 <= cy0:
+                continue
+            region = (slice(cy0 - sy0, cy1 - sy0), slice(cx0 - sx0, cx1 - sx0))
+            cv2.copyTo(tile[region], mask[region], frame[cy0:cy1, cx0:cx1])
+        return frame
+
+    def to_image(self):
+        # the viewport rendered on black
+        image = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        return self.composite(image)
@@ -0,0 +1,112 @@
+import numpy as np
+from config import MAX_HANDS
+from hand_tracker import HandTracker
+from profiling import profiler
+from landmarks import UNKNOWN_HAND
+
+
+# version 1 traces have no handedness
+TRACE_VERSION = 2
+# labels are optional, the gesture every hand in a frame is showing as an
+# index into gesture_model.GESTURES, or this
+UNLABELLED = -1
+
+
+class TraceRecorder:
+    # records the tracker's landmark array every frame so a session can be
+    # replayed later without a camera or mediapipe
+    def __init__(self, width, height, max_hands=MAX_HANDS):
+        self.width = width
+        self.height = height
+        self.max_hands = max_hands
+        self.frames = []
+        self.handedness = []
+        self.timestamps = []
+        self.labels = []
+        self.start = None
+
+    def add(self, landmarks, timestamp, handedness=None, label=UNLABELLED):
+        if self.start is None:
+            self.start = timestamp
+
+        # missing hands are stored as NaN so every frame has the same shape
+        padded = np.full((self.max_hands, 21, 3), np.nan, dtype=np.float32)
+        padded_handedness = np.full(self.max_hands, UNKNOWN_HAND, dtype=np.int8)
+        if landmarks is not None:
+            if landmarks.ndim == 2:
+                landmarks = landmarks[None]
+            hands = min(len(landmarks), self.max_hands)
+            padded[:hands] = landmarks[:hands]
+            if handedness is not None:
+                padded_handedness[:hands] = handedness[:hands]
+        self.frames.append(padded)
+        self.handedness.append(padded_handedness)
+        self.timestamps.append(timestamp - self.start)
+        self.labels.append(label)
+
+    def save(self, path):
+        # labels are only written when there are any
+        labelled = any(label != UNLABELLED for label in self.labels)
+        np.savez_compressed(
+            path,
+            **({"labels": np.array(self.labels, dtype=np.int8)} if labelled else {}),
+            version=TRACE_VERSION,
+            width=self.width,
+            height=self.height,
+            landmarks=np.stack(self.frames) if self.frames else np.empty((0, self.max_hands, 21, 3), np.float32),
+            handedness=np.stack(self.handedness) if self.handedness else np.empty((0, self.max_hands), np.int8),
+            timestamps=np.array(self.timestamps, dtype=np.float64),
+        )
+        print(f"Recorded {len(self.frames)} frames to {path}")
+
+
+class LandmarkTrace:
+    def __init__(self, path):
+        with np.load(path) as data:
+            version = int(data["version"])
+            if version not in (1, TRACE_VERSION):
+                raise ValueError(f"{path} has unsupported trace version {version}")
+            self.width = int(data["width"])
+            self.height = int(data["height"])
+            self.landmarks = data["landmarks"]
+            self.timestamps = data["timestamps"]
+            if version >= 2:
+                self.handedness = data["handedness"]
+            else:
+                self.handedness = np.full(self.landmarks.shape[:2], UNKNOWN_HAND, dtype=np.int8)
+            self.labels = data["labels"] if "labels" in data.files else None
+
+        # hands that were seen in each frame
+        self.present = ~np.isnan(self.landmarks[..., 0, 0])
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def frame(self, index):
+        # (landmarks, handedness) of the hands seen in a frame
+        present = self.present[index]
+        return self.landmarks[index][present], self.handedness[index][present]
+
+
+class TraceTracker(HandTracker):
+    # a HandTracker that plays back a recorded trace instead of running
+    # mediapipe, everything downstream of find_hands behaves the same
+    def __init__(self, trace):
+        self.trace = trace
+        self.index = 0
+        super().__init__(roi_tracking=False)
+
+    def _create_model(self):
+        pass
+
+    def find_hands(self, frame, draw=True, timestamp=None):
+        # the recorded timestamps keep smoothing deterministic
+        self.timestamp = float(self.trace.timestamps[self.index])
+        with profiler.time("landmarks"):
+            self.landmarks, self.handedness = self.trace.frame(self.index)
+            height, width = frame.shape[:2]
+            self._assign_ids(width, height)
+        self.index += 1
+        if draw:
+            self._draw_hands(frame)
+        return frame
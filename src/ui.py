@@ -1,8 +1,73 @@
 import cv2
+import numpy as np
 from colours import Colours
 
 
+class OverlayPanel:
+    # one cached piece of the UI overlay: a colour image and an alpha mask
+    # covering only its bounding box, redrawn when its state key changes
+    def __init__(self, render):
+        # render(key) -> (x, y, colour, alpha) or None for nothing to show
+        self.render = render
+        self.key = None
+        self.built = False
+        self.layer = None
+
+    def update(self, key):
+        if self.built and key == self.key:
+            return
+        self.key = key
+        self.built = True
+        self.layer = self.render(key)
+        if self.layer is not None:
+            x, y, colour, alpha = self.layer
+            if not np.any((alpha > 0) & (alpha < 255)):
+                # fully opaque, a masked copy is enough
+                self.layer = (x, y, colour, alpha, None)
+            else:
+                # premultiplied colour and inverse alpha, so blending is two
+                # saturating uint8 passes: frame * (1 - alpha) + colour * alpha
+                alpha = cv2.merge([alpha, alpha, alpha])
+                premultiplied = cv2.multiply(colour, alpha, scale=1 / 255)
+                self.layer = (x, y, premultiplied, None, 255 - alpha)
+
+    def blend(self, frame):
+        if self.layer is None:
+            return
+        x, y, colour, mask, inverse_alpha = self.layer
+        height, width = frame.shape[:2]
+        # clip to the frame
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + colour.shape[1], width), min(y + colour.shape[0], height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        region = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+        target = frame[y0:y1, x0:x1]
+        if mask is not None:
+            cv2.copyTo(colour[region], mask[region], target)
+        else:
+            cv2.add(cv2.multiply(target, inverse_alpha[region], scale=1 / 255), colour[region], dst=target)
+
+
+def new_layer(width, height):
+    return np.zeros((height, width, 3), dtype=np.uint8), np.zeros((height, width), dtype=np.uint8)
+
+
+def draw_on_layer(colour, alpha, bgr, draw):
+    # draw(image, value) draws a shape on a single channel image. The
+    # coverage goes into alpha so anti-aliased edges blend with whatever
+    # is underneath, like drawing straight onto the frame does.
+    coverage = np.zeros_like(alpha)
+    draw(coverage, 255)
+    colour[coverage > 0] = bgr
+    np.maximum(alpha, coverage, out=alpha)
+
+
 class UIManager:
+    # the palette, colour swatch, status lines, notices and the profiling
+    # HUD are drawn once into cached panels and only blended onto each frame
+    HIT_CELL = 16  # px per hit-test grid cell
+
     def __init__(self, width, height):
         self.width = width
         self.height = height
@@ -25,6 +90,27 @@ class UIManager:
             )
             y_pos += self.box_size + self.margin
 
+        # hit-test index, grid cell -> names of the boxes touching it
+        self.hit_grid = {}
+        self._index_targets(self.colour_boxes)
+
+        self.status = ()
+        self.notice = None
+        self.hud = None
+        self.palette_panel = OverlayPanel(self._render_palette)
+        self.header_panel = OverlayPanel(self._render_header)
+        self.status_panel = OverlayPanel(self._render_status)
+        self.notice_panel = OverlayPanel(self._render_notice)
+        self.hud_panel = OverlayPanel(self._render_hud)
+        self.panels = (self.palette_panel, self.header_panel, self.status_panel, self.notice_panel, self.hud_panel)
+
+    def _index_targets(self, targets):
+        cell = self.HIT_CELL
+        for name, (x, y, w, h) in targets.items():
+            for cy in range(y // cell, (y + h) // cell + 1):
+                for cx in range(x // cell, (x + w) // cell + 1):
+                    self.hit_grid.setdefault((cx, cy), []).append(name)
+
     def draw_box(self, frame, colour_name, x, y, w, h):
         cv2.rectangle(frame, (x, y), (x + w, y + h), Colours[colour_name].value, -1)
 
@@ -43,27 +129,116 @@ class UIManager:
             False,
         )
 
-    def draw_selected_colour(self, frame, box):
-        (x, y, w, h) = box
-        cv2.rectangle(frame, (x - 3, y - 3), (x + w + 3, y + h + 3), (255, 255, 255), 2)
+    def _text_layer(self, lines, x, y, line_height, font_scale=1, color=(255, 255, 255), thickness=2):
+        # lines of text with their baselines line_height apart, the first
+        # one at (x, y), as a layer sized to fit
+        if not lines:
+            return None
+        # padded for the stroke width and anti-aliasing
+        pad = thickness + 1
+        sizes = [cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness) for text in lines]
+        ascent = max(h for (_, h), _ in sizes) + pad
+        descent = max(baseline for _, baseline in sizes) + pad
+        top = y - ascent
+        width = max(w for (w, _), _ in sizes) + 2 * pad
+        height = ascent + descent + line_height * (len(lines) - 1)
+
+        colour, alpha = new_layer(width, height)
+        for row, text in enumerate(lines):
+            origin = (pad, ascent + row * line_height)
+            draw_on_layer(colour, alpha, color, lambda image, value: cv2.putText(
+                image, text, origin, cv2.FONT_HERSHEY_SIMPLEX, font_scale, value, thickness, cv2.LINE_AA, False
+            ))
+        return x - pad, top, colour, alpha
+
+    def _render_palette(self, selected_colour):
+        x0 = min(x for x, _, _, _ in self.colour_boxes.values()) - 4
+        y0 = min(y for _, y, _, _ in self.colour_boxes.values()) - 4
+        x1 = max(x + w for x, _, w, _ in self.colour_boxes.values()) + 5
+        y1 = max(y + h for _, y, _, h in self.colour_boxes.values()) + 5
+        colour, alpha = new_layer(x1 - x0, y1 - y0)
 
-    def draw(self, frame, last_audio_command: str):
         # Draw colour boxes
         for colour_name, (x, y, w, h) in self.colour_boxes.items():
-            self.draw_box(frame, colour_name, x, y, w, h)
+            draw_on_layer(colour, alpha, Colours[colour_name].value, lambda image, value: cv2.rectangle(
+                image, (x - x0, y - y0), (x + w - x0, y + h - y0), value, -1
+            ))
 
-        self.draw_selected_colour(frame, self.colour_boxes[self.selected_colour])
+        # outline around the selected colour
+        x, y, w, h = self.colour_boxes[selected_colour]
+        draw_on_layer(colour, alpha, (255, 255, 255), lambda image, value: cv2.rectangle(
+            image, (x - 3 - x0, y - 3 - y0), (x + w + 3 - x0, y + h + 3 - y0), value, 2
+        ))
+        return x0, y0, colour, alpha
 
-        # Draw current colour indicator
-        cv2.rectangle(
-            frame, (10, 10), (50, 50), Colours[self.selected_colour].value, -1
-        )
-        cv2.rectangle(frame, (10, 10), (50, 50), (255, 255, 255), 2)
-        self.draw_text(frame, f"Last audio command: {last_audio_command}", x=60, y=40)
+    def _render_header(self, key):
+        selected_colour, last_audio_command = key
+        text = self._text_layer([f"Last audio command: {last_audio_command}"], 60, 40, 0)
+        tx, ty, text_colour, text_alpha = text
+
+        # current colour indicator at (10, 10) - (50, 50), and the text
+        x0, y0 = min(8, tx), min(8, ty)
+        x1 = max(53, tx + text_colour.shape[1])
+        y1 = max(53, ty + text_colour.shape[0])
+        colour, alpha = new_layer(x1 - x0, y1 - y0)
+        draw_on_layer(colour, alpha, Colours[selected_colour].value, lambda image, value: cv2.rectangle(
+            image, (10 - x0, 10 - y0), (50 - x0, 50 - y0), value, -1
+        ))
+        draw_on_layer(colour, alpha, (255, 255, 255), lambda image, value: cv2.rectangle(
+            image, (10 - x0, 10 - y0), (50 - x0, 50 - y0), value, 2
+        ))
+
+        region = (slice(ty - y0, ty - y0 + text_colour.shape[0]), slice(tx - x0, tx - x0 + text_colour.shape[1]))
+        covered = text_alpha > 0
+        colour[region][covered] = text_colour[covered]
+        np.maximum(alpha[region], text_alpha, out=alpha[region])
+        return x0, y0, colour, alpha
+
+    def _render_status(self, lines):
+        # first line at the bottom, the rest stacked above it
+        lines = list(reversed(lines))
+        return self._text_layer(lines, 10, self.height - 30 - 30 * (len(lines) - 1), 30, 0.6)
+
+    def _render_notice(self, text):
+        if not text:
+            return None
+        return self._text_layer([text], self.width // 2 - 15, self.height // 2, 0)
+
+    def _render_hud(self, lines):
+        # top-left, under the colour swatch
+        if not lines:
+            return None
+        return self._text_layer(lines, 10, 90, 20, 0.45, (0, 255, 255), 1)
+
+    def set_status(self, lines):
+        # status lines shown bottom-left, one per hand
+        self.status = tuple(lines)
+
+    def set_notice(self, text):
+        # text shown in the middle of the frame, None hides it
+        self.notice = text
+
+    def set_hud(self, lines):
+        # profiling lines shown top-left, None hides them
+        self.hud = tuple(lines) if lines else None
+
+    def draw(self, frame, last_audio_command: str):
+        # panels are only re-rendered when what they show has changed
+        self.palette_panel.update(self.selected_colour)
+        self.header_panel.update((self.selected_colour, last_audio_command))
+        self.status_panel.update(self.status)
+        self.notice_panel.update(self.notice)
+        self.hud_panel.update(self.hud)
+
+        for panel in self.panels:
+            panel.blend(frame)
 
     def handle_selection(self, point):
-        for colour_name, (x, y, w, h) in self.colour_boxes.items():
-            if (x <= point[0] <= x + w) and (y <= point[1] <= y + h):
+        # only the boxes in the point's grid cell are checked
+        x, y = point
+        for colour_name in self.hit_grid.get((x // self.HIT_CELL, y // self.HIT_CELL), ()):
+            bx, by, w, h = self.colour_boxes[colour_name]
+            if (bx <= x <= bx + w) and (by <= y <= by + h):
                 self.selected_colour = colour_name
                 return True, colour_name
         return False, None
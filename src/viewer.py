@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import threading
+import time
+import cv2
+import numpy as np
+from config import *
+from broadcast import ACK, KEYFRAME, MESSAGE_HEADER, BroadcastServer, CanvasMirror, read_message
+
+
+class BroadcastViewer:
+    # rebuilds a broadcast canvas (see broadcast.BroadcastServer) and keeps
+    # count of what it cost: bytes received and the lag from the change on the
+    # sender to it being applied here
+    def __init__(self, delay=0.0):
+        self.mirror = None
+        self.seq = 0
+        self.messages = 0
+        self.keyframes = 0
+        self.bytes = 0
+        self.lags = []
+        self.started = None
+        self.delay = delay  # seconds slept per message, to act as a slow viewer
+        self.caught_up = threading.Condition()
+
+    async def watch(self, host, port, duration=None, on_message=None):
+        reader, writer = await asyncio.open_connection(host, port)
+        self.started = time.perf_counter()
+        try:
+            while duration is None or time.perf_counter() - self.started < duration:
+                try:
+                    header, tiles, raw = await read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                self.apply(header, tiles, raw)
+                if on_message and on_message(self) is False:
+                    break
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(np.array(header["seq"], ACK).tobytes())
+        finally:
+            writer.close()
+
+    def apply(self, header, tiles, raw):
+        width, height, tile_size = int(header["width"]), int(header["height"]), int(header["tile_size"])
+        if header["kind"] == KEYFRAME or self.mirror is None:
+            self.mirror = CanvasMirror(width, height, tile_size)
+            self.keyframes += 1
+        self.mirror.unpack(tiles, raw)
+        self.lags.append(time.time() - float(header["timestamp"]))
+        self.messages += 1
+        self.bytes += MESSAGE_HEADER.itemsize + 4 * len(tiles) + int(header["size"])
+        with self.caught_up:
+            self.seq = int(header["seq"])
+            self.caught_up.notify_all()
+
+    def wait_for(self, seq, timeout=5.0):
+        with self.caught_up:
+            return self.caught_up.wait_for(lambda: self.seq >= seq, timeout)
+
+    def report(self, name="viewer"):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        if not self.messages:
+            return f"{name:>8}: nothing received"
+        lags = np.array(self.lags) * 1000
+        return (
+            f"{name:>8}: {self.messages} messages ({self.keyframes} keyframes), "
+            f"{self.bytes / 1024:.1f} kB, {self.bytes / 1024 / elapsed:.1f} kB/s, "
+            f"lag p50 {np.percentile(lags, 50):.1f} ms, p95 {np.percentile(lags, 95):.1f} ms, "
+            f"max {lags.max():.1f} ms"
+        )
+
+
+def scribble(canvas, rng, frames, fps):
+    # random pinch strokes with a layer change now and then, one point per
+    # frame, paced like a live session
+    width, height = canvas.width, canvas.height
+    point = np.array([width / 2, height / 2])
+    velocity = np.zeros(2)
+    for frame in range(frames):
+        if frame % 90 == 0:
+            canvas.stop_drawing()
+            if frame % 360 == 180:
+                if len(canvas.layers) < MAX_LAYERS:
+                    canvas.add_layer()
+                else:
+                    canvas.select_layer(0)
+            canvas.set_colour(rng.choice(["RED", "GREEN", "BLUE", "YELLOW", "WHITE"]))
+            canvas.start_drawing(tuple(point.astype(int)), pressure=rng.random())
+        else:
+            velocity = 0.85 * velocity + rng.normal(0, 6, 2)
+            point = np.clip(point + velocity, 0, (width - 1, height - 1))
+            canvas.draw(tuple(point.astype(int)), pressure=rng.random())
+        yield frame / fps
+    canvas.stop_drawing()
+
+
+def check(size, seconds, fps, viewers, slow):
+    # draws into a canvas with a server on a free port and viewers on their
+    # own loop, then checks each viewer ended up with exactly the sender's
+    # tiles and reports bandwidth and lag
+    from compositor import Compositor
+    from drawing import DrawingCanvas
+
+    canvas = DrawingCanvas(*size)
+    compositor = Compositor(canvas)
+    server = BroadcastServer(compositor, host="127.0.0.1", port=0)
+    host, port = server.address
+    clients = [BroadcastViewer(slow / 1000 if i == viewers - 1 and slow else 0.0) for i in range(viewers)]
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    watching = [asyncio.run_coroutine_threadsafe(client.watch(host, port), loop) for client in clients]
+    while len(server.viewers) < viewers:
+        time.sleep(0.01)
+
+    frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    started = time.perf_counter()
+    tick_times = []
+    for at in scribble(canvas, np.random.default_rng(0), int(seconds * fps), fps):
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        compositor.blend(frame)
+        tick_start = time.perf_counter()
+        server.tick()
+        tick_times.append(time.perf_counter() - tick_start)
+    # the last changes go out whatever the rate limit
+    compositor.blend(frame)
+    server.last_tick = None
+    server.tick()
+    elapsed = time.perf_counter() - started
+
+    raw_rate = size[0] * size[1] * 3 * fps / 1024
+    print(f"{size[0]}x{size[1]} at {fps} fps for {elapsed:.1f} s, {server.seq} deltas, "
+          f"raw frames would be {raw_rate:.0f} kB/s")
+    tick_times = np.array(tick_times) * 1000
+    print(f"    tick: mean {tick_times.mean():.3f} ms, p95 {np.percentile(tick_times, 95):.3f} ms on the render loop")
+    exact = True
+    for i, client in enumerate(clients):
+        name = "slow" if client.delay else f"viewer {i}"
+        if not client.wait_for(server.seq, timeout=10 + seconds):
+            print(f"{name:>8}: did not catch up, at {client.seq} of {server.seq}")
+            exact = False
+            continue
+        same = (
+            np.array_equal(client.mirror.colour, compositor.colour)
+            and np.array_equal(client.mirror.inverse_alpha, compositor.inverse_alpha)
+        )
+        exact = exact and same
+        print(client.report(name) + (", pixel exact" if same else ", MISMATCH"))
+
+    server.close()
+    for future in watching:
+        future.result(timeout=5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    return exact
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a canvas broadcast by main.py --broadcast")
+    parser.add_argument("address", nargs="?", default=f"{BROADCAST_HOST}:{BROADCAST_PORT}", help="HOST:PORT of the broadcast")
+    parser.add_argument("--seconds", type=float, default=None, help="stop watching after this long")
+    parser.add_argument("--no-window", action="store_true", help="only print the statistics")
+    parser.add_argument("--check", action="store_true", help="broadcast scribbles locally and check the viewers rebuild them exactly")
+    parser.add_argument("--size", default="1920x1080", help="canvas size for --check as WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=int, default=60, help="frame rate of the --check scribbles")
+    parser.add_argument("--viewers", type=int, default=2, help="number of --check viewers")
+    parser.add_argument("--slow", type=float, default=50.0, help="ms the last --check viewer sleeps per message, 0 for none")
+    args = parser.parse_args()
+
+    if args.check:
+        size = tuple(int(v) for v in args.size.split("x"))
+        exact = check(size, args.seconds or 5.0, args.fps, args.viewers, args.slow)
+        raise SystemExit(0 if exact else 1)
+
+    host, port = args.address.rsplit(":", 1)
+    viewer = BroadcastViewer()
+
+    def show(viewer):
+        if args.no_window:
+            return True
+        cv2.imshow("AirCanvas viewer", viewer.mirror.image())
+        return cv2.waitKey(1) & 0xFF != ord("q")
+
+    try:
+        asyncio.run(viewer.watch(host, int(port), args.seconds, show))
+    except KeyboardInterrupt:
+        pass
+    except ConnectionError as e:
+        print(f"Could not watch {args.address}: {e}")
+    print(viewer.report())
+    cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import argparse
+import json
+import queue
+import re
+import threading
+import time
+import wave
+import numpy as np
+from config import *
+from colours import Colours
+from strokes import Tools
+from logging_utils import get_logger
+
+logger = get_logger("voice")
+
+
+# spoken word -> (command, argument)
+COMMAND_WORDS = {
+    "clear": ("clear", None),
+    "exit": ("exit", None),
+    "undo": ("undo", None),
+    "redo": ("redo", None),
+    "save": ("save", None),
+    "load": ("load", None),
+    **{colour.name.lower(): ("colour", colour.name) for colour in Colours},
+    # what the draw gesture draws
+    "pen": ("tool", Tools.PEN.name),
+    "line": ("tool", Tools.LINE.name),
+    "rectangle": ("tool", Tools.RECTANGLE.name),
+    "circle": ("tool", Tools.ELLIPSE.name),
+    "ellipse": ("tool", Tools.ELLIPSE.name),
+    "shape": ("tool", Tools.SNAP.name),
+}
+
+
+class VoiceCommand:
+    __slots__ = ("name", "argument", "text", "spoken_at")
+
+    def __init__(self, name, argument, text, spoken_at):
+        self.name = name
+        self.argument = argument
+        self.text = text
+        # perf_counter time the utterance ended, for latency measurements
+        self.spoken_at = spoken_at
+
+
+def parse_commands(text, spoken_at=None):
+    # every command word in the text, in the order spoken. Whole words only,
+    # so "redo" is never mistaken for "red".
+    spoken_at = time.perf_counter() if spoken_at is None else spoken_at
+    return [
+        VoiceCommand(*COMMAND_WORDS[word], text, spoken_at)
+        for word in re.findall(r"[a-z]+", text.lower())
+        if word in COMMAND_WORDS
+    ]
+
+
+# audio sources, each yields chunks of 16-bit mono PCM as bytes
+
+
+class MicrophoneSource:
+    def __init__(self, sample_rate=VOICE_SAMPLE_RATE, chunk_ms=30):
+        # imported here so the rest of the app runs without pyaudio
+        import pyaudio
+
+        self.sample_rate = sample_rate
+        self.chunk = sample_rate * chunk_ms // 1000
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=sample_rate,
+            input=True,
+            frames_per_buffer=self.chunk,
+        )
+
+    def chunks(self):
+        while True:
+            # audio that piles up while a phrase is being recognised is
+            # dropped instead of raising
+            yield self.stream.read(self.chunk, exception_on_overflow=False)
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio.terminate()
+
+
+class WavFileSource:
+    # plays a 16-bit mono .wav file, in real time by default so latencies
+    # match a live microphone
+    def __init__(self, path, chunk_ms=30, realtime=True):
+        self.wav = wave.open(path, "rb")
+        if self.wav.getsampwidth() != 2 or self.wav.getnchannels() != 1:
+            raise ValueError(f"{path} must be 16-bit mono")
+        self.sample_rate = self.wav.getframerate()
+        self.chunk = self.sample_rate * chunk_ms // 1000
+        self.realtime = realtime
+
+    def chunks(self):
+        start = time.perf_counter()
+        played = 0
+        while True:
+            data = self.wav.readframes(self.chunk)
+            if not data:
+                # trailing silence so the last utterance gets closed
+                data = bytes(2 * self.chunk)
+                if played > self.wav.getnframes() + 2 * self.sample_rate:
+                    return
+            played += self.chunk
+            if self.realtime:
+                time.sleep(max(start + played / self.sample_rate - time.perf_counter(), 0))
+            yield data
+
+    def close(self):
+        self.wav.close()
+
+
+class EnergyVAD:
+    # voice activity detection on the RMS of each chunk against a running
+    # estimate of the noise floor, a few numpy ops per chunk so listening
+    # to silence costs next to nothing. Only whole utterances go on to the
+    # (expensive) recogniser.
+    def __init__(self, sample_rate, threshold=VOICE_VAD_THRESHOLD, hangover=VOICE_VAD_HANGOVER,
+                 min_speech=0.15, max_speech=5.0, preroll=0.2):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.hangover = hangover
+        self.min_speech = min_speech
+        self.max_speech = max_speech
+        self.preroll = preroll
+
+        self.noise_floor = None
+        self.chunks = []
+        self.recent = []  # chunks before speech starts, so the onset is not cut off
+        self.samples = 0
+        self.speech_samples = 0
+        self.silence = 0.0
+        self.last_voiced = None
+
+    def process(self, chunk, timestamp):
+        # returns (pcm, end of speech time) once an utterance is complete
+        samples = np.frombuffer(chunk, dtype=np.int16)
+        duration = len(samples) / self.sample_rate
+        rms = float(np.sqrt(np.mean(samples.astype(np.float32) ** 2))) if len(samples) else 0.0
+
+        if self.noise_floor is None:
+            self.noise_floor = rms
+        # never below a small absolute level, digital silence is not a floor
+        voiced = rms > max(self.noise_floor, 50.0) * self.threshold
+
+        if not self.chunks:
+            if not voiced:
+                self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+                self.recent.append(chunk)
+                if len(self.recent) * duration > self.preroll:
+                    self.recent.pop(0)
+                return None
+            self.chunks = self.recent
+            self.recent = []
+            self.samples = sum(len(c) for c in self.chunks) // 2
+            self.speech_samples = 0
+            self.silence = 0.0
+
+        self.chunks.append(chunk)
+        self.samples += len(samples)
+        if voiced:
+            self.speech_samples += len(samples)
+            self.silence = 0.0
+            self.last_voiced = timestamp
+        else:
+            self.silence += duration
+
+        if self.silence < self.hangover and self.samples / self.sample_rate < self.max_speech:
+            return None
+
+        pcm = b"".join(self.chunks)
+        self.chunks = []
+        if self.speech_samples / self.sample_rate < self.min_speech:
+            # a click or a bump, not speech
+            return None
+        return pcm, self.last_voiced
+
+
+# recognisers turn one utterance of 16-bit mono PCM into text
+
+
+class VoskRecogniser:
+    # offline, limited to the command words which makes it fast and accurate
+    def __init__(self, model_path=VOICE_MODEL, sample_rate=VOICE_SAMPLE_RATE):
+        # imported here so voice commands are optional
+        import vosk
+
+        vosk.SetLogLevel(-1)
+        self.model = vosk.Model(model_path)
+        self.sample_rate = sample_rate
+        self.grammar = json.dumps(sorted(COMMAND_WORDS) + ["[unk]"])
+        self.vosk = vosk
+
+    def recognise(self, pcm, sample_rate):
+        recogniser = self.vosk.KaldiRecognizer(self.model, sample_rate, self.grammar)
+        recogniser.AcceptWaveform(pcm)
+        return json.loads(recogniser.FinalResult()).get("text", "")
+
+
+class GoogleRecogniser:
+    # online, the original backend, needs a network connection
+    def __init__(self):
+        import speech_recognition as sr
+
+        self.sr = sr
+        self.recogniser = sr.Recognizer()
+
+    def recognise(self, pcm, sample_rate):
+        try:
+            return self.recogniser.recognize_google(self.sr.AudioData(pcm, sample_rate, 2), language="en-US")
+        except self.sr.UnknownValueError:
+            return ""
+
+
+class ScriptedRecogniser:
+    # returns the given phrases in order, one per utterance, for testing the
+    # rest of the chain without a speech model
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+
+    def recognise(self, pcm, sample_rate):
+        return self.phrases.pop(0) if self.phrases else ""
+
+
+def create_recogniser(backend=VOICE_BACKEND):
+    if backend == "vosk":
+        return VoskRecogniser()
+    if backend == "google":
+        return GoogleRecogniser()
+    raise ValueError(f"Unknown voice backend {backend!r}")
+
+
+class VoiceEngine:
+    # listens and recognises on its own thread. Commands go through a
+    # thread-safe queue that the render loop drains without ever blocking.
+    def __init__(self, source, recogniser, vad=None):
+        self.source = source
+        self.recogniser = recogniser
+        self.vad = vad or EnergyVAD(source.sample_rate)
+        self.commands = queue.Queue()
+        # set while an utterance is being recognised
+        self.busy = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="voice", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+        self.source.close()
+
+    @property
+    def finished(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def poll(self):
+        # every command recognised since the last call, never blocks
+        commands = []
+        while True:
+            try:
+                commands.append(self.commands.get_nowait())
+            except queue.Empty:
+                return commands
+
+    def _run(self):
+        for chunk in self.source.chunks():
+            if not self.running:
+                break
+            utterance = self.vad.process(chunk, time.perf_counter())
+            if utterance:
+                self._recognise(*utterance)
+
+    def _recognise(self, pcm, spoken_at):
+        self.busy.set()
+        try:
+            text = self.recogniser.recognise(pcm, self.source.sample_rate)
+        except Exception as e:
+            logger.warning("Voice recognition failed: %s", e)
+            return
+        finally:
+            self.busy.clear()
+
+        commands = parse_commands(text, spoken_at)
+        logger.info("Heard %r, commands: %s", text, [c.name for c in commands])
+        for command in commands:
+            self.commands.put(command)
+
+
+def create_voice_engine():
+    # None when voice commands are disabled or cannot start
+    if not VOICE_BACKEND:
+        return None
+    try:
+        source = WavFileSource(VOICE_SOURCE) if VOICE_SOURCE else MicrophoneSource()
+        engine = VoiceEngine(source, create_recogniser())
+    except Exception as e:
+        # missing optional dependency, model or microphone
+        print(f"Voice commands disabled: {e}")
+        return None
+    engine.start()
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the voice command engine on a .wav file and report latencies")
+    parser.add_argument("wav", help="16-bit mono .wav file")
+    parser.add_argument("--backend", default=VOICE_BACKEND, help="vosk or google")
+    parser.add_argument("--script", nargs="*", help="skip recognition and return these phrases, one per utterance")
+    parser.add_argument("--fast", action="store_true", help="read the file as fast as possible instead of in real time")
+    args = parser.parse_args()
+
+    source = WavFileSource(args.wav, realtime=not args.fast)
+    recogniser = ScriptedRecogniser(args.script) if args.script is not None else create_recogniser(args.backend)
+    engine = VoiceEngine(source, recogniser)
+    engine.start()
+
+    latencies = []
+    while not engine.finished or not engine.commands.empty():
+        for command in engine.poll():
+            latency = time.perf_counter() - command.spoken_at
+            latencies.append(latency)
+            print(f"{command.name:>8} {command.argument or '':<8} {1000 * latency:8.1f} ms  ({command.text!r})")
+        time.sleep(0.005)
+    engine.stop()
+
+    if latencies:
+        latencies = np.array(latencies) * 1000
+        print(f"{len(latencies)} commands, end of speech -> command mean {latencies.mean():.1f} ms, max {latencies.max():.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import numpy as np
+from filters import OneEuroFilter, OneEuroFilterBank
+from strokes import SPLINE_STEP, segment_curve
+
+
+def test_one_euro_smooths_jitter_and_follows_motion():
+    rng = np.random.default_rng(0)
+    times = np.arange(120) / 30
+    noise = rng.normal(0, 2.0, len(times))
+
+    still = OneEuroFilter(min_cutoff=1.0, beta=0.0)
+    smoothed = np.array([still(100 + n, t) for n, t in zip(noise, times)])
+    assert smoothed[30:].std() < noise[30:].std() / 2
+
+    # with beta, fast motion is followed with less lag than without
+    moving = 100 + 600 * times
+    lag = []
+    for beta in (0.0, 0.1):
+        euro = OneEuroFilter(min_cutoff=1.0, beta=beta)
+        lag.append(np.abs(np.array([euro(x, t) for x, t in zip(moving, times)]) - moving)[-1])
+    assert lag[1] < lag[0] / 4
+
+
+def test_one_euro_first_sample_and_repeated_timestamp():
+    euro = OneEuroFilter()
+    assert euro(5.0, 0.0) == 5.0
+    first = euro(7.0, 0.1)
+    assert euro(50.0, 0.1) == first
+
+
+def test_filter_bank_matches_single_filters():
+    rng = np.random.default_rng(1)
+    bank = OneEuroFilterBank(min_cutoff=1.0, beta=0.5)
+    single = {key: OneEuroFilter(min_cutoff=1.0, beta=0.5) for key in (3, 7)}
+    for step in range(20):
+        t = step / 30
+        # hand 7 joins late, hand 3 skips a frame
+        keys = [3, 7] if step >= 5 and step != 12 else [3] if step != 12 else [7]
+        x = rng.normal(0, 10, (len(keys), 2))
+        out = bank(keys, x, t)
+        for row, key in enumerate(keys):
+            np.testing.assert_allclose(out[row], single[key](x[row], t))
+
+    bank.retain([7])
+    assert list(bank.state) == [7]
+
+
+def test_segment_curve_passes_through_points():
+    points = np.array([[0, 0], [40, 10], [80, 60], [90, 120]], dtype=np.int32)
+    previous_end = None
+    for index in range(1, len(points)):
+        curve = segment_curve(points, index)
+        np.testing.assert_allclose(curve[0], points[index - 1])
+        np.testing.assert_allclose(curve[-1], points[index])
+        if previous_end is not None:
+            np.testing.assert_allclose(curve[0], previous_end)
+        previous_end = curve[-1]
+        # sampled about every SPLINE_STEP px along the segment
+        length = np.hypot(*(points[index] - points[index - 1]))
+        assert len(curve) >= length / SPLINE_STEP
+
+    # collinear points stay on the line
+    line = np.array([[0, 0], [10, 10], [20, 20], [30, 30]], dtype=np.int32)
+    curve = segment_curve(line, 2)
+    np.testing.assert_allclose(curve[:, 0], curve[:, 1])
@@ -0,0 +1,114 @@
+import numpy as np
+from drawing import DrawingCanvas
+from strokes import CLEAR, SESSION_DTYPES, SESSION_MAGIC, CommandLog, Tools
+
+
+def draw(canvas, points, pressure=None):
+    canvas.start_drawing(points[0], pressure=pressure)
+    for point in points[1:]:
+        canvas.draw(point, pressure=pressure)
+    canvas.stop_drawing()
+
+
+def sample_canvas():
+    canvas = DrawingCanvas(320, 240)
+    canvas.set_colour("RED")
+    draw(canvas, [(10, 10), (80, 40), (150, 30), (200, 120)])
+    draw(canvas, [(20, 200), (60, 150), (120, 180)], pressure=0.8)
+    canvas.clear()
+    draw(canvas, [(30, 30), (90, 90), (160, 60)])
+    canvas.add_layer("highlighter", 0.5, "multiply")
+    canvas.set_colour("YELLOW")
+    canvas.set_tool(Tools.RECTANGLE)
+    draw(canvas, [(40, 40), (180, 160)])
+    canvas.set_tool(Tools.ERASER)
+    draw(canvas, [(50, 50), (70, 70)])
+    return canvas
+
+
+def test_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "session.acv")
+    canvas = sample_canvas()
+    canvas.save(path)
+
+    loaded = DrawingCanvas(320, 240)
+    loaded.load(path)
+    assert loaded.history.position == canvas.history.position
+    assert [layer.state()[1:] for layer in loaded.layers] == [layer.state()[1:] for layer in canvas.layers]
+    for saved, restored in zip(canvas.history.commands, loaded.history.commands):
+        assert saved.kind == restored.kind
+        if saved.kind != CLEAR:
+            assert (saved.tool, saved.thickness, saved.layer) == (restored.tool, restored.thickness, restored.layer)
+            np.testing.assert_array_equal(saved.points, restored.points)
+            assert tuple(saved.colour) == tuple(restored.colour)
+    np.testing.assert_array_equal(loaded.to_image(), canvas.to_image())
+
+
+def test_load_then_save_same_path(tmp_path):
+    # the loaded strokes are views of the file that is saved over
+    path = str(tmp_path / "session.acv")
+    sample_canvas().save(path)
+    canvas = DrawingCanvas(320, 240)
+    canvas.load(path)
+    expected = canvas.to_image()
+    canvas.save(path)
+    canvas.undo()
+    canvas.redo()
+    canvas.save(path)
+
+    loaded = DrawingCanvas(320, 240)
+    loaded.load(path)
+    np.testing.assert_array_equal(loaded.to_image(), expected)
+
+
+def test_render_matches_canvas():
+    canvas = sample_canvas()
+    np.testing.assert_array_equal(canvas.history.render(), canvas.to_image())
+    assert canvas.history.render(2.0).shape == (480, 640, 3)
+
+
+def test_load_older_versions(tmp_path):
+    # versions 1 and 2 share a layout: header, command table, then points
+    points = [np.array([[10, 10], [60, 80], [120, 40]]), np.array([[200, 200], [250, 150]])]
+    for version in (1, 2):
+        header_dtype, command_dtype = SESSION_DTYPES[version]
+        header = np.zeros(1, dtype=header_dtype)
+        header[0] = (SESSION_MAGIC, version, 320, 240, len(points) + 1, sum(map(len, points)))
+        table = np.zeros(len(points) + 1, dtype=command_dtype)
+        table[0]["kind"] = CLEAR
+        start = 0
+        for row, stroke in zip(table[1:], points):
+            row["tool"] = Tools.PEN.value
+            row["colour"] = (0, 0, 255)
+            row["thickness"] = 5
+            row["start"] = start
+            row["count"] = len(stroke)
+            start += len(stroke)
+        path = tmp_path / f"v{version}.acv"
+        path.write_bytes(header.tobytes() + table.tobytes() + np.concatenate(points).astype("<i4").tobytes())
+
+        log = CommandLog.load(str(path))
+        assert (log.width, log.height, log.position) == (320, 240, 3)
+        assert log.commands[0].kind == CLEAR
+        np.testing.assert_array_equal(log.commands[2].points, points[1])
+        assert log.commands[1].widths is None and log.commands[1].layer == 0
+        assert log.render().any()
+
+
+def test_load_at_another_size(tmp_path):
+    # strokes are scaled to the canvas they are loaded into
+    path = str(tmp_path / "session.acv")
+    canvas = sample_canvas()
+    canvas.save(path)
+
+    loaded = DrawingCanvas(640, 480)
+    loaded.load(path)
+    assert (loaded.history.width, loaded.history.height) == (640, 480)
+    np.testing.assert_array_equal(loaded.to_image(), canvas.history.render(2.0))
+
+    wide = DrawingCanvas(640, 240)
+    wide.load(path)
+    stroke = next(command for command in wide.history.commands if command.kind != CLEAR)
+    original = next(command for command in canvas.history.commands if command.kind != CLEAR)
+    np.testing.assert_array_equal(stroke.points, original.points * [2, 1])
+    assert stroke.thickness == original.thickness